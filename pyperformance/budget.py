@@ -0,0 +1,285 @@
+"""Split a time budget between benchmarks.
+
+A quick calibration run measures, for each benchmark, the cost of a worker
+process and of a value, and the variance of values within a worker process
+and between worker processes. The budget is then split to get the relative
+standard deviation of the mean of each benchmark below a target, or as close
+as possible to the target if the budget is too short.
+"""
+import math
+import statistics
+import time
+
+from pyperformance.run import run_benchmarks, get_timeout
+from pyperformance.utils import format_duration
+
+
+# Number of worker processes and values per process of the calibration run
+CALIBRATION_PROCESSES = 2
+CALIBRATION_VALUES = 2
+
+# Use at least 3 processes to benchmark 3 different (randomized) hash
+# functions, as pyperf --fast
+MIN_PROCESSES = 3
+MAX_PROCESSES = 200
+MIN_VALUES = 2
+MAX_VALUES = 20
+DEFAULT_VALUES = 3
+
+
+def _run_duration(run):
+    return run.get_metadata().get('duration', 0.0)
+
+
+class BenchmarkCost(object):
+    """Cost and variance of a pyperformance benchmark.
+
+    Estimated from a calibration run: *benchmarks* is the list of pyperf
+    benchmarks produced by the calibration run, which took *elapsed*
+    seconds.
+    """
+
+    def __init__(self, name, benchmarks, elapsed):
+        self.name = name
+        # relative variances: (between processes, within a process)
+        self.variances = []
+        # time to compute one value of each pyperf benchmark
+        self.value_time = 0.0
+        self.warmups = 0
+
+        nspawn = 1   # the master process
+        total_duration = 0.0
+        calibration_duration = 0.0
+        for bench in benchmarks:
+            runs = bench.get_runs()
+            nspawn += len(runs)
+            for run in runs:
+                total_duration += _run_duration(run)
+                if not run.values:
+                    calibration_duration += _run_duration(run)
+            self._add_bench(bench, [run for run in runs if run.values])
+
+        # Time to spawn a worker process, import modules and prepare the
+        # benchmark: the time spent outside run durations
+        self.spawn_time = max(elapsed - total_duration, 0.0) / nspawn
+        self.nbench = len(benchmarks)
+        self.fixed_time = ((1 + self.nbench) * self.spawn_time
+                           + calibration_duration)
+
+    def _add_bench(self, bench, runs):
+        if not runs:
+            return
+
+        mean = bench.mean()
+        run_means = [statistics.mean(run.values) for run in runs]
+        squares = sum(sum((value - run_mean) ** 2 for value in run.values)
+                      for run, run_mean in zip(runs, run_means))
+        dof = sum(len(run.values) - 1 for run in runs)
+        within = squares / dof if dof else 0.0
+        if len(runs) >= 2:
+            nvalue = statistics.mean(len(run.values) for run in runs)
+            between = max(statistics.variance(run_means) - within / nvalue,
+                          0.0)
+        else:
+            between = within
+        if mean:
+            self.variances.append((between / mean ** 2, within / mean ** 2))
+
+        nvalue = sum(len(run.warmups) + len(run.values) for run in runs)
+        self.value_time += sum(map(_run_duration, runs)) / nvalue
+        self.warmups = max(self.warmups,
+                           max(len(run.warmups) for run in runs))
+
+    def process_time(self, values):
+        """Time to run one worker process of each pyperf benchmark."""
+        return (self.nbench * self.spawn_time
+                + (self.warmups + values) * self.value_time)
+
+    def estimate(self, processes, values):
+        """Estimate the time to run the benchmark, in seconds."""
+        return self.fixed_time + processes * self.process_time(values)
+
+    def variance(self, values):
+        """Relative variance of the mean of one worker process.
+
+        The relative variance of the mean of P processes is variance / P.
+        Return the variance of the least stable pyperf benchmark.
+        """
+        return max((between + within / values
+                    for between, within in self.variances),
+                   default=0.0)
+
+    def best_values(self):
+        """Number of values per process minimizing the cost for a variance.
+
+        More values per process are cheaper when spawning a process is
+        expensive and values are stable within a process compared to the
+        variance between processes.
+        """
+        if not self.variances or not self.value_time:
+            return DEFAULT_VALUES
+        between, within = max(self.variances, key=sum)
+        if not within:
+            return MIN_VALUES
+        if not between:
+            return MAX_VALUES
+        values = math.sqrt(self.nbench * self.spawn_time / self.value_time
+                           * within / between)
+        return min(max(int(round(values)), MIN_VALUES), MAX_VALUES)
+
+    def needed_processes(self, values, target):
+        """Number of processes to get a relative std dev below target."""
+        processes = math.ceil(self.variance(values) / target ** 2)
+        return min(max(processes, MIN_PROCESSES), MAX_PROCESSES)
+
+
+def _share_time(free, remaining, values):
+    """Split remaining seconds between the free benchmarks.
+
+    Return a dict: benchmark name => number of processes (a float).
+    """
+    # Minimize the sum of the relative variances of the means: the optimum
+    # gives to each benchmark a number of processes proportional to
+    # sqrt(variance / process_time).
+    weights = {}
+    for cost in free:
+        process_time = cost.process_time(values[cost.name])
+        variance = cost.variance(values[cost.name])
+        weights[cost.name] = (math.sqrt(variance * process_time),
+                              math.sqrt(variance / process_time))
+    denominator = sum(weight[0] for weight in weights.values())
+
+    processes = {}
+    for cost in free:
+        if denominator:
+            nprocess = remaining * weights[cost.name][1] / denominator
+        else:
+            # All benchmarks are stable: split the time evenly
+            nprocess = (remaining / len(free)
+                        / cost.process_time(values[cost.name]))
+        processes[cost.name] = nprocess
+    return processes
+
+
+def split_budget(costs, budget, target):
+    """Split budget (in seconds) between benchmarks.
+
+    Return a dict: benchmark name => (processes, values). The estimated
+    total time is at most budget, unless the budget is too short to run
+    MIN_PROCESSES processes of each benchmark.
+    """
+    values = {cost.name: cost.best_values() for cost in costs}
+    needed = {cost.name: cost.needed_processes(values[cost.name], target)
+              for cost in costs}
+    total = sum(cost.estimate(needed[cost.name], values[cost.name])
+                for cost in costs)
+    if total <= budget:
+        return {name: (needed[name], values[name]) for name in needed}
+
+    # The budget is too short. Benchmarks getting less than MIN_PROCESSES
+    # processes get MIN_PROCESSES, and benchmarks reaching the target with
+    # less are capped: the remaining time is split again between other
+    # benchmarks.
+    available = budget - sum(cost.fixed_time for cost in costs)
+    # Worker processes which take no time don't use the budget
+    fixed = {cost.name: needed[cost.name] for cost in costs
+             if not cost.process_time(values[cost.name])}
+    processes = {}
+    while True:
+        free = [cost for cost in costs if cost.name not in fixed]
+        if not free:
+            break
+        remaining = available - sum(
+            fixed[cost.name] * cost.process_time(values[cost.name])
+            for cost in costs if cost.name in fixed)
+        processes = _share_time(free, max(remaining, 0.0), values)
+
+        # Give MIN_PROCESSES first: it reduces the time of other benchmarks.
+        # Capping benchmarks then only gives more time to other benchmarks.
+        low = [cost.name for cost in free
+               if processes[cost.name] < MIN_PROCESSES]
+        if low:
+            fixed.update((name, MIN_PROCESSES) for name in low)
+            continue
+        high = [cost.name for cost in free
+                if processes[cost.name] >= needed[cost.name]]
+        if high:
+            fixed.update((name, needed[name]) for name in high)
+            continue
+        break
+
+    sizes = {}
+    for cost in costs:
+        if cost.name in fixed:
+            nprocess = fixed[cost.name]
+        else:
+            # Round down to stay within the budget
+            nprocess = int(processes[cost.name])
+        sizes[cost.name] = (nprocess, values[cost.name])
+    return sizes
+
+
+def plan_time_budget(bench_funcs, should_run, cmd_prefix, options, cpu_sets):
+    """Run a calibration pass and split options.time_budget.
+
+    Return (sample_sizes, skipped). sample_sizes is a dict: benchmark name
+    => (processes, values), to be passed to run_benchmarks(). Benchmarks
+    which failed or timed out in the calibration run have no known cost:
+    they are not run, skipped is a list of (name, reason) tuples.
+    """
+    print("Calibration run to split the time budget of %s"
+          % format_duration(options.time_budget))
+    print()
+
+    costs = []
+
+    def checkpoint(name, benchmarks, elapsed):
+        costs.append(BenchmarkCost(name, benchmarks, elapsed))
+
+    calibration = (CALIBRATION_PROCESSES, CALIBRATION_VALUES)
+    sample_sizes = {name: calibration for name in should_run}
+    timeouts = {name: get_timeout(bench_funcs[name], options,
+                                  CALIBRATION_PROCESSES)
+                for name in should_run}
+    # calibration results are only used to plan the run
+    start = time.monotonic()
+    suite, errors = run_benchmarks(bench_funcs, should_run, cmd_prefix,
+                                   options, cpu_sets=cpu_sets,
+                                   checkpoint=checkpoint,
+                                   sample_sizes=sample_sizes,
+                                   timeouts=timeouts)
+    elapsed = time.monotonic() - start
+    skipped = [(name, 'skipped, calibration %s' % reason)
+               for name, reason in errors]
+    failed = {name for name, reason in errors}
+    costs = [cost for cost in costs if cost.name not in failed]
+
+    # Benchmarks run in parallel on each CPU set
+    budget = (options.time_budget - elapsed) * len(cpu_sets)
+    target = options.target_rsd / 100.0
+    if budget <= 0:
+        print("WARNING: the calibration run exceeded the time budget")
+        budget = 0.0
+
+    for name, reason in skipped:
+        print("WARNING: Benchmark %s is not run: %s" % (name, reason))
+    sizes = split_budget(costs, budget, target)
+    estimates = {}
+    print("Time budget plan (target: %.1f%% relative std dev):"
+          % options.target_rsd)
+    for cost in sorted(costs, key=lambda cost: cost.name):
+        processes, values = sizes[cost.name]
+        estimate = cost.estimate(processes, values)
+        estimates[cost.name] = estimate
+        rsd = math.sqrt(cost.variance(values) / processes) * 100
+        print("- %s: %s processes x %s values, ~%s (%.1f%% rel std dev)"
+              % (cost.name, processes, values,
+                 format_duration(estimate), rsd))
+
+    print("Estimated time: %s"
+          % format_duration(sum(estimates.values()) / len(cpu_sets)))
+    if sum(estimates.values()) > budget:
+        print("WARNING: the time budget is too short to run %s processes "
+              "of each benchmark" % MIN_PROCESSES)
+    print()
+    return (sizes, skipped)
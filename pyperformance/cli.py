@@ -1,8 +1,9 @@
 import argparse
 import os.path
+import signal
 import sys
 
-from pyperformance.venv import exec_in_virtualenv, cmd_venv
+from pyperformance.utils import parse_cpu_sets, parse_duration
 
 
 def comma_separated(values):
@@ -20,6 +21,37 @@ def filter_opts(cmd):
                            " Otherwise we run only the positive arguments."))
 
 
+def manifest_opts(cmd):
+    cmd.add_argument("--manifest", metavar="FILENAME", action="append",
+                     default=[],
+                     help=("Load additional benchmarks from a manifest "
+                           "file. Option can be used multiple times."))
+
+
+def stats_opts(cmd, default, help):
+    methods = ('t-test', 'welch', 'mann-whitney', 'bootstrap',
+               'bootstrap-median')
+    cmd.add_argument("--stats", metavar="METHOD", choices=methods,
+                     default=default, help=help % ', '.join(methods))
+
+
+def duration(text):
+    try:
+        return parse_duration(text)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def percent(text):
+    try:
+        value = float(text.strip().rstrip('%'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid percent: %r" % text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("percent must be > 0: %r" % text)
+    return value
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description=("Compares the performance of baseline_python with"
@@ -39,14 +71,59 @@ def parse_args():
                      help="Get rough answers quickly")
     cmd.add_argument("--debug-single-value", action="store_true",
                      help="Debug: fastest mode, only compute a single value")
+    cmd.add_argument("--processes", metavar="N", type=int, default=None,
+                     help="Number of worker processes per benchmark")
+    cmd.add_argument("--values", metavar="N", type=int, default=None,
+                     help="Number of values per worker process")
+    cmd.add_argument("--time-budget", metavar="DURATION",
+                     type=duration, default=None,
+                     help=("Split a time budget (ex: 30m, 1h30m) between "
+                           "benchmarks: a short calibration run measures "
+                           "the cost and the stability of each benchmark, "
+                           "and the budget is spent where it reduces the "
+                           "uncertainty the most"))
+    cmd.add_argument("--target-rsd", metavar="PERCENT", type=float,
+                     default=None,
+                     help=("With --time-budget, relative standard deviation "
+                           "of the mean to reach (default: 1%%)"))
+    cmd.add_argument("--adaptive-ci", metavar="PERCENT", type=float,
+                     default=None,
+                     help=("Spawn worker processes until the 95%% "
+                           "confidence interval of the mean is within "
+                           "+-PERCENT of the mean, up to --processes (or "
+                           "the pyperf default) processes"))
+    cmd.add_argument("--warm-workers", action="store_true",
+                     help=("Load each benchmark script once and fork "
+                           "worker processes from it, to not import "
+                           "benchmark dependencies in each worker process"))
+    cmd.add_argument("--timeout", metavar="DURATION", type=duration,
+                     default=None,
+                     help=("Kill a benchmark if it doesn't complete in "
+                           "DURATION (ex: 10m), 0 means no timeout "
+                           "(default: per-benchmark timeout)"))
     cmd.add_argument("-v", "--verbose", action="store_true",
                      help="Print more output")
     cmd.add_argument("-m", "--track-memory", action="store_true",
                      help="Track memory usage. This only works on Linux.")
+    cmd.add_argument("--hw-counters", action="store_true",
+                     help=("Count instructions, cycles, branch misses and "
+                           "cache misses of each worker process with Linux "
+                           "perf events. Worker processes are forked as "
+                           "with --warm-workers."))
     cmd.add_argument("--affinity", metavar="CPU_LIST", default=None,
                      help=("Specify CPU affinity for benchmark runs. This "
                            "way, benchmarks can be forced to run on a given "
                            "CPU to minimize run to run variation."))
+    cmd.add_argument("-j", "--jobs", metavar="N", type=int, default=None,
+                     help=("Run up to N benchmarks in parallel, each one "
+                           "on its own CPU set. CPU sets are taken from "
+                           "--cpu-sets, or computed by splitting the "
+                           "--affinity CPUs into N sets."))
+    cmd.add_argument("--cpu-sets", metavar="CPU_SETS", default=None,
+                     help=("Comma-separated list of CPU sets used to run "
+                           "benchmarks in parallel, one benchmark per "
+                           "CPU set (ex: 2-3,4-5,6-7). Each benchmark "
+                           "process is pinned to its CPU set."))
     cmd.add_argument("-o", "--output", metavar="FILENAME",
                      help="Run the benchmarks on only one interpreter and "
                            "write benchmark into FILENAME. "
@@ -54,11 +131,59 @@ def parse_args():
     cmd.add_argument("--append", metavar="FILENAME",
                      help="Add runs to an existing file, or create it "
                      "if it doesn't exist")
+    cmd.add_argument("--resume", action="store_true",
+                     help=("Complete an interrupted run: keep benchmarks "
+                           "already written into the --output file and "
+                           "only run missing benchmarks"))
     filter_opts(cmd)
+    manifest_opts(cmd)
+
+    # profile
+    cmd = subparsers.add_parser(
+        'profile', help='Profile benchmarks on the running python')
+    cmds.append(cmd)
+    cmd.add_argument("--sampler", action="store_true",
+                     help=("Use a low-overhead stack sampler instead of "
+                           "cProfile, and write collapsed stacks for "
+                           "flamegraphs"))
+    cmd.add_argument("--interval", metavar="SECONDS", type=float,
+                     default=0.001,
+                     help=("Sampling interval in seconds of CPU time "
+                           "(default: 0.001)"))
+    cmd.add_argument("--values", metavar="N", type=int, default=10,
+                     help=("Number of values computed by the profiled "
+                           "worker process (default: 10)"))
+    cmd.add_argument("--timeout", metavar="DURATION", type=duration,
+                     default=None,
+                     help=("Stop profiling a benchmark if it doesn't "
+                           "complete in DURATION (ex: 10m), 0 means no "
+                           "timeout (default: per-benchmark timeout)"))
+    cmd.add_argument("-o", "--output-dir", metavar="DIR",
+                     default="profiles",
+                     help=("Directory where profiles are written "
+                           "(default: profiles)"))
+    cmd.add_argument("-v", "--verbose", action="store_true",
+                     help="Print more output")
+    filter_opts(cmd)
+    manifest_opts(cmd)
+
+    # profile_diff
+    cmd = subparsers.add_parser(
+        'profile_diff', help='Compare profiles function by function')
+    cmd.add_argument("-n", "--limit", metavar="N", type=int, default=20,
+                     help=("Number of functions displayed per profile "
+                           "(default: 20)"))
+    cmd.add_argument("base", metavar="BASE",
+                     help=".pstats file or directory written by profile")
+    cmd.add_argument("changed", metavar="CHANGED",
+                     help=".pstats file or directory written by profile")
 
     # show
     cmd = subparsers.add_parser('show', help='Display a benchmark file')
     cmd.add_argument("filename", metavar="FILENAME")
+    stats_opts(cmd, None,
+               "Display the 95%% confidence interval computed by METHOD: "
+               "%s")
 
     # compare
     cmd = subparsers.add_parser('compare', help='Compare two benchmark files')
@@ -71,24 +196,51 @@ def parse_args():
                      help=("What style the benchmark output should take."
                            " Valid options are 'normal' and 'table'."
                            " Default is normal."))
+    stats_opts(cmd, 't-test',
+               "Statistics method used to check if a change is "
+               "significant: %s (default: t-test)")
     cmd.add_argument("--csv", metavar="CSV_FILE",
                      action="store", default=None,
                      help=("Name of a file the results will be written to,"
                            " as a three-column CSV file containing minimum"
                            " runtimes for each benchmark."))
+    manifest_opts(cmd)
+    cmd.add_argument("baseline_filename", metavar="baseline_file.json")
+    cmd.add_argument("changed_filenames", metavar="changed_file.json",
+                     nargs='+',
+                     help=("With multiple changed files, display a single "
+                           "table with geometric means per benchmark "
+                           "group"))
+
+    # report
+    cmd = subparsers.add_parser(
+        'report', help='Write a report comparing two benchmark files')
+    cmd.add_argument("--html", metavar="FILENAME", required=True,
+                     help=("Write a single HTML file with tables and "
+                           "charts into FILENAME"))
+    stats_opts(cmd, 't-test',
+               "Statistics method used to check if a change is "
+               "significant: %s (default: t-test)")
+    manifest_opts(cmd)
     cmd.add_argument("baseline_filename", metavar="baseline_file.json")
     cmd.add_argument("changed_filename", metavar="changed_file.json")
+    cmd.add_argument("history_filenames", metavar="history_file.json",
+                     nargs='*',
+                     help=("Results of other revisions: draw the history "
+                           "of each benchmark, ordered by commit date"))
 
     # list
     cmd = subparsers.add_parser(
         'list', help='List benchmarks of the running Python')
     cmds.append(cmd)
     filter_opts(cmd)
+    manifest_opts(cmd)
 
     # list_groups
     cmd = subparsers.add_parser(
         'list_groups', help='List benchmark groups of the running Python')
     cmds.append(cmd)
+    manifest_opts(cmd)
 
     # compile
     cmd = subparsers.add_parser(
@@ -107,6 +259,45 @@ def parse_args():
     cmd.add_argument('-T', '--no-tune', action="store_true",
                      help="Don't run 'pyperf system tune' "
                           "to tune the system for benchmarks")
+    cmd.add_argument('--stage', choices=('all', 'build', 'bench'),
+                     default='all',
+                     help="build: only compile Python and create the "
+                          "virtual environment; bench: only run benchmarks "
+                          "on Python compiled by the build stage "
+                          "(default: all)")
+    cmd.add_argument('--slot', metavar='NAME',
+                     help="Use build, prefix and venv directories of the "
+                          "bench_dir/NAME directory")
+    cmd.add_argument('--no-upload', action="store_true",
+                     help="Don't upload results, even if the upload option "
+                          "of the configuration is true (used by "
+                          "compile_all which uploads results of all "
+                          "revisions at the end)")
+    cmds.append(cmd)
+
+    # bisect
+    cmd = subparsers.add_parser(
+        'bisect',
+        help='Compile and benchmark CPython to find the first revision '
+             'introducing a regression between GOOD and BAD')
+    cmd.add_argument('config_file',
+                     help='Configuration filename')
+    cmd.add_argument('good',
+                     help='Revision without the regression')
+    cmd.add_argument('bad',
+                     help='Revision with the regression')
+    cmd.add_argument("-b", "--benchmarks", required=True,
+                     help="Comma-separated list of benchmarks to run")
+    cmd.add_argument('--threshold', metavar='PERCENT', type=percent,
+                     default=5.0,
+                     help="A revision is bad if a benchmark is significantly "
+                          "slower than on GOOD by at least PERCENT "
+                          "(default: 5%%)")
+    cmd.add_argument('-U', '--no-update', action="store_true",
+                     help="Don't update the Git repository")
+    cmd.add_argument('-T', '--no-tune', action="store_true",
+                     help="Don't run 'pyperf system tune' "
+                          "to tune the system for benchmarks")
     cmds.append(cmd)
 
     # compile_all
@@ -124,10 +315,102 @@ def parse_args():
         'upload', help='Upload JSON results to a Codespeed website')
     cmd.add_argument('config_file',
                      help='Configuration filename')
-    cmd.add_argument('json_file',
-                     help='JSON filename')
+    cmd.add_argument('json_files', metavar='json_file', nargs='+',
+                     help='JSON filenames: results of all files are '
+                          'uploaded in batches')
     cmds.append(cmd)
 
+    # codespeed_server
+    cmd = subparsers.add_parser(
+        'codespeed_server',
+        help='Run a local stand-in for the Codespeed upload endpoint')
+    cmd.add_argument('--host', default='127.0.0.1',
+                     help='Listening address (default: 127.0.0.1)')
+    cmd.add_argument('--port', type=int, default=8000,
+                     help='Listening port (default: 8000)')
+    cmd.add_argument('--fail-requests', metavar='N', type=int, default=0,
+                     help='Fail the first N requests with HTTP error 503 '
+                          'to test retries')
+    cmd.add_argument('-o', '--output', metavar='FILENAME',
+                     help='Write received results into a JSON file on exit')
+
+    # db
+    cmd = subparsers.add_parser(
+        'db', help='Import results into a SQLite database and query it')
+    db_actions = cmd.add_subparsers(dest='db_action')
+    db_actions.required = True
+    db_cmds = []
+
+    db_cmd = db_actions.add_parser(
+        'import', help='Import JSON files, directories are walked '
+                       'recursively')
+    db_cmds.append(db_cmd)
+    db_cmd.add_argument('paths', metavar='PATH', nargs='+',
+                        help='JSON file or directory of JSON files')
+
+    db_cmd = db_actions.add_parser(
+        'query', help='Display the history of benchmarks, or compare two '
+                      'revisions')
+    db_cmds.append(db_cmd)
+    db_cmd.add_argument('-b', '--benchmarks', metavar='BM_LIST',
+                        type=comma_separated,
+                        help='Comma-separated list of benchmark names')
+    db_cmd.add_argument('--branch', help='Only results of this Git branch')
+    db_cmd.add_argument('--host', help='Only results of this host')
+    db_cmd.add_argument('--since', metavar='DATE',
+                        help='Only results of revisions committed after DATE '
+                             '(ex: 2020-03-26)')
+    db_cmd.add_argument('--until', metavar='DATE',
+                        help='Only results of revisions committed before '
+                             'DATE')
+    db_cmd.add_argument('--commit', dest='commits', metavar='REV',
+                        action='append',
+                        help='Only results of this commit (or commit prefix), '
+                             'option can be used multiple times')
+    db_cmd.add_argument('--limit', metavar='N', type=int,
+                        help='Only display the N most recent results')
+    db_cmd.add_argument('--compare', metavar='REV', nargs=2,
+                        help='Compare the mean of benchmarks on two commits')
+
+    # detect
+    cmd = subparsers.add_parser(
+        'detect', help='Detect the revisions where the performance of '
+                       'benchmarks changed')
+    db_cmds.append(cmd)
+    cmd.add_argument('paths', metavar='PATH', nargs='*',
+                     help='JSON files or directories of JSON files '
+                          '(default: read results from the database)')
+    cmd.add_argument('-b', '--benchmarks', metavar='BM_LIST',
+                     type=comma_separated,
+                     help='Comma-separated list of benchmark names')
+    cmd.add_argument('--branch', help='Only results of this Git branch')
+    cmd.add_argument('--host', help='Only results of this host')
+    cmd.add_argument('--since', metavar='DATE',
+                     help='Only results of revisions committed after DATE')
+    cmd.add_argument('--until', metavar='DATE',
+                     help='Only results of revisions committed before DATE')
+    cmd.add_argument('--penalty', metavar='FACTOR', type=float,
+                     default=2.0,
+                     help='Penalty of a changepoint, multiplied by the '
+                          'logarithm of the number of revisions: increase '
+                          'it to detect less changepoints (default: 2.0)')
+    cmd.add_argument('--min-size', metavar='N', type=int, default=2,
+                     help='Minimum number of revisions between two '
+                          'changepoints (default: 2)')
+    cmd.add_argument('--threshold', metavar='PERCENT', type=percent,
+                     default=1.0,
+                     help='Ignore changes smaller than PERCENT '
+                          '(default: 1%%)')
+    cmd.add_argument('--confidence', metavar='PERCENT', type=percent,
+                     default=95.0,
+                     help='Ignore changes with a lower confidence '
+                          '(default: 95%%)')
+
+    for db_cmd in db_cmds:
+        db_cmd.add_argument('--db', metavar='FILENAME',
+                            help='SQLite database (default: '
+                                 '~/.cache/pyperformance/results.db)')
+
     # venv
     cmd = subparsers.add_parser('venv',
                                 help='Actions on the virtual environment')
@@ -136,6 +419,23 @@ def parse_args():
                      default='show')
     cmds.append(cmd)
 
+    # wheelhouse
+    cmd = subparsers.add_parser(
+        'wheelhouse',
+        help='Build wheels of requirements for offline venv creation')
+    cmd.add_argument("wheelhouse_action", choices=('build',))
+    cmd.add_argument("wheelhouse_dir", metavar="DIR",
+                     help="Directory where wheels are written")
+    cmd.add_argument("-p", "--python",
+                     help=("Python executable used to build wheels "
+                           "(default: use running Python)"),
+                     default=sys.executable)
+    cmd.add_argument("--inherit-environ", metavar="VAR_LIST",
+                     type=comma_separated,
+                     help=("Comma-separated list of environment variable "
+                           "names that are inherited from the parent "
+                           "environment when running pip."))
+
     for cmd in cmds:
         cmd.add_argument("--inherit-environ", metavar="VAR_LIST",
                          type=comma_separated,
@@ -152,17 +452,90 @@ def parse_args():
                          default=sys.executable)
         cmd.add_argument("--venv",
                          help="Path to the virtual environment")
+        cmd.add_argument("--venv-store", metavar="DIR",
+                         help=("Directory of installed requirements shared "
+                               "by virtual environments of Python builds "
+                               "with the same ABI (default: "
+                               "~/.cache/pyperformance/venvs)"))
+        cmd.add_argument("--no-venv-store", action="store_true",
+                         help="Don't use the venv store")
+        cmd.add_argument("--wheelhouse", metavar="DIR",
+                         help=("Install requirements from wheels of DIR "
+                               "without using the network: see the "
+                               "wheelhouse command"))
 
     options = parser.parse_args()
 
     if options.action == 'run' and options.debug_single_value:
         options.fast = True
 
+    if options.action == 'run':
+        if options.jobs is not None and options.jobs < 1:
+            parser.error("--jobs must be >= 1")
+        if options.cpu_sets and options.affinity:
+            parser.error("--cpu-sets and --affinity are mutually exclusive")
+        if options.cpu_sets:
+            try:
+                parse_cpu_sets(options.cpu_sets)
+            except ValueError as exc:
+                parser.error("invalid --cpu-sets: %s" % exc)
+
+        sizes = options.processes or options.values
+        for opt in ('processes', 'values'):
+            value = getattr(options, opt)
+            if value is not None and value < 1:
+                parser.error("--%s must be >= 1" % opt)
+        if sizes and options.time_budget:
+            parser.error("--processes and --values are incompatible "
+                         "with --time-budget")
+        if (sizes or options.time_budget) and (options.rigorous
+                                               or options.fast):
+            parser.error("--processes, --values and --time-budget are "
+                         "incompatible with --rigorous, --fast and "
+                         "--debug-single-value")
+        if options.hw_counters and (options.adaptive_ci is not None
+                                    or options.debug_single_value):
+            parser.error("--hw-counters is incompatible with "
+                         "--adaptive-ci and --debug-single-value")
+        if options.adaptive_ci is not None:
+            if options.adaptive_ci <= 0:
+                parser.error("--adaptive-ci must be > 0")
+            if (options.time_budget or options.debug_single_value
+                    or options.warm_workers):
+                parser.error("--adaptive-ci is incompatible with "
+                             "--time-budget, --debug-single-value and "
+                             "--warm-workers")
+        if options.target_rsd is not None:
+            if not options.time_budget:
+                parser.error("--target-rsd requires --time-budget")
+            if options.target_rsd <= 0:
+                parser.error("--target-rsd must be > 0")
+        else:
+            options.target_rsd = 1.0
+
+    if options.action == 'profile':
+        if options.values < 1:
+            parser.error("--values must be >= 1")
+        if options.interval <= 0:
+            parser.error("--interval must be > 0")
+        if options.sampler and not hasattr(signal, 'setitimer'):
+            parser.error("--sampler is not supported on this platform")
+
+    if options.action == 'detect':
+        if options.min_size < 1:
+            parser.error("--min-size must be >= 1")
+        if options.penalty < 0:
+            parser.error("--penalty must be >= 0")
+
     if not options.action:
         # an action is mandatory
         parser.print_help()
         sys.exit(1)
 
+    if hasattr(options, 'manifest'):
+        options.manifest = [os.path.abspath(filename)
+                            for filename in options.manifest]
+
     if hasattr(options, 'python'):
         # Replace "~" with the user home directory
         options.python = os.path.expanduser(options.python)
@@ -177,16 +550,56 @@ def parse_args():
     return (parser, options)
 
 
+def has_pinned_pyperf():
+    """Check if the running Python has the pyperf version of requirements.txt.
+
+    If it has, commands only using pyperf give the same output than in the
+    virtual environment.
+    """
+    # Use lazy imports and importlib.metadata to not pay the cost of
+    # importing pyperf
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python 3.7 and older
+        return False
+
+    filename = os.path.join(os.path.dirname(__file__), 'requirements.txt')
+    with open(filename) as fp:
+        for line in fp:
+            req = line.partition('#')[0].strip()
+            name, _, version = req.partition('==')
+            if name.strip() == 'pyperf':
+                break
+        else:
+            return False
+    try:
+        return metadata.version('pyperf') == version.strip()
+    except metadata.PackageNotFoundError:
+        return False
+
+
 def _main():
     parser, options = parse_args()
 
+    # Commands which don't run benchmarks don't need the virtual
+    # environment: use lazy imports to start quickly
     if options.action == 'venv':
+        from pyperformance.venv import cmd_venv
         cmd_venv(options)
         sys.exit()
+    elif options.action == 'wheelhouse':
+        from pyperformance.venv import cmd_wheelhouse
+        cmd_wheelhouse(options)
+        sys.exit()
     elif options.action == 'compile':
         from pyperformance.compile import cmd_compile
         cmd_compile(options)
         sys.exit()
+    elif options.action == 'bisect':
+        from pyperformance.compile import cmd_bisect
+        cmd_bisect(options)
+        sys.exit()
     elif options.action == 'compile_all':
         from pyperformance.compile import cmd_compile_all
         cmd_compile_all(options)
@@ -195,25 +608,58 @@ def _main():
         from pyperformance.compile import cmd_upload
         cmd_upload(options)
         sys.exit()
+    elif options.action == 'codespeed_server':
+        from pyperformance.upload import cmd_codespeed_server
+        cmd_codespeed_server(options)
+        sys.exit()
+    elif options.action == 'db':
+        from pyperformance.db import cmd_db
+        cmd_db(options)
+        sys.exit()
+    elif options.action == 'detect':
+        from pyperformance.detect import cmd_detect
+        cmd_detect(options)
+        sys.exit()
+    elif options.action == 'profile_diff':
+        from pyperformance.cli_profile import cmd_profile_diff
+        cmd_profile_diff(options)
+        sys.exit()
     elif options.action == 'show':
         from pyperformance.compare import cmd_show
         cmd_show(options)
         sys.exit()
+    elif options.action == 'report':
+        from pyperformance.report import cmd_report
+        cmd_report(options)
+        sys.exit()
+    elif options.action == 'list':
+        from pyperformance.cli_list import cmd_list
+        cmd_list(options)
+        sys.exit()
+    elif options.action == 'list_groups':
+        from pyperformance.cli_list import cmd_list_groups
+        cmd_list_groups(options)
+        sys.exit()
+    elif options.action == 'compare' and (options.inside_venv
+                                          or has_pinned_pyperf()):
+        # compare only needs pyperf
+        from pyperformance.compare import cmd_compare
+        cmd_compare(options)
+        sys.exit()
 
     if not options.inside_venv:
+        from pyperformance.venv import exec_in_virtualenv
         exec_in_virtualenv(options)
 
-    from pyperformance.cli_run import cmd_run, cmd_list, cmd_list_groups
-
     if options.action == 'run':
+        from pyperformance.cli_run import cmd_run
         cmd_run(parser, options)
+    elif options.action == 'profile':
+        from pyperformance.cli_profile import cmd_profile
+        cmd_profile(options)
     elif options.action == 'compare':
         from pyperformance.compare import cmd_compare
         cmd_compare(options)
-    elif options.action == 'list':
-        cmd_list(options)
-    elif options.action == 'list_groups':
-        cmd_list_groups(options)
     else:
         parser.print_help()
         sys.exit(1)
@@ -0,0 +1,40 @@
+"""Commands listing benchmarks.
+
+They only use the standard library to not have to create the virtual
+environment.
+"""
+from pyperformance.benchmarks import get_benchmarks, select_benchmarks
+
+
+def get_benchmarks_to_run(options):
+    bench_funcs, bench_groups = get_benchmarks(options.manifest)
+    should_run = select_benchmarks(options.benchmarks, bench_groups)
+    return (bench_funcs, bench_groups, should_run)
+
+
+def cmd_list(options):
+    bench_funcs, bench_groups, all_funcs = get_benchmarks_to_run(options)
+
+    print("%r benchmarks:" % options.benchmarks)
+    for func in sorted(all_funcs):
+        print("- %s" % func)
+    print()
+    print("Total: %s benchmarks" % len(all_funcs))
+
+
+def cmd_list_groups(options):
+    bench_funcs, bench_groups = get_benchmarks(options.manifest)
+
+    funcs = set(bench_groups['all'])
+    all_funcs = set(funcs)
+
+    for group, funcs in sorted(bench_groups.items()):
+        funcs = set(funcs) & all_funcs
+        if not funcs:
+            # skip empty groups
+            continue
+
+        print("%s (%s):" % (group, len(funcs)))
+        for func in sorted(funcs):
+            print("- %s" % func)
+        print()
@@ -0,0 +1,243 @@
+"""Commands profiling benchmarks and comparing profiles.
+
+"pyperformance profile" runs each worker task of the selected benchmarks in
+a single pyperf worker process under a profiler: see
+pyperformance.profiler. The number of loops is first calibrated by a
+worker process without profiler.
+
+"pyperformance profile_diff" compares the profiles of two interpreters
+function by function.
+"""
+import copy
+import os.path
+import pstats
+import re
+import sys
+
+from pyperformance.compare import render_table
+from pyperformance.profiler import short_filename
+
+
+# Number of values computed by the profiled worker process
+VALUES = 10
+# Number of functions displayed by profile_diff
+LIMIT = 20
+
+
+def get_profile_name(name):
+    # Benchmark names can contain characters which are not portable in
+    # filenames, like "/"
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def calibrate_loops(python, bench, task, options, deadline=None):
+    """Run the worker task of a benchmark script without profiler.
+
+    Return (name, loops) where name is the pyperf benchmark name, or None
+    if the script has no such worker task.
+    """
+    # Use lazy import: pyperformance.run imports pyperf
+    import pyperf
+    from pyperformance.run import run_command, get_remaining_time
+    from pyperformance.utils import temporary_file
+
+    cmd = [python, '-u', bench.script]
+    cmd.extend(bench.args)
+    cmd.extend(('--worker', '--worker-task=%s' % task, '--calibrate-loops'))
+    with temporary_file() as tmp:
+        cmd.extend(('--output', tmp))
+        run_command(cmd, hide_stderr=not options.verbose,
+                    timeout=get_remaining_time(options, deadline))
+        if not os.path.exists(tmp):
+            # no more worker task
+            return None
+        result = pyperf.Benchmark.load(tmp)
+    loops = result.get_runs()[-1].get_metadata()['calibrate_loops']
+    return (result.get_name(), loops)
+
+
+def profile_benchmark(python, bench, options):
+    """Profile the worker tasks of a benchmark script.
+
+    Return the list of written files. Raise BenchmarkTimeout if profiling
+    all worker tasks takes longer than the timeout of the benchmark, as
+    computed by the run command for a single worker process.
+    """
+    # Use lazy import: pyperformance.run imports pyperf
+    from pyperformance.run import (run_command, get_deadline,
+                                   get_remaining_time, get_timeout)
+
+    options = copy.copy(options)
+    options.timeout = get_timeout(bench, options, processes=1)
+    deadline = get_deadline(options)
+
+    filenames = []
+    task = 0
+    while True:
+        result = calibrate_loops(python, bench, task, options, deadline)
+        if result is None:
+            break
+        name, loops = result
+
+        output = os.path.join(options.output_dir, get_profile_name(name))
+        cmd = [python, '-u', '-m', 'pyperformance.profiler']
+        if options.sampler:
+            cmd.extend(('--sampler', '--interval=%s' % options.interval))
+        cmd.extend((output, bench.script))
+        cmd.extend(bench.args)
+        cmd.extend(('--worker', '--worker-task=%s' % task,
+                    '--loops=%s' % loops, '--warmups=1',
+                    '--values=%s' % options.values))
+        run_command(cmd, hide_stderr=not options.verbose,
+                    timeout=get_remaining_time(options, deadline))
+
+        filenames.append(output + '.pstats')
+        if options.sampler:
+            filenames.append(output + '.collapsed')
+        task += 1
+    return filenames
+
+
+def cmd_profile(options):
+    # Use lazy import: pyperformance.cli_list loads the manifest
+    from pyperformance.cli_list import get_benchmarks_to_run
+    from pyperformance.run import BenchmarkTimeout
+
+    if hasattr(options, 'python'):
+        executable = options.python
+    else:
+        executable = sys.executable
+    if not os.path.isabs(executable):
+        print("ERROR: \"%s\" is not an absolute path" % executable)
+        sys.exit(1)
+
+    bench_funcs, bench_groups, should_run = get_benchmarks_to_run(options)
+    os.makedirs(options.output_dir, exist_ok=True)
+
+    errors = []
+    to_run = sorted(should_run)
+    for index, name in enumerate(to_run):
+        print("[%s/%s] %s..." % (index + 1, len(to_run), name))
+        sys.stdout.flush()
+        try:
+            filenames = profile_benchmark(executable, bench_funcs[name],
+                                          options)
+        except BenchmarkTimeout as exc:
+            print("ERROR: Benchmark %s: %s" % (name, exc))
+            errors.append(name)
+            continue
+        except RuntimeError as exc:
+            print("ERROR: Benchmark %s failed: %s" % (name, exc))
+            errors.append(name)
+            continue
+        for filename in filenames:
+            print("Profile written into %s" % filename)
+        print()
+
+    if errors:
+        print("ERROR: %s benchmarks failed: %s"
+              % (len(errors), ', '.join(errors)))
+        sys.exit(1)
+
+
+def get_function_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # built-in function
+        return name
+    # Ignore line numbers: they change between Python versions
+    return '%s:%s' % (short_filename(filename), name)
+
+
+def load_profile(filename):
+    """Load a .pstats file.
+
+    Return a dict: function name => own time in seconds. Functions are
+    identified by their short filename and name, to compare profiles of two
+    Python installations: functions with the same name in the same file
+    are merged.
+    """
+    stats = pstats.Stats(filename).stats
+    times = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        name = get_function_name(func)
+        times[name] = times.get(name, 0.0) + tt
+    return times
+
+
+def diff_profiles(times1, times2):
+    """Compare the own time of functions of two profiles.
+
+    Return a list of (name, time1, time2) tuples, sorted by decreasing
+    absolute difference. A function missing in a profile has a time of 0.
+    """
+    names = set(times1) | set(times2)
+    diff = [(name, times1.get(name, 0.0), times2.get(name, 0.0))
+            for name in names]
+    diff.sort(key=lambda item: (-abs(item[2] - item[1]), item[0]))
+    return diff
+
+
+def format_time(seconds):
+    return "%.1f ms" % (seconds * 1e3)
+
+
+def format_profile_diff(times1, times2, limit=LIMIT):
+    total1 = sum(times1.values())
+    total2 = sum(times2.values())
+    lines = []
+    if total1:
+        change = " (%+.1f%%)" % ((total2 / total1 - 1.0) * 100)
+    else:
+        change = ""
+    lines.append("Total: %s -> %s%s"
+                 % (format_time(total1), format_time(total2), change))
+
+    table = [("Function", "Base", "Changed", "Change")]
+    for name, time1, time2 in diff_profiles(times1, times2)[:limit]:
+        delta = "%+.1f ms" % ((time2 - time1) * 1e3)
+        if total1:
+            # Contribution to the change of the total time
+            delta += " (%+.1f%%)" % ((time2 - time1) / total1 * 100)
+        table.append((name, format_time(time1), format_time(time2), delta))
+    lines.append(render_table(table))
+    return '\n'.join(lines)
+
+
+def get_profile_pairs(base, changed):
+    """Get the pairs of profiles to compare.
+
+    base and changed are .pstats files, or directories written by the
+    profile command: profiles with the same filename are compared. Return
+    a list of (name, filename1, filename2) tuples.
+    """
+    if not os.path.isdir(base) or not os.path.isdir(changed):
+        return [(None, base, changed)]
+
+    names1 = {name for name in os.listdir(base) if name.endswith('.pstats')}
+    names2 = {name for name in os.listdir(changed)
+              if name.endswith('.pstats')}
+    return [(name[:-len('.pstats')], os.path.join(base, name),
+             os.path.join(changed, name))
+            for name in sorted(names1 & names2)]
+
+
+def cmd_profile_diff(options):
+    pairs = get_profile_pairs(options.base, options.changed)
+    if not pairs:
+        print("ERROR: no profile in both %s and %s"
+              % (options.base, options.changed))
+        sys.exit(1)
+
+    for index, (name, filename1, filename2) in enumerate(pairs):
+        try:
+            times1 = load_profile(filename1)
+            times2 = load_profile(filename2)
+        except (OSError, ValueError, TypeError, EOFError) as exc:
+            print("ERROR: failed to load profiles: %s" % exc)
+            sys.exit(1)
+        if index:
+            print()
+        if name is not None:
+            print("### %s ###" % name)
+        print(format_profile_diff(times1, times2, options.limit))
@@ -5,15 +5,95 @@ import sys
 import pyperf
 
 import pyperformance
-from pyperformance.benchmarks import get_benchmarks, select_benchmarks
+from pyperformance.budget import plan_time_budget
+from pyperformance.cli_list import get_benchmarks_to_run
 from pyperformance.compare import display_benchmark_suite
-from pyperformance.run import run_benchmarks
-
-
-def get_benchmarks_to_run(options):
-    bench_funcs, bench_groups = get_benchmarks()
-    should_run = select_benchmarks(options.benchmarks, bench_groups)
-    return (bench_funcs, bench_groups, should_run)
+from pyperformance.history import RuntimeHistory, get_run_mode
+from pyperformance.run import (run_benchmarks, get_cpu_sets, get_timeout,
+                               get_expected_runtime, check_hw_counters)
+
+
+def get_run_options(options):
+    """Describe the options of a run which change its results.
+
+    Stored in the performance_run_options metadata of checkpoints: --resume
+    must not mix results of runs with different options.
+    """
+    mode = get_run_mode(options)
+    if options.time_budget:
+        mode += ',budget=%s' % options.time_budget
+    return mode
+
+
+def load_checkpoint(filename, run_options=None):
+    """Load the benchmarks written by an interrupted run.
+
+    Return a dict: pyperformance benchmark name => list of pyperf
+    benchmarks. Benchmarks produced by a different pyperformance version
+    are ignored, as well as partial results of benchmarks which timed out.
+
+    Raise ValueError if a benchmark was produced by a run with options
+    different than run_options.
+    """
+    suite = pyperf.BenchmarkSuite.load(filename)
+    version = pyperformance.__version__
+
+    results = {}
+    for bench in suite.get_benchmarks():
+        metadata = bench.get_metadata()
+        name = metadata.get('performance_benchmark', bench.get_name())
+        bench_options = metadata.get('performance_run_options')
+        if (run_options is not None and bench_options is not None
+                and bench_options != run_options):
+            raise ValueError("benchmark %s of %s was run with different "
+                             "options: %s != %s"
+                             % (bench.get_name(), filename, bench_options,
+                                run_options))
+        bench_version = metadata.get('performance_version')
+        if bench_version != version:
+            print("Ignore benchmark %s from %s: performance version %s "
+                  "!= %s" % (bench.get_name(), filename, bench_version,
+                             version))
+            continue
+        if 'performance_partial' in metadata:
+            print("Ignore partial benchmark %s from %s"
+                  % (bench.get_name(), filename))
+            continue
+        results.setdefault(name, []).append(bench)
+    return results
+
+
+def write_checkpoint(filename, results):
+    """Write benchmarks into filename, replacing the file atomically.
+
+    results is a dict: pyperformance benchmark name => list of pyperf
+    benchmarks. Benchmarks are written sorted by name.
+    """
+    benchmarks = [bench
+                  for name in sorted(results)
+                  for bench in results[name]]
+    suite = pyperf.BenchmarkSuite(benchmarks)
+
+    # Keep the filename extension: pyperf compresses .json.gz files
+    dirname, basename = os.path.split(filename)
+    tmp = os.path.join(dirname, '.tmp-%s-%s' % (os.getpid(), basename))
+    try:
+        suite.dump(tmp, replace=True)
+        os.replace(tmp, filename)
+    except:   # noqa
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return suite
+
+
+def display_errors(errors):
+    if not errors:
+        return
+    print("%s benchmarks failed:" % len(errors))
+    for name, reason in errors:
+        print("- %s (%s)" % (name, reason))
+    print()
 
 
 def cmd_run(parser, options):
@@ -22,10 +102,26 @@ def cmd_run(parser, options):
     print("Python benchmark suite %s" % pyperformance.__version__)
     print()
 
-    if options.output and os.path.exists(options.output):
-        print("ERROR: the output file %s already exists!" % options.output)
+    if options.resume and not options.output:
+        print("ERROR: --resume requires --output")
         sys.exit(1)
 
+    results = {}
+    if options.output and os.path.exists(options.output):
+        if not options.resume:
+            print("ERROR: the output file %s already exists!" % options.output)
+            print("Use --resume to complete an interrupted run.")
+            sys.exit(1)
+        try:
+            results = load_checkpoint(options.output,
+                                      get_run_options(options))
+        except ValueError as exc:
+            print("ERROR: cannot resume: %s" % exc)
+            sys.exit(1)
+        print("Resume %s: %s benchmarks already done"
+              % (options.output, len(results)))
+        print()
+
     if hasattr(options, 'python'):
         executable = options.python
     else:
@@ -33,51 +129,76 @@ def cmd_run(parser, options):
     if not os.path.isabs(executable):
         print("ERROR: \"%s\" is not an absolute path" % executable)
         sys.exit(1)
+    try:
+        cpu_sets = get_cpu_sets(options)
+    except ValueError as exc:
+        print("ERROR: %s" % exc)
+        sys.exit(1)
+
+    if options.hw_counters:
+        check_hw_counters(options)
+
     bench_funcs, bench_groups, should_run = get_benchmarks_to_run(options)
-    cmd_prefix = [executable]
-    suite, errors = run_benchmarks(bench_funcs, should_run, cmd_prefix, options)
+    should_run = should_run - set(results)
 
-    if not suite:
+    cmd_prefix = [executable]
+    sample_sizes = None
+    skipped = []
+    if options.time_budget and should_run:
+        sample_sizes, skipped = plan_time_budget(bench_funcs, should_run,
+                                                 cmd_prefix, options,
+                                                 cpu_sets)
+        should_run = should_run - {name for name, reason in skipped}
+
+    history = RuntimeHistory(executable)
+    modes = {}
+    timeouts = {}
+    runtimes = {}
+    for name in should_run:
+        sample_size = None
+        if sample_sizes and name in sample_sizes:
+            sample_size = sample_sizes[name]
+        processes = sample_size[0] if sample_size else None
+        modes[name] = get_run_mode(options, sample_size)
+        timeouts[name] = get_timeout(bench_funcs[name], options, processes)
+        runtimes[name] = history.get(name, modes[name])
+        if runtimes[name] is None:
+            runtimes[name] = get_expected_runtime(bench_funcs[name], options,
+                                                  processes)
+
+    def checkpoint(name, benchmarks, elapsed):
+        # Write each benchmark as soon as it completes to not lose results
+        # if pyperformance is interrupted
+        for bench in benchmarks:
+            bench.update_metadata({'performance_run_options':
+                                   get_run_options(options)})
+        results[name] = benchmarks
+        if options.output:
+            write_checkpoint(options.output, results)
+        if not any('performance_partial' in bench.get_metadata()
+                   for bench in benchmarks):
+            history.add(name, modes[name], elapsed)
+            history.save()
+
+    suite, errors = run_benchmarks(bench_funcs, should_run, cmd_prefix, options,
+                                   cpu_sets=cpu_sets, checkpoint=checkpoint,
+                                   sample_sizes=sample_sizes,
+                                   timeouts=timeouts, runtimes=runtimes)
+    errors = sorted(errors + skipped)
+
+    if not results:
+        display_errors(errors)
         print("ERROR: No benchmark was run")
         sys.exit(1)
 
     if options.output:
-        suite.dump(options.output)
-    if options.append:
+        full_suite = write_checkpoint(options.output, results)
+    else:
+        full_suite = suite
+    if options.append and suite:
         pyperf.add_runs(options.append, suite)
-    display_benchmark_suite(suite)
+    display_benchmark_suite(full_suite)
 
     if errors:
-        print("%s benchmarks failed:" % len(errors))
-        for name in errors:
-            print("- %s" % name)
-        print()
+        display_errors(errors)
         sys.exit(1)
-
-
-def cmd_list(options):
-    bench_funcs, bench_groups, all_funcs = get_benchmarks_to_run(options)
-
-    print("%r benchmarks:" % options.benchmarks)
-    for func in sorted(all_funcs):
-        print("- %s" % func)
-    print()
-    print("Total: %s benchmarks" % len(all_funcs))
-
-
-def cmd_list_groups(options):
-    bench_funcs, bench_groups = get_benchmarks()
-
-    funcs = set(bench_groups['all'])
-    all_funcs = set(funcs)
-
-    for group, funcs in sorted(bench_groups.items()):
-        funcs = set(funcs) & all_funcs
-        if not funcs:
-            # skip empty groups
-            continue
-
-        print("%s (%s):" % (group, len(funcs)))
-        for func in sorted(funcs):
-            print("- %s" % func)
-        print()
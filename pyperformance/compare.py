@@ -3,12 +3,23 @@ import os.path
 import math
 import sys
 
-import pyperf
 import statistics
 
+from pyperformance import stats
+from pyperformance.stream import load_suite
+
 
 NO_VERSION = "<not set>"
 
+# Hardware counters of the --hw-counters option of run: (name, title)
+HW_COUNTERS = (
+    ('instructions', "Instructions per iteration"),
+    ('ipc', "IPC"),
+    ('cycles', "Cycles per iteration"),
+    ('branch_misses', "Branch misses per iteration"),
+    ('cache_misses', "Cache misses per iteration"),
+)
+
 
 def format_result(bench):
     mean = bench.mean()
@@ -93,11 +104,10 @@ def tscore(sample1, sample2):
     Returns:
         The t-test score, as a float.
     """
-    if len(sample1) != len(sample2):
-        raise ValueError("different number of values")
-    error = pooled_sample_variance(sample1, sample2) / len(sample1)
+    error = (pooled_sample_variance(sample1, sample2)
+             * (1.0 / len(sample1) + 1.0 / len(sample2)))
     diff = statistics.mean(sample1) - statistics.mean(sample2)
-    return diff / math.sqrt(error * 2)
+    return diff / math.sqrt(error)
 
 
 def is_significant(sample1, sample2):
@@ -120,7 +130,31 @@ def is_significant(sample1, sample2):
     return (abs(t_score) >= critical_value, t_score)
 
 
-def significant_msg(base, changed):
+def stats_test(sample1, sample2, method='t-test'):
+    """Test whether two samples differ significantly with a method of the
+    --stats option.
+
+    Return (significant, text) where text describes the test result.
+    """
+    if method == 't-test':
+        significant, t_score = is_significant(sample1, sample2)
+        return (significant, "t=%.2f" % t_score)
+    elif method == 'welch':
+        t_score, pvalue = stats.welch_test(sample1, sample2)
+        return (pvalue < 0.05, "Welch t=%.2f, p=%.3g" % (t_score, pvalue))
+    elif method == 'mann-whitney':
+        u, pvalue = stats.mann_whitney_u(sample1, sample2)
+        return (pvalue < 0.05, "Mann-Whitney U=%.0f, p=%.3g" % (u, pvalue))
+    elif method in ('bootstrap', 'bootstrap-median'):
+        statistic = 'median' if method == 'bootstrap-median' else 'mean'
+        ratio, low, high = stats.bootstrap_ratio(sample1, sample2, statistic)
+        return (not (low <= 1.0 <= high),
+                "ratio of %ss 95%% CI: %.3f-%.3f" % (statistic, low, high))
+    else:
+        raise ValueError("invalid statistics method: %r" % method)
+
+
+def significant_msg(base, changed, method='t-test'):
     if base.get_nvalue() < 2 or changed.get_nvalue() < 2:
         return "(benchmark only contains a single value)"
 
@@ -137,29 +171,53 @@ def significant_msg(base, changed):
         base_times = base.get_values()
         changed_times = changed.get_values()
 
-        significant, t_score = is_significant(base_times, changed_times)
+        significant, text = stats_test(base_times, changed_times, method)
         if significant:
-            msg = "Significant (t=%.2f)" % t_score
+            msg = "Significant (%s)" % text
 
     return msg
 
 
 def format_table(base_label, changed_label, results):
-    table = [("Benchmark", base_label, changed_label, "Change", "Significance")]
+    has_counters = any(compare_hw_counters(result.base, result.changed)
+                       for bench_name, result in results)
+    if has_counters:
+        table = [("Benchmark", base_label, changed_label, "Change",
+                  "Significance", "Instructions", "IPC")]
+    else:
+        table = [("Benchmark", base_label, changed_label, "Change",
+                  "Significance")]
 
     for (bench_name, result) in results:
         format_value = result.base.format_value
         avg_base = result.base.mean()
         avg_changed = result.changed.mean()
         delta_avg = quantity_delta(result.base, result.changed)
-        msg = significant_msg(result.base, result.changed)
-        table.append((bench_name,
-                      # Limit the precision for conciseness in the table.
-                      format_value(avg_base),
-                      format_value(avg_changed),
-                      delta_avg,
-                      msg))
-
+        msg = significant_msg(result.base, result.changed, result.method)
+        row = (bench_name,
+               # Limit the precision for conciseness in the table.
+               format_value(avg_base),
+               format_value(avg_changed),
+               delta_avg,
+               msg)
+        if has_counters:
+            counters = {name: (value1, value2) for name, value1, value2
+                        in compare_hw_counters(result.base, result.changed)}
+            if 'instructions' in counters:
+                row += (format_percent_change(*counters['instructions']),)
+            else:
+                row += ("-",)
+            if 'ipc' in counters:
+                row += ("%.2f -> %.2f" % counters['ipc'],)
+            else:
+                row += ("-",)
+        table.append(row)
+
+    return render_table(table)
+
+
+def render_table(table):
+    """Render a table: the first row is the header."""
     # Columns with None values are skipped
     skipped_cols = set()
     col_widths = [0] * len(table[0])
@@ -197,19 +255,17 @@ def format_table(base_label, changed_label, results):
 class BenchmarkResult(object):
     """An object representing data from a succesful benchmark run."""
 
-    def __init__(self, base, changed):
+    def __init__(self, base, changed, method='t-test'):
         name = base.get_name()
         name2 = changed.get_name()
         if name2 != name:
             raise ValueError("not the same benchmark: %s != %s"
                              % (name, name2))
 
-        if base.get_nvalue() != changed.get_nvalue():
-            raise RuntimeError("base and changed don't have "
-                               "the same number of values")
-
         self.base = base
         self.changed = changed
+        # statistics method of the --stats option
+        self.method = method
 
     def __str__(self):
         if self.base.get_nvalue() > 1:
@@ -217,10 +273,11 @@ class BenchmarkResult(object):
                       self.changed.mean(), self.changed.stdev())
             text = "%s +- %s -> %s +- %s" % self.base.format_values(values)
 
-            msg = significant_msg(self.base, self.changed)
+            msg = significant_msg(self.base, self.changed, self.method)
             delta_avg = quantity_delta(self.base, self.changed)
-            return ("Mean +- std dev: %s: %s\n%s"
-                    % (text, delta_avg, msg))
+            lines = ["Mean +- std dev: %s: %s" % (text, delta_avg), msg]
+            lines.extend(format_hw_counters(self.base, self.changed))
+            return "\n".join(lines)
         else:
             format_value = self.base.format_value
             base = self.base.mean()
@@ -253,6 +310,109 @@ def quantity_delta(base, changed):
         return "no change"
 
 
+def get_hw_counters(bench):
+    """Get the hardware counters of a benchmark per loop iteration.
+
+    Return a dict: counter name => mean count per loop iteration of the
+    runs which have the counter, plus 'ipc' (instructions per cycle). The
+    dict is empty if the benchmark was not run with --hw-counters.
+    """
+    totals = {}
+    for run in bench.get_runs():
+        metadata = run.get_metadata()
+        iterations = metadata.get('hw_iterations')
+        if not iterations:
+            continue
+        for name, title in HW_COUNTERS:
+            key = 'hw_' + name
+            if key in metadata:
+                count, total = totals.get(name, (0, 0))
+                totals[name] = (count + metadata[key], total + iterations)
+
+    counters = {name: count / iterations
+                for name, (count, iterations) in totals.items()}
+    if 'instructions' in counters and counters.get('cycles'):
+        counters['ipc'] = counters['instructions'] / counters['cycles']
+    return counters
+
+
+def compare_hw_counters(base, changed):
+    """Compare the hardware counters of two benchmarks.
+
+    Return a list of (name, base, changed) tuples of the counters of both
+    benchmarks, in the order of HW_COUNTERS.
+    """
+    counters1 = get_hw_counters(base)
+    counters2 = get_hw_counters(changed)
+    return [(name, counters1[name], counters2[name])
+            for name, title in HW_COUNTERS
+            if name in counters1 and name in counters2]
+
+
+def format_count(name, value):
+    if name == 'ipc':
+        return "%.2f" % value
+    for scale, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if abs(value) >= scale:
+            return "%.3g%s" % (value / scale, suffix)
+    return "%.3g" % value
+
+
+def format_percent_change(old, new):
+    if not old:
+        return "incomparable (one result was zero)"
+    return "%+.1f%%" % ((new / old - 1.0) * 100)
+
+
+def format_hw_counters(base, changed):
+    """Format the changes of hardware counters: return a list of lines."""
+    titles = dict(HW_COUNTERS)
+    return ["%s: %s -> %s: %s"
+            % (titles[name], format_count(name, value1),
+               format_count(name, value2),
+               format_percent_change(value1, value2))
+            for name, value1, value2 in compare_hw_counters(base, changed)]
+
+
+def format_ratio(ratio, is_time):
+    """Format the ratio changed / base like quantity_delta()."""
+    if ratio > 1:
+        return "%.2fx %s" % (ratio, "slower" if is_time else "larger")
+    elif ratio < 1:
+        return "%.2fx %s" % (1 / ratio, "faster" if is_time else "smaller")
+    else:
+        return "no change"
+
+
+def geometric_mean(ratios):
+    """Geometric mean of ratios with its 95% confidence interval.
+
+    The interval is computed on the logarithms of the ratios with Student's
+    t distribution. Return (mean, low, high): low and high are None if
+    there are less than 2 ratios.
+    """
+    logs = [math.log(ratio) for ratio in ratios]
+    mean = statistics.mean(logs)
+    if len(logs) < 2:
+        return (math.exp(mean), None, None)
+    error = (tdist95conf_level(len(logs) - 1)
+             * statistics.stdev(logs) / math.sqrt(len(logs)))
+    return (math.exp(mean), math.exp(mean - error), math.exp(mean + error))
+
+
+def format_geometric_mean(ratios, is_time):
+    if not ratios:
+        return "-"
+    mean, low, high = geometric_mean(ratios)
+    text = format_ratio(mean, is_time)
+    if low is not None and mean != 1:
+        # Express the interval in the direction of the mean
+        if mean < 1:
+            low, high = 1 / high, 1 / low
+        text += " (95%% CI: %.2fx-%.2fx)" % (low, high)
+    return text
+
+
 def display_suite_metadata(suite, title=None):
     metadata = suite.get_metadata()
     empty = True
@@ -285,37 +445,194 @@ def display_suite_metadata(suite, title=None):
         print()
 
 
-def display_benchmark_suite(suite):
+def format_confidence_interval(bench, method):
+    """Format the 95% confidence interval of a method of the --stats
+    option."""
+    values = bench.get_values()
+    if method in ('t-test', 'welch'):
+        mean = bench.mean()
+        error = (tdist95conf_level(len(values) - 1)
+                 * bench.stdev() / math.sqrt(len(values)))
+        name = "mean"
+        low, high = mean - error, mean + error
+    elif method == 'mann-whitney':
+        name = "median"
+        low, high = stats.median_ci(values)
+    else:
+        statistic = 'median' if method == 'bootstrap-median' else 'mean'
+        name = "%s (bootstrap)" % statistic
+        low, high = stats.bootstrap_ci(values, statistic)
+    return ("95%% CI of the %s: %s .. %s"
+            % ((name,) + bench.format_values((low, high))))
+
+
+def display_benchmark_suite(suite, method=None):
     display_suite_metadata(suite)
 
     for bench in suite.get_benchmarks():
         print("### %s ###" % bench.get_name())
         print(format_result(bench))
+        if method and bench.get_nvalue() >= 2:
+            print(format_confidence_interval(bench, method))
+        counters = get_hw_counters(bench)
+        if counters:
+            print(", ".join("%s: %s" % (title, format_count(name,
+                                                            counters[name]))
+                            for name, title in HW_COUNTERS
+                            if name in counters))
         print()
 
 
 def cmd_show(options):
-    suite = pyperf.BenchmarkSuite.load(options.filename)
-    display_benchmark_suite(suite)
+    suite = load_suite(options.filename)
+    display_benchmark_suite(suite, options.stats)
 
 
-def get_labels(filename1, filename2):
-    # Find a short label to identify two filenames:
-    # the two labels must be different
-    name1 = os.path.basename(filename1)
-    name2 = os.path.basename(filename2)
-    if name1 != name2:
-        return (name1, name2)
+def get_labels(filenames):
+    # Find short labels to identify filenames:
+    # the labels must be different
+    labels = [os.path.basename(filename) for filename in filenames]
+    if len(set(labels)) == len(labels):
+        return labels
 
-    return (filename1, filename2)
+    return list(filenames)
 
 
-def compare_results(options):
-    base_label, changed_label = get_labels(options.baseline_filename,
-                                           options.changed_filename)
+def check_versions(suites):
+    versions = [suite.get_metadata().get('performance_version', NO_VERSION)
+                for suite in suites]
+    if len(set(versions)) > 1 or NO_VERSION in versions:
+        print()
+        print("ERROR: Performance versions are different: %s"
+              % ' != '.join(versions))
+        sys.exit(1)
+
+
+def format_change(result):
+    msg = significant_msg(result.base, result.changed, result.method)
+    if msg == "Not significant":
+        text = "not significant"
+    else:
+        text = quantity_delta(result.base, result.changed)
+    return "%s: %s" % (result.changed.format_value(result.changed.mean()),
+                       text)
+
+
+def get_benchmark_groups(options):
+    # Use lazy import: only the N-way comparison displays groups
+    from pyperformance.benchmarks import get_benchmarks
+
+    bench_groups = get_benchmarks(options.manifest)[1]
+    return {group: set(names) for group, names in bench_groups.items()
+            if group != 'all'}
+
+
+def get_manifest_name(bench):
+    """Get the name of the manifest benchmark which produced bench.
 
-    base_suite = pyperf.BenchmarkSuite.load(options.baseline_filename)
-    changed_suite = pyperf.BenchmarkSuite.load(options.changed_filename)
+    Scripts like xml_etree produce several pyperf benchmarks, which are not
+    listed in the manifest groups: use the performance_benchmark metadata
+    written by run, or fall back to the pyperf benchmark name.
+    """
+    return bench.get_metadata().get('performance_benchmark',
+                                    bench.get_name())
+
+
+def compare_suites(options, labels, suites):
+    """Compare a baseline suite with multiple changed suites.
+
+    Return a list of (name, results) tuples where results is a list of
+    BenchmarkResult, one per changed suite, or None if the changed suite
+    doesn't have the benchmark.
+    """
+    base_suite = suites[0]
+    changed_suites = suites[1:]
+
+    for label, suite in zip(labels, suites):
+        display_suite_metadata(suite, title=label)
+
+    base_names = set(base_suite.get_benchmark_names())
+    changed_names = [set(suite.get_benchmark_names())
+                     for suite in changed_suites]
+    names = sorted(base_names & set().union(*changed_names))
+
+    table = [["Benchmark"] + labels]
+    results = []
+    # ratios[index]: benchmark name => changed / base mean ratio
+    ratios = [{} for suite in changed_suites]
+    # benchmark name => manifest benchmark name
+    manifest_names = {}
+    is_time = True
+    for name in names:
+        base = base_suite.get_benchmark(name)
+        manifest_names[name] = get_manifest_name(base)
+        is_time &= (base.get_unit() == 'second')
+        row = [name, base.format_value(base.mean())]
+        bench_results = []
+        for index, suite in enumerate(changed_suites):
+            if name not in changed_names[index]:
+                row.append("-")
+                bench_results.append(None)
+                continue
+            result = BenchmarkResult(base, suite.get_benchmark(name),
+                                     options.stats)
+            row.append(format_change(result))
+            bench_results.append(result)
+            if base.mean() and result.changed.mean():
+                ratios[index][name] = result.changed.mean() / base.mean()
+        table.append(row)
+        results.append((name, bench_results))
+
+    groups = get_benchmark_groups(options)
+    for group, members in sorted(groups.items()):
+        if not members & set(manifest_names.values()):
+            continue
+        row = ["Geometric mean (%s)" % group, "(ref)"]
+        for bench_ratios in ratios:
+            group_ratios = [ratio for name, ratio in bench_ratios.items()
+                            if manifest_names[name] in members]
+            row.append(format_geometric_mean(group_ratios, is_time))
+        table.append(row)
+    row = ["Geometric mean", "(ref)"]
+    for bench_ratios in ratios:
+        row.append(format_geometric_mean(list(bench_ratios.values()),
+                                         is_time))
+    table.append(row)
+
+    if names:
+        print(render_table(table))
+
+    only_base = base_names - set(names)
+    if only_base:
+        print()
+        print("Skipped %s benchmarks only in %s: %s"
+              % (len(only_base), labels[0], ', '.join(sorted(only_base))))
+    for label, bench_names in zip(labels[1:], changed_names):
+        only_changed = bench_names - base_names
+        if only_changed:
+            print()
+            print("Skipped %s benchmarks only in %s: %s"
+                  % (len(only_changed), label,
+                     ', '.join(sorted(only_changed))))
+
+    check_versions(suites)
+    return results
+
+
+def compare_results(options):
+    filenames = [options.baseline_filename] + options.changed_filenames
+    labels = get_labels(filenames)
+    # Only load benchmarks of changed files which are in the baseline
+    base_suite = load_suite(options.baseline_filename)
+    names = set(base_suite.get_benchmark_names())
+    suites = [base_suite]
+    suites.extend(load_suite(filename, names)
+                  for filename in options.changed_filenames)
+    if len(suites) > 2:
+        return compare_suites(options, labels, suites)
+
+    base_label, changed_label = labels
+    base_suite, changed_suite = suites
 
     results = []
     common = set(base_suite.get_benchmark_names()) & set(
@@ -323,7 +640,7 @@ def compare_results(options):
     for name in sorted(common):
         base_bench = base_suite.get_benchmark(name)
         changed_bench = changed_suite.get_benchmark(name)
-        result = BenchmarkResult(base_bench, changed_bench)
+        result = BenchmarkResult(base_bench, changed_bench, options.stats)
         results.append(result)
 
     hidden = []
@@ -331,7 +648,8 @@ def compare_results(options):
     for result in results:
         name = result.base.get_name()
 
-        significant = significant_msg(result.base, result.changed)
+        significant = significant_msg(result.base, result.changed,
+                                      result.method)
         if significant or options.verbose:
             shown.append((name, result))
         else:
@@ -374,14 +692,7 @@ def compare_results(options):
               % (len(only_changed), changed_label,
                  ', '.join(sorted(only_changed))))
 
-    version1 = base_suite.get_metadata().get('performance_version', NO_VERSION)
-    version2 = changed_suite.get_metadata().get('performance_version', NO_VERSION)
-    if version1 != version2 or (version1 == version2 == NO_VERSION):
-        print()
-        print("ERROR: Performance versions are different: %s != %s"
-              % (version1, version2))
-        sys.exit(1)
-
+    check_versions(suites)
     return results
 
 
@@ -410,8 +721,28 @@ def write_csv(results, filename):
             writer.writerow(row)
 
 
+def write_csv_multiple(labels, results, filename):
+    with open(filename, "w", newline='', encoding='ascii') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['Benchmark'] + labels)
+        for name, bench_results in results:
+            base = next(filter(None, bench_results)).base
+            row = [name, format_csv(base.mean())]
+            for result in bench_results:
+                if result is not None:
+                    row.append(format_csv(result.changed.mean()))
+                else:
+                    row.append('')
+            writer.writerow(row)
+
+
 def cmd_compare(options):
     results = compare_results(options)
 
     if options.csv:
-        write_csv(results, options.csv)
+        if len(options.changed_filenames) == 1:
+            write_csv(results, options.csv)
+        else:
+            labels = get_labels([options.baseline_filename]
+                                + options.changed_filenames)
+            write_csv_multiple(labels, results, options.csv)
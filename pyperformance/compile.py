@@ -1,24 +1,27 @@
 import configparser
 import datetime
 import errno
+import hashlib
 import json
 import logging
 import math
 import os.path
 import pyperf
+import queue
 import re
 import shlex
 import shutil
 import statistics
 import subprocess
 import sys
+import threading
 import time
-from urllib.error import HTTPError
-from urllib.parse import urlencode
-from urllib.request import urlopen
 
 import pyperformance
-from pyperformance.utils import MS_WINDOWS
+from pyperformance.compare import is_significant
+from pyperformance.upload import UploadQueue, BATCH_SIZE, RETRIES
+from pyperformance.utils import (MS_WINDOWS, parse_cpu_list, format_cpu_list,
+                                 parse_size, link_tree)
 from pyperformance.venv import (GET_PIP_URL, REQ_OLD_PIP, PERFORMANCE_ROOT,
                                 download, is_build_dir)
 
@@ -237,6 +240,97 @@ class Application(object):
                 raise
 
 
+def get_tree_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return size
+
+
+class PrefixCache(object):
+    """Cache of installed Python prefixes.
+
+    Entries are directories named by the cache key, containing the installed
+    prefix and an info.json file. The modification time of info.json is the
+    last use of the entry: least recently used entries are removed when the
+    cache becomes larger than max_size bytes.
+    """
+
+    def __init__(self, app, directory, max_size):
+        self.app = app
+        self.logger = app.logger
+        self.directory = directory
+        self.max_size = max_size
+
+    def restore(self, key, prefix):
+        entry = os.path.join(self.directory, key)
+        info_file = os.path.join(entry, 'info.json')
+        if not os.path.exists(info_file):
+            return False
+
+        self.logger.error("Restore the installed Python from the prefix "
+                          "cache %s" % entry)
+        self.app.safe_rmdir(prefix)
+        link_tree(os.path.join(entry, 'prefix'), prefix)
+        # Mark the entry as recently used
+        os.utime(info_file)
+        return True
+
+    def add(self, key, prefix, info):
+        """Add an installed prefix to the cache.
+
+        Errors are only logged: the cache is only an optimization.
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(entry):
+            return
+
+        tmp = '%s.tmp-%s' % (entry, os.getpid())
+        try:
+            self.app.safe_makedirs(self.directory)
+            link_tree(prefix, os.path.join(tmp, 'prefix'))
+            info = dict(info, size=get_tree_size(tmp))
+            with open(os.path.join(tmp, 'info.json'), 'w') as fp:
+                json.dump(info, fp, sort_keys=True)
+            # Rename the directory at the end to not restore an incomplete
+            # entry
+            os.rename(tmp, entry)
+        except OSError as exc:
+            self.logger.error("WARNING: failed to add %s to the prefix "
+                              "cache: %s" % (prefix, exc))
+        else:
+            self.logger.error("Installed Python added to the prefix cache %s"
+                              % entry)
+        finally:
+            self.app.safe_rmdir(tmp)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            info_file = os.path.join(self.directory, name, 'info.json')
+            try:
+                mtime = os.stat(info_file).st_mtime
+                with open(info_file) as fp:
+                    size = json.load(fp)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((mtime, size, name))
+        entries.sort()
+
+        total = sum(size for mtime, size, name in entries)
+        # Always keep the most recently used entry
+        while total > self.max_size and len(entries) > 1:
+            mtime, size, name = entries.pop(0)
+            self.logger.error("Prefix cache larger than %.0f MiB: "
+                              "remove the least recently used entry"
+                              % (self.max_size / 1024 ** 2))
+            self.app.safe_rmdir(os.path.join(self.directory, name))
+            total -= size
+
+
 class Python(Task):
     def __init__(self, app, conf):
         super().__init__(app, conf.build_dir)
@@ -246,6 +340,11 @@ class Python(Task):
         self.logger = app.logger
         self.program = None
         self.hexversion = None
+        if conf.prefix_cache and conf.install:
+            self.prefix_cache = PrefixCache(app, conf.prefix_cache_dir,
+                                            conf.prefix_cache_size)
+        else:
+            self.prefix_cache = None
 
     def patch(self, filename):
         if not filename:
@@ -257,12 +356,34 @@ class Python(Task):
                      cwd=self.conf.repo_dir,
                      stdin_filename=filename)
 
-    def compile(self):
-        build_dir = self.conf.build_dir
-
-        self.app.safe_rmdir(build_dir)
-        self.app.safe_makedirs(build_dir)
-
+    def get_build_env(self):
+        if not self.conf.ccache:
+            return None
+
+        ccache = shutil.which('ccache')
+        if not ccache:
+            self.logger.error("WARNING: ccache program not found: "
+                              "compile without ccache")
+            return None
+
+        # Masquerade compilers as ccache: ccache runs the compiler found
+        # next in PATH. Python doesn't remember ccache in its sysconfig CC
+        # variable, unlike CC="ccache gcc".
+        bin_dir = os.path.join(self.conf.ccache_dir, 'bin')
+        self.app.safe_makedirs(bin_dir)
+        for name in ('cc', 'gcc', 'clang', 'c++', 'g++', 'clang++'):
+            link = os.path.join(bin_dir, name)
+            if not os.path.lexists(link):
+                os.symlink(ccache, link)
+
+        env = dict(os.environ)
+        env['PATH'] = bin_dir + os.pathsep + env.get('PATH', os.defpath)
+        env['CCACHE_DIR'] = self.conf.ccache_dir
+        # Share cache entries between build directories
+        env['CCACHE_BASEDIR'] = self.conf.repo_dir
+        return env
+
+    def get_config_args(self):
         config_args = []
         if self.branch.startswith("2.") and not MS_WINDOWS:
             # On Python 2, use UCS-4 for Unicode on all platforms, except
@@ -278,21 +399,84 @@ class Python(Task):
             config_args.extend(self.get_package_only_flags())
         if self.conf.debug:
             config_args.append('CFLAGS=-O0')
+        return config_args
+
+    def _get_config_filename(self):
+        return os.path.join(self.conf.build_dir, 'pyperformance-config.json')
+
+    def is_configured(self, config_args):
+        if not os.path.exists(os.path.join(self.conf.build_dir, 'Makefile')):
+            return False
+        try:
+            with open(self._get_config_filename()) as fp:
+                return json.load(fp) == config_args
+        except (OSError, ValueError):
+            return False
+
+    def configure(self, config_args, env):
+        build_dir = self.conf.build_dir
+
+        self.app.safe_rmdir(build_dir)
+        self.app.safe_makedirs(build_dir)
+
         configure = os.path.join(self.conf.repo_dir, 'configure')
-        self.run(configure, *config_args)
+        self.run(configure, *config_args, env=env)
 
+        with open(self._get_config_filename(), 'w') as fp:
+            json.dump(config_args, fp)
+
+    def make(self, env):
+        cmd = ['make', '-j%s' % self.conf.jobs]
         if self.conf.pgo:
             # FIXME: use taskset (isolated CPUs) for PGO?
-            self.run('make', 'profile-opt')
+            cmd.append('profile-opt')
+        return self.run_nocheck(*cmd, env=env)
+
+    def compile(self):
+        config_args = self.get_config_args()
+        env = self.get_build_env()
+
+        incremental = (self.conf.incremental
+                       and self.is_configured(config_args))
+        if incremental:
+            # Makefile rules recompile files modified by the checkout, and
+            # run configure again if it changed
+            self.logger.error("Incremental build in %s" % self.conf.build_dir)
         else:
-            self.run('make')
+            self.configure(config_args, env)
+
+        exitcode = self.make(env)
+        if exitcode and incremental:
+            self.logger.error("Incremental build failed: "
+                              "rebuild from scratch")
+            self.configure(config_args, env)
+            exitcode = self.make(env)
+        if exitcode:
+            sys.exit(exitcode)
+
+    def get_installed_program(self):
+        if sys.platform == 'win32':
+            program_ext = '.exe'
+        else:
+            program_ext = ''
+
+        program = os.path.join(self.conf.prefix, "bin", "python" + program_ext)
+        if not os.path.exists(program):
+            program = os.path.join(self.conf.prefix, "bin",
+                                   "python3" + program_ext)
+        return program
+
+    def get_program(self):
+        if self.conf.install:
+            return self.get_installed_program()
 
-    def install_python(self):
         if sys.platform in ('darwin', 'win32'):
             program_ext = '.exe'
         else:
             program_ext = ''
+        return os.path.join(self.conf.build_dir, "python" + program_ext)
 
+    def install_python(self):
         if self.conf.install:
             prefix = self.conf.prefix
             self.app.safe_rmdir(prefix)
@@ -300,16 +484,10 @@ class Python(Task):
 
             self.run('make', 'install')
 
-            if sys.platform == 'darwin':
-                program_ext = ''
-
-            self.program = os.path.join(prefix, "bin", "python" + program_ext)
-            if not os.path.exists(self.program):
-                self.program = os.path.join(prefix, "bin", "python3" + program_ext)
+            self.program = self.get_installed_program()
         else:
             # don't install: run python from the compilation directory
-            self.program = os.path.join(self.conf.build_dir,
-                                        "python" + program_ext)
+            self.program = self.get_program()
 
     def get_version(self):
         # Dump the Python version
@@ -402,13 +580,55 @@ class Python(Task):
 
         self.run(*cmd)
 
+    def get_compiler_version(self):
+        cmd = shlex.split(os.environ.get('CC', 'cc')) + ['--version']
+        try:
+            exitcode, stdout = self.app.get_output_nocheck(*cmd)
+        except OSError:
+            return ''
+        return stdout if not exitcode else ''
+
+    def get_cache_info(self):
+        patch = self.app.patch
+        if patch:
+            with open(patch, 'rb') as fp:
+                patch = hashlib.sha1(fp.read()).hexdigest()
+        return {
+            'revision': self.app.revision,
+            'branch': self.branch,
+            # config_args contains --prefix: the prefix is written in the
+            # installed files (shebang of scripts, sysconfig), so an entry
+            # cannot be restored into another prefix
+            'config_args': self.get_config_args(),
+            'pgo': self.conf.pgo,
+            'patch': patch,
+            'compiler': self.get_compiler_version(),
+            # pip and pyperformance are installed in the prefix
+            'performance_version': pyperformance.__version__,
+            'performance_root': PERFORMANCE_ROOT if is_build_dir() else None,
+        }
+
     def compile_install(self):
+        if self.prefix_cache is not None:
+            info = self.get_cache_info()
+            data = json.dumps(dict(info, branch=None), sort_keys=True)
+            key = hashlib.sha1(data.encode('utf-8')).hexdigest()
+            if self.prefix_cache.restore(key, self.conf.prefix):
+                # Commands are run in the build directory
+                self.app.safe_makedirs(self.conf.build_dir)
+                self.program = self.get_installed_program()
+                self.get_version()
+                return
+
         self.compile()
         self.install_python()
         self.get_version()
         self.install_pip()
         self.install_performance()
 
+        if self.prefix_cache is not None:
+            self.prefix_cache.add(key, self.conf.prefix, info)
+
 
 class BenchmarkRevision(Application):
     def __init__(self, conf, revision, branch=None, patch=None,
@@ -418,12 +638,16 @@ class BenchmarkRevision(Application):
         self.patch = patch
         self.exitcode = 0
         self.uploaded = False
+        # 'all', 'build' (compile and create the venv) or 'bench'
+        self.stage = getattr(options, 'stage', None) or 'all'
 
         if setup_log:
             if branch:
                 prefix = 'compile-%s-%s' % (branch, revision)
             else:
                 prefix = 'compile-%s' % revision
+            if self.stage != 'all':
+                prefix = '%s-%s' % (prefix, self.stage)
             self.setup_log(prefix)
 
         if filename is None:
@@ -443,7 +667,8 @@ class BenchmarkRevision(Application):
                                             os.path.basename(self.filename))
 
     def init_revision(self, revision, branch=None):
-        if self.conf.update:
+        # the bench stage doesn't use the repository
+        if self.conf.update and self.stage != 'bench':
             self.repository.fetch()
 
         if branch:
@@ -486,8 +711,10 @@ class BenchmarkRevision(Application):
     def compile_install(self):
         self.repository.checkout(self.revision)
 
-        # First: remove everything
-        self.safe_rmdir(self.conf.build_dir)
+        # First: remove everything, except of the build directory
+        # for incremental builds
+        if not self.conf.incremental:
+            self.safe_rmdir(self.conf.build_dir)
         self.safe_rmdir(self.conf.prefix)
         self.safe_rmdir(self.conf.venv)
 
@@ -517,7 +744,9 @@ class BenchmarkRevision(Application):
             cmd.append('--inherit-environ=%s' % ','.join(self.options.inherit_environ))
         if self.conf.benchmarks:
             cmd.extend(('--benchmarks', self.conf.benchmarks))
-        if self.conf.affinity:
+        if self.conf.cpu_sets:
+            cmd.extend(('--cpu-sets', self.conf.cpu_sets))
+        elif self.conf.affinity:
             cmd.extend(('--affinity', self.conf.affinity))
         if self.conf.venv:
             cmd.extend(('--venv', self.conf.venv))
@@ -527,6 +756,8 @@ class BenchmarkRevision(Application):
 
         if os.path.exists(self.filename):
             self.update_metadata()
+            if self.conf.results_db:
+                self.import_results()
 
         return bool(exitcode)
 
@@ -544,6 +775,21 @@ class BenchmarkRevision(Application):
             bench.update_metadata(metadata)
         suite.dump(self.filename, replace=True)
 
+    def import_results(self):
+        # Use lazy import: sqlite3 is only needed with results_db
+        from pyperformance.db import ResultsDB
+
+        try:
+            with ResultsDB(self.conf.results_db) as db:
+                db.import_file(self.filename)
+        except Exception as exc:
+            # The JSON file remains the reference: don't fail the run
+            self.logger.error("Failed to import %s into %s: %s"
+                              % (self.filename, self.conf.results_db, exc))
+        else:
+            self.logger.error("Results imported into %s"
+                              % self.conf.results_db)
+
     def encode_benchmark(self, bench):
         data = {}
         data['environment'] = self.conf.environment
@@ -568,56 +814,54 @@ class BenchmarkRevision(Application):
         # Other stats metadata: q1, q3
         return data
 
-    def upload(self):
+    def get_upload_error(self):
+        """Get the error message if results cannot be uploaded, or None."""
         if self.uploaded:
             raise Exception("already uploaded")
 
         if self.filename == self.upload_filename:
-            self.logger.error("ERROR: %s was already uploaded!"
-                              % self.filename)
-            sys.exit(1)
+            return "%s was already uploaded!" % self.filename
 
         if os.path.exists(self.upload_filename):
-            self.logger.error("ERROR: cannot upload, %s file ready exists!"
-                              % self.upload_filename)
-            sys.exit(1)
-
-        self.safe_makedirs(self.conf.uploaded_json_dir)
-
-        suite = pyperf.BenchmarkSuite.load(self.filename)
-        data = [self.encode_benchmark(bench)
-                for bench in suite]
-        data = dict(json=json.dumps(data))
+            return ("cannot upload, %s file ready exists!"
+                    % self.upload_filename)
 
-        url = self.conf.url
-        if not url.endswith('/'):
-            url += '/'
-        url += 'result/add/json/'
-        self.logger.error("Upload %s benchmarks to %s" % (len(suite), url))
+        return None
 
-        try:
-            response = urlopen(data=urlencode(data).encode('utf-8'), url=url)
-            body = response.read()
-            response.close()
-        except HTTPError as err:
-            self.logger.error("HTTP Error: %s" % err)
-            errmsg = err.read().decode('utf8')
-            self.logger.error(errmsg)
-            err.close()
-            return
+    def check_upload(self):
+        error = self.get_upload_error()
+        if error:
+            self.logger.error("ERROR: %s" % error)
+            sys.exit(1)
 
-        self.logger.error('Response: "%s"' % body.decode('utf-8'))
+    def encode_results(self):
+        suite = pyperf.BenchmarkSuite.load(self.filename)
+        return [self.encode_benchmark(bench) for bench in suite]
 
+    def mark_uploaded(self):
+        self.safe_makedirs(self.conf.uploaded_json_dir)
         self.logger.error("Move %s to %s"
                           % (self.filename, self.upload_filename))
         os.rename(self.filename, self.upload_filename)
-
         self.uploaded = True
 
+    def upload(self):
+        self.check_upload()
+
+        queue = UploadQueue(self.conf.url,
+                            batch_size=self.conf.upload_batch_size,
+                            retries=self.conf.upload_retries)
+        queue.add(self.filename, self.encode_results())
+        if self.filename in queue.flush():
+            self.mark_uploaded()
+
     def perf_system_tune(self):
         pythonpath = os.environ.get('PYTHONPATH')
         args = ['-m', 'pyperf', 'system', 'tune']
-        if self.conf.affinity:
+        if self.conf.cpu_sets:
+            cpus = parse_cpu_list(self.conf.cpu_sets)
+            args.extend(('--affinity', format_cpu_list(cpus)))
+        elif self.conf.affinity:
             args.extend(('--affinity', self.conf.affinity))
         if pythonpath:
             cmd = ('PYTHONPATH=%s %s %s'
@@ -667,18 +911,32 @@ class BenchmarkRevision(Application):
             self.logger.error("Disable upload if Python is not installed")
             self.conf.upload = False
 
-        if self.conf.system_tune:
+        if getattr(self.options, 'no_upload', False) and self.conf.upload:
+            self.logger.error("Don't upload: compile_all uploads results")
+            self.conf.upload = False
+
+        if self.conf.system_tune and self.stage != 'build':
             self.perf_system_tune()
 
     def compile_bench(self):
         self.python = Python(self, self.conf)
 
-        try:
-            self.compile_install()
-        except SystemExit:
-            sys.exit(EXIT_COMPILE_ERROR)
+        if self.stage == 'bench':
+            # Python and the venv were created by the build stage
+            self.python.program = self.python.get_program()
+            if not os.path.exists(self.python.program):
+                self.logger.error("ERROR: %s does not exist: run the "
+                                  "build stage first" % self.python.program)
+                sys.exit(EXIT_COMPILE_ERROR)
+        else:
+            try:
+                self.compile_install()
+            except SystemExit:
+                sys.exit(EXIT_COMPILE_ERROR)
 
-        self.create_venv()
+            self.create_venv()
+            if self.stage == 'build':
+                return False
 
         failed = self.run_benchmark()
         if not failed and self.conf.upload:
@@ -695,7 +953,10 @@ class BenchmarkRevision(Application):
         dt = datetime.timedelta(seconds=dt)
         self.logger.error("Benchmark completed in %s" % dt)
 
-        if self.uploaded:
+        if self.stage == 'build':
+            self.logger.error("Python and its virtual environment are ready "
+                              "to be benchmarked")
+        elif self.uploaded:
             self.logger.error("Benchmark results uploaded and written into %s"
                               % self.upload_filename)
         elif failed:
@@ -713,7 +974,7 @@ class Configuration:
     pass
 
 
-def parse_config(filename, command):
+def parse_config(filename, command, slot=None):
     parse_compile = False
     parse_compile_all = False
     if command == 'compile_all':
@@ -754,6 +1015,8 @@ def parse_config(filename, command):
     conf.json_patch_dir = os.path.join(conf.json_dir, 'patch')
     conf.uploaded_json_dir = os.path.join(conf.json_dir, 'uploaded')
     conf.debug = getboolean('config', 'debug', False)
+    conf.results_db = os.path.expanduser(getstr('config', 'results_db',
+                                                default=''))
 
     if parse_compile:
         # [scm]
@@ -767,17 +1030,47 @@ def parse_config(filename, command):
         conf.pgo = getboolean('compile', 'pgo', True)
         conf.install = getboolean('compile', 'install', True)
         conf.pkg_only = getstr('compile', 'pkg_only', '').split()
+        jobs = getstr('compile', 'jobs', default='')
+        if jobs:
+            conf.jobs = int(jobs)
+        elif hasattr(os, 'sched_getaffinity'):
+            # Only use the CPUs of the process: the build stage of the
+            # pipeline mode is pinned to housekeeping_cpus by taskset
+            conf.jobs = len(os.sched_getaffinity(0))
+        else:
+            conf.jobs = os.cpu_count() or 1
+        conf.ccache = getboolean('compile', 'ccache', False)
+        conf.ccache_dir = os.path.expanduser(
+            getstr('compile', 'ccache_dir', default=''))
+        conf.incremental = getboolean('compile', 'incremental', False)
+        conf.prefix_cache = getboolean('compile', 'prefix_cache', False)
+        conf.prefix_cache_dir = os.path.expanduser(
+            getstr('compile', 'prefix_cache_dir', default=''))
+        conf.prefix_cache_size = parse_size(
+            getstr('compile', 'prefix_cache_size', default='10G'))
 
         # [run_benchmark]
         conf.system_tune = getboolean('run_benchmark', 'system_tune', True)
         conf.benchmarks = getstr('run_benchmark', 'benchmarks', default='')
         conf.affinity = getstr('run_benchmark', 'affinity', default='')
+        conf.cpu_sets = getstr('run_benchmark', 'cpu_sets', default='')
         conf.upload = getboolean('run_benchmark', 'upload', False)
 
         # paths
-        conf.build_dir = os.path.join(conf.directory, 'build')
-        conf.prefix = os.path.join(conf.directory, 'prefix')
-        conf.venv = os.path.join(conf.directory, 'venv')
+        if slot:
+            # Revisions built while another revision is benchmarked use
+            # their own directories
+            work_dir = os.path.join(conf.directory, slot)
+        else:
+            work_dir = conf.directory
+        conf.build_dir = os.path.join(work_dir, 'build')
+        conf.prefix = os.path.join(work_dir, 'prefix')
+        conf.venv = os.path.join(work_dir, 'venv')
+        if not conf.ccache_dir:
+            conf.ccache_dir = os.path.join(conf.directory, 'ccache')
+        if not conf.prefix_cache_dir:
+            conf.prefix_cache_dir = os.path.join(conf.directory,
+                                                 'prefix_cache')
 
         check_upload = conf.upload
     else:
@@ -790,6 +1083,10 @@ def parse_config(filename, command):
     conf.executable = getstr('upload', 'executable', default='')
     conf.project = getstr('upload', 'project', default='')
     conf.environment = getstr('upload', 'environment', default='')
+    conf.upload_batch_size = int(getstr('upload', 'batch_size',
+                                        default=str(BATCH_SIZE)))
+    conf.upload_retries = int(getstr('upload', 'retries',
+                                     default=str(RETRIES)))
 
     if check_upload and any(not getattr(conf, attr) for attr in UPLOAD_OPTIONS):
         print("ERROR: Upload requires to set the following "
@@ -806,6 +1103,27 @@ def parse_config(filename, command):
     if parse_compile_all:
         # [compile_all]
         conf.branches = getstr('compile_all', 'branches', '').split()
+        conf.pipeline = getboolean('compile_all', 'pipeline', False)
+        conf.housekeeping_cpus = getstr('compile_all', 'housekeeping_cpus',
+                                        default='')
+        if conf.pipeline and not conf.housekeeping_cpus:
+            # An unpinned build would run on the CPUs of the benchmarks
+            print("ERROR: pipeline of %s requires to set housekeeping_cpus "
+                  "in the [compile_all] section" % filename)
+            sys.exit(1)
+        if conf.pipeline and not (conf.cpu_sets or conf.affinity):
+            print("ERROR: pipeline of %s requires to set affinity or "
+                  "cpu_sets in the [run_benchmark] section, disjoint from "
+                  "housekeeping_cpus" % filename)
+            sys.exit(1)
+        if conf.housekeeping_cpus:
+            housekeeping = set(parse_cpu_list(conf.housekeeping_cpus))
+            bench_cpus = set(parse_cpu_list(conf.cpu_sets or conf.affinity))
+            if housekeeping & bench_cpus:
+                print("ERROR: housekeeping_cpus of %s must not contain "
+                      "benchmark CPUs: %s"
+                      % (filename, format_cpu_list(housekeeping & bench_cpus)))
+                sys.exit(1)
         conf.revisions = []
         try:
             revisions = cfgobj.items('compile_all_revisions')
@@ -841,24 +1159,90 @@ class BenchmarkAll(Application):
         self.failed = []
         self.timings = []
         self.logger = logging.getLogger()
-
-    def benchmark(self, revision, branch):
+        # Results of all revisions are uploaded at the end, in batches
+        self.upload_queue = None
+        if self.conf.upload and self.conf.install and not self.conf.debug:
+            self.upload_queue = UploadQueue(
+                self.conf.url,
+                batch_size=self.conf.upload_batch_size,
+                retries=self.conf.upload_retries)
+        # filename => (key, BenchmarkRevision) of queued results
+        self.queued = {}
+
+    def get_key(self, revision, branch):
         if branch:
-            key = '%s-%s' % (branch, revision)
+            return '%s-%s' % (branch, revision)
         else:
-            key = revision
-
+            return revision
+
+    def get_compile_cmd(self, revision, branch, *args, update=None,
+                        tune=None):
+        """Get the compile command of a revision.
+
+        update and tune default to the update and system_tune options: the
+        builder thread of the pipeline passes them explicitly, to not share
+        the configuration with the main thread.
+        """
+        if update is None:
+            update = self.conf.update
+        if tune is None:
+            tune = self.conf.system_tune
         cmd = [sys.executable, '-m', 'pyperformance', 'compile',
                self.config_filename, revision, branch]
-        if not self.conf.update:
+        if not update:
             cmd.append('--no-update')
-        if not self.conf.system_tune:
+        if not tune:
             cmd.append('--no-tune')
+        if self.conf.upload:
+            cmd.append('--no-upload')
+        cmd.extend(args)
+        return cmd
 
-        self.start = time.monotonic()
-        exitcode = self.run_nocheck(*cmd, log_stdout=False)
-        dt = time.monotonic() - self.start
+    def list_results(self):
+        try:
+            return set(os.listdir(self.conf.json_dir))
+        except FileNotFoundError:
+            return set()
+
+    def queue_results(self, key, old_results):
+        """Queue the results written since old_results was listed.
+
+        Errors are logged: they must not stop the revisions in progress.
+        """
+        if self.upload_queue is None:
+            return
+        for name in sorted(self.list_results() - old_results):
+            if not name.endswith('.json.gz'):
+                continue
+            filename = os.path.join(self.conf.json_dir, name)
+            try:
+                bench = load_revision(self.conf, filename, self.options)
+                error = bench.get_upload_error()
+                if not error:
+                    self.upload_queue.add(filename, bench.encode_results())
+            except Exception as exc:
+                error = "failed to load %s: %s" % (filename, exc)
+            if error:
+                self.logger.error("ERROR: %s" % error)
+                self.failed.append(key)
+                continue
+            self.queued[filename] = (key, bench)
+
+    def upload(self):
+        if not self.queued:
+            return
+        uploaded = set(self.upload_queue.flush())
+        for filename, (key, bench) in sorted(self.queued.items()):
+            if filename in uploaded:
+                bench.mark_uploaded()
+                self.outputs.remove(key)
+                self.uploaded.append(key)
+            else:
+                self.logger.error("ERROR: failed to upload %s" % filename)
+                self.failed.append(key)
+        self.queued.clear()
 
+    def handle_exitcode(self, key, exitcode, dt, tuned=True):
         if exitcode:
             self.logger.error("Benchmark exit code: %s" % exitcode)
 
@@ -870,7 +1254,7 @@ class BenchmarkAll(Application):
         # compile, venv and bench errors occur after repository update
         # and system tune
         if exitcode >= EXIT_COMPILE_ERROR:
-            if self.conf.system_tune:
+            if self.conf.system_tune and tuned:
                 # only tune the system once
                 self.conf.system_tune = False
 
@@ -879,14 +1263,88 @@ class BenchmarkAll(Application):
                 self.conf.update = False
 
         if exitcode == 0:
-            if self.conf.upload:
-                self.uploaded.append(key)
-            else:
-                self.outputs.append(key)
+            # moved to uploaded by upload()
+            self.outputs.append(key)
             self.timings.append(dt)
         else:
             self.failed.append(key)
 
+    def benchmark(self, revision, branch):
+        key = self.get_key(revision, branch)
+        cmd = self.get_compile_cmd(revision, branch)
+
+        results = self.list_results()
+        self.start = time.monotonic()
+        exitcode = self.run_nocheck(*cmd, log_stdout=False)
+        dt = time.monotonic() - self.start
+
+        self.handle_exitcode(key, exitcode, dt)
+        if not exitcode:
+            self.queue_results(key, results)
+
+    def build_revisions(self, revisions, free_slots, built, update):
+        # Run in the builder thread: don't modify self.conf, and only read
+        # options which are not modified by the main thread
+        for revision, branch in revisions:
+            slot = free_slots.get()
+            # the build stage doesn't tune the system
+            cmd = self.get_compile_cmd(revision, branch,
+                                       '--stage', 'build', '--slot', slot,
+                                       update=update, tune=False)
+            if self.conf.housekeeping_cpus:
+                cmd = ['taskset', '-c', self.conf.housekeeping_cpus] + cmd
+
+            start = time.monotonic()
+            try:
+                exitcode = self.run_nocheck(*cmd, log_stdout=False)
+            except Exception:
+                # don't block the benchmark loop
+                self.logger.exception("Build of %s failed" % revision)
+                exitcode = 1
+            dt = time.monotonic() - start
+            # the repository is updated by the first build
+            update = False
+            built.put((revision, branch, slot, exitcode, dt))
+
+    def pipeline(self, revisions):
+        """Build the next revision while the current revision is benchmarked.
+
+        Each revision in progress uses its own slot directory: the builder
+        waits until a slot is free.
+        """
+        free_slots = queue.Queue()
+        for slot in ('slot-0', 'slot-1'):
+            free_slots.put(slot)
+        built = queue.Queue()
+        builder = threading.Thread(target=self.build_revisions,
+                                   args=(revisions, free_slots, built,
+                                         self.conf.update),
+                                   daemon=True)
+        builder.start()
+
+        for _ in revisions:
+            revision, branch, slot, exitcode, build_dt = built.get()
+            key = self.get_key(revision, branch)
+            if exitcode:
+                free_slots.put(slot)
+                # the build stage doesn't tune the system
+                self.handle_exitcode(key, exitcode, build_dt, tuned=False)
+                continue
+
+            # the bench stage uses the Python built by the build stage
+            cmd = self.get_compile_cmd(revision, branch,
+                                       '--stage', 'bench', '--slot', slot,
+                                       update=False)
+            results = self.list_results()
+            start = time.monotonic()
+            exitcode = self.run_nocheck(*cmd, log_stdout=False)
+            dt = time.monotonic() - start
+            free_slots.put(slot)
+            self.handle_exitcode(key, exitcode, build_dt + dt)
+            if not exitcode:
+                self.queue_results(key, results)
+        builder.join()
+
     def report(self):
         for key in self.skipped:
             self.logger.error("Skipped: %s" % key)
@@ -931,13 +1389,20 @@ class BenchmarkAll(Application):
                               "configured for compile_all")
             sys.exit(1)
 
+        revisions = list(self.conf.revisions)
+        revisions.extend((branch, branch) for branch in self.conf.branches)
+        if self.upload_queue is not None:
+            # Upload options were checked by parse_config(): check that
+            # uploaded files can be moved before compiling anything
+            self.safe_makedirs(self.conf.uploaded_json_dir)
         try:
-            for revision, branch in self.conf.revisions:
-                self.benchmark(revision, branch)
-
-            for branch in self.conf.branches:
-                self.benchmark(branch, branch)
+            if self.conf.pipeline:
+                self.pipeline(revisions)
+            else:
+                for revision, branch in revisions:
+                    self.benchmark(revision, branch)
         finally:
+            self.upload()
             self.report()
             if self.timings:
                 self.report_timings()
@@ -946,8 +1411,208 @@ class BenchmarkAll(Application):
             sys.exit(1)
 
 
+def is_regression(base, changed, threshold):
+    """Is changed slower than base by more than threshold (ex: 0.05)?
+
+    Raise a ValueError if the significance cannot be computed, like with
+    single values (--debug-single-value).
+    """
+    values1 = base.get_values()
+    values2 = changed.get_values()
+    try:
+        significant = is_significant(values1, values2)[0]
+    except (ValueError, ZeroDivisionError) as exc:
+        raise ValueError("cannot check if %s is significant (%s values "
+                         "vs %s values: %s), rerun without "
+                         "--debug-single-value (debug option)"
+                         % (base.get_name(), len(values1), len(values2),
+                            exc))
+    slowdown = changed.mean() / base.mean() - 1.0
+    return significant and slowdown >= threshold
+
+
+def bisect_revisions(revisions, test):
+    """Binary search of the first bad revision.
+
+    revisions are ordered from the oldest to the newest: the last one is
+    bad. test(revision, left), where left is the number of revisions left
+    to test, returns 'good', 'bad' or 'skipped' if the revision cannot be
+    tested. Return (lo, hi): revisions[hi] is bad, and
+    revisions[lo:hi] are skipped revisions which may be the first bad
+    revision.
+    """
+    # revisions[lo] may be good, revisions[hi] is bad
+    lo = 0
+    hi = len(revisions) - 1
+    candidates = list(range(lo, hi))
+    while candidates:
+        mid = candidates[len(candidates) // 2]
+        verdict = test(revisions[mid], len(candidates))
+        if verdict == 'skipped':
+            candidates.remove(mid)
+            continue
+        if verdict == 'bad':
+            hi = mid
+        else:
+            lo = mid + 1
+        candidates = [index for index in candidates if lo <= index < hi]
+    return (lo, hi)
+
+
+class BenchmarkBisect(Application):
+    """Binary search of the first commit introducing a regression."""
+
+    def __init__(self, config_filename, good, bad, options):
+        conf = parse_config(config_filename, "compile")
+        conf.benchmarks = options.benchmarks
+        conf.upload = False
+        if options.no_update:
+            conf.update = False
+        if options.no_tune:
+            conf.system_tune = False
+        super().__init__(conf, options)
+        self.safe_makedirs(self.conf.directory)
+        self.setup_log('bisect-%s-%s' % (good, bad))
+        self.good = good
+        self.bad = bad
+        # minimum slowdown, ex: 0.05 for 5%
+        self.threshold = options.threshold / 100.0
+        self.repository = Repository(self, conf.repo_dir)
+        # list of (revision, verdict) tuples
+        self.steps = []
+
+    def benchmark(self, revision):
+        """Compile revision and run benchmarks: return a BenchmarkSuite.
+
+        Return None if the revision cannot be compiled or benchmarked.
+        """
+        bench = BenchmarkRevision(self.conf, revision, setup_log=False,
+                                  options=self.options)
+        if not os.path.exists(bench.filename):
+            if self.conf.system_tune:
+                bench.perf_system_tune()
+                # only tune the system once
+                self.conf.system_tune = False
+            bench.python = Python(bench, self.conf)
+            try:
+                bench.compile_install()
+                bench.create_venv()
+                bench.run_benchmark()
+            except SystemExit as exc:
+                self.logger.error("Failed to benchmark %s: exit code %s"
+                                  % (revision, exc.code))
+            # Only update the repository once
+            self.conf.update = False
+        else:
+            self.logger.error("Reuse results of %s" % bench.filename)
+
+        if not os.path.exists(bench.filename):
+            return None
+        return pyperf.BenchmarkSuite.load(bench.filename)
+
+    def get_regressions(self, base_suite, suite, names):
+        regressions = []
+        for name in names:
+            try:
+                base = base_suite.get_benchmark(name)
+                changed = suite.get_benchmark(name)
+            except KeyError:
+                continue
+            try:
+                regression = is_regression(base, changed, self.threshold)
+            except ValueError as exc:
+                self.logger.error("ERROR: %s" % exc)
+                sys.exit(1)
+            if regression:
+                regressions.append(name)
+        return regressions
+
+    def record_verdict(self, revision, suite, verdict):
+        self.steps.append((revision, verdict))
+        self.logger.error("Revision %s is %s" % (revision, verdict))
+        if suite is None:
+            return
+        for bench in suite:
+            bench.update_metadata({'bisect_verdict': verdict})
+        suite.dump(suite.filename, replace=True)
+
+    def main(self):
+        self.logger.error("Bisect the regression between %s (good) and %s "
+                          "(bad) with threshold %.1f%%"
+                          % (self.good, self.bad, self.threshold * 100))
+        if self.log_filename:
+            self.logger.error("Write logs into %s" % self.log_filename)
+
+        if self.conf.update:
+            self.repository.fetch()
+            self.conf.update = False
+        good = self.repository.get_output('git', 'rev-parse', '--verify',
+                                          '%s^{commit}' % self.good)
+        bad = self.repository.get_output('git', 'rev-parse', '--verify',
+                                         '%s^{commit}' % self.bad)
+        # Results are written in a dedicated directory: they only contain
+        # the bisected benchmarks
+        self.conf.json_dir = os.path.join(self.conf.json_dir, 'bisect',
+                                          '%s-%s' % (good[:12], bad[:12]))
+        # Oldest commit first; first parents to get a linear history
+        stdout = self.repository.get_output('git', 'rev-list', '--reverse',
+                                            '--first-parent',
+                                            '%s..%s' % (good, bad))
+        revisions = stdout.split()
+        if not revisions:
+            self.logger.error("ERROR: %s is not an ancestor of %s"
+                              % (self.good, self.bad))
+            sys.exit(1)
+
+        good_suite = self.benchmark(good)
+        bad_suite = self.benchmark(revisions[-1])
+        if good_suite is None or bad_suite is None:
+            self.logger.error("ERROR: failed to benchmark the good or "
+                              "the bad revision")
+            sys.exit(1)
+
+        names = self.get_regressions(good_suite, bad_suite,
+                                     good_suite.get_benchmark_names())
+        if not names:
+            self.logger.error("ERROR: no benchmark is slower by more than "
+                              "%.1f%% in %s" % (self.threshold * 100,
+                                                self.bad))
+            sys.exit(1)
+        self.logger.error("Regressions: %s" % ', '.join(sorted(names)))
+        self.record_verdict(good, good_suite, 'good')
+        self.record_verdict(revisions[-1], bad_suite, 'bad')
+
+        def test(revision, left):
+            self.logger.error("Bisect: %s revisions left to test" % left)
+            suite = self.benchmark(revision)
+            if suite is None:
+                # Skip revisions which cannot be benchmarked
+                verdict = 'skipped'
+            elif self.get_regressions(good_suite, suite, names):
+                verdict = 'bad'
+            else:
+                verdict = 'good'
+            self.record_verdict(revision, suite, verdict)
+            return verdict
+
+        lo, hi = bisect_revisions(revisions, test)
+
+        self.logger.error("")
+        for revision, verdict in self.steps:
+            self.logger.error("%s: %s" % (revision, verdict))
+        first_bad = revisions[hi]
+        if lo < hi:
+            # revisions between lo and hi were skipped
+            self.logger.error("First bad revision: %s or one of the skipped "
+                              "revisions: %s"
+                              % (first_bad, ', '.join(revisions[lo:hi])))
+        else:
+            self.logger.error("First bad revision: %s" % first_bad)
+        self.logger.error("Results written into %s" % self.conf.json_dir)
+
+
 def cmd_compile(options):
-    conf = parse_config(options.config_file, "compile")
+    conf = parse_config(options.config_file, "compile", slot=options.slot)
     if options is not None:
         if options.no_update:
             conf.update = False
@@ -958,22 +1623,47 @@ def cmd_compile(options):
     bench.main()
 
 
-def cmd_upload(options):
-    conf = parse_config(options.config_file, "upload")
-
-    filename = options.json_file
-    bench = pyperf.BenchmarkSuite.load(filename)
-    metadata = bench.get_metadata()
+def load_revision(conf, filename, options):
+    """Create a BenchmarkRevision to upload an existing JSON file."""
+    suite = pyperf.BenchmarkSuite.load(filename)
+    metadata = suite.get_metadata()
     revision = metadata['commit_id']
     branch = metadata['commit_branch']
     commit_date = parse_date(metadata['commit_date'])
+    return BenchmarkRevision(conf, revision, branch,
+                             filename=filename, commit_date=commit_date,
+                             setup_log=False, options=options)
 
-    bench = BenchmarkRevision(conf, revision, branch,
-                              filename=filename, commit_date=commit_date,
-                              setup_log=False, options=options)
-    bench.upload()
+
+def cmd_upload(options):
+    conf = parse_config(options.config_file, "upload")
+
+    queue = UploadQueue(conf.url,
+                        batch_size=conf.upload_batch_size,
+                        retries=conf.upload_retries)
+    revisions = {}
+    for filename in options.json_files:
+        bench = load_revision(conf, filename, options)
+        bench.check_upload()
+        queue.add(filename, bench.encode_results())
+        revisions[filename] = bench
+
+    uploaded = queue.flush()
+    for filename in uploaded:
+        revisions[filename].mark_uploaded()
+
+    if len(uploaded) != len(revisions):
+        print("ERROR: failed to upload %s files"
+              % (len(revisions) - len(uploaded)))
+        sys.exit(1)
 
 
 def cmd_compile_all(options):
     bench = BenchmarkAll(options.config_file, options=options)
     bench.main()
+
+
+def cmd_bisect(options):
+    bisect = BenchmarkBisect(options.config_file, options.good, options.bad,
+                             options=options)
+    bisect.main()
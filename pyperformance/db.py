@@ -0,0 +1,376 @@
+"""Local SQLite database of benchmark results.
+
+"pyperformance db import" ingests pyperf JSON files (for example the json_dir
+of compile_all) into a SQLite database, to query the history of a benchmark
+or compare two revisions without loading every JSON file.
+
+The suites table has one row per imported file, indexed by commit, branch,
+commit date, host and run date. The results table has one row per benchmark
+of a suite with precomputed statistics; all values of the benchmark are
+stored in a single BLOB column as little-endian doubles.
+"""
+import array
+import datetime
+import hashlib
+import os.path
+import sqlite3
+import sys
+
+from pyperformance.utils import get_cache_dir
+
+
+# Stored in PRAGMA user_version
+DB_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE suites (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    commit_id TEXT,
+    branch TEXT,
+    commit_date TEXT,
+    host TEXT,
+    date TEXT,
+    python_version TEXT,
+    performance_version TEXT
+);
+CREATE INDEX suites_commit ON suites (commit_id);
+CREATE INDEX suites_branch ON suites (branch, commit_date);
+CREATE INDEX suites_commit_date ON suites (commit_date);
+CREATE INDEX suites_host ON suites (host, commit_date);
+CREATE INDEX suites_date ON suites (date);
+
+CREATE TABLE results (
+    id INTEGER PRIMARY KEY,
+    suite_id INTEGER NOT NULL REFERENCES suites (id) ON DELETE CASCADE,
+    benchmark TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    nvalue INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    median REAL NOT NULL,
+    stdev REAL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    vals BLOB NOT NULL
+);
+CREATE INDEX results_benchmark ON results (benchmark, suite_id);
+CREATE UNIQUE INDEX results_suite ON results (suite_id, benchmark);
+"""
+
+_RESULT_COLUMNS = ('suites.commit_id, suites.branch, suites.commit_date, '
+                   'suites.host, suites.date, results.benchmark, '
+                   'results.unit, results.nvalue, results.mean, '
+                   'results.stdev')
+
+_UNIT_SCALES = {
+    'second': ((1.0, 'sec'), (1e-3, 'ms'), (1e-6, 'us'), (1e-9, 'ns')),
+    'byte': ((1024.0 ** 3, 'GiB'), (1024.0 ** 2, 'MiB'),
+             (1024.0, 'KiB'), (1.0, 'bytes')),
+}
+
+
+def get_db_filename():
+    return os.path.join(get_cache_dir(), 'results.db')
+
+
+def encode_values(values):
+    values = array.array('d', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode_values(data):
+    values = array.array('d')
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tolist()
+
+
+def format_value(unit, value):
+    for scale, name in _UNIT_SCALES.get(unit, ()):
+        if abs(value) >= scale:
+            break
+    else:
+        return '%.3g' % value
+    return '%.3g %s' % (value / scale, name)
+
+
+def get_file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_json_files(paths):
+    """Yield JSON files of paths: directories are walked recursively."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(('.json', '.json.gz')):
+                    yield os.path.join(dirpath, name)
+
+
+class ResultsDB(object):
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = get_db_filename()
+        self.filename = filename
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self._init_schema()
+
+    def _init_schema(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == DB_VERSION:
+            return
+        if version:
+            self.close()
+            raise ValueError("%s: unsupported database version %s"
+                             % (self.filename, version))
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute('PRAGMA user_version = %d' % DB_VERSION)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def import_file(self, filename):
+        """Import a pyperf JSON file.
+
+        Return the number of imported benchmarks, or None if the file was
+        already imported.
+        """
+        # Use lazy import: query commands don't need pyperf
+        from pyperformance.stream import load_suite
+
+        digest = get_file_digest(filename)
+        row = self.conn.execute('SELECT id FROM suites WHERE digest = ?',
+                                (digest,)).fetchone()
+        if row is not None:
+            return None
+
+        suite = load_suite(filename)
+        metadata = suite.get_metadata()
+        dates = suite.get_dates()
+        date = dates[0].isoformat(' ') if dates else None
+
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO suites (filename, digest, commit_id, branch, '
+                'commit_date, host, date, python_version, '
+                'performance_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(filename), digest,
+                 metadata.get('commit_id'), metadata.get('commit_branch'),
+                 metadata.get('commit_date'), metadata.get('hostname'),
+                 date, metadata.get('python_version'),
+                 metadata.get('performance_version')))
+            suite_id = cursor.lastrowid
+
+            rows = []
+            for bench in suite.get_benchmarks():
+                values = bench.get_values()
+                if not values:
+                    continue
+                stdev = bench.stdev() if len(values) >= 2 else None
+                rows.append((suite_id, bench.get_name(), bench.get_unit(),
+                             len(values), bench.mean(), bench.median(),
+                             stdev, min(values), max(values),
+                             encode_values(values)))
+            self.conn.executemany(
+                'INSERT INTO results (suite_id, benchmark, unit, nvalue, '
+                'mean, median, stdev, min, max, vals) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def _filters(self, benchmarks=None, branch=None, host=None, since=None,
+                 until=None, commits=None):
+        where = []
+        params = []
+        if benchmarks:
+            where.append('results.benchmark IN (%s)'
+                         % ', '.join('?' * len(benchmarks)))
+            params.extend(benchmarks)
+        if branch:
+            where.append('suites.branch = ?')
+            params.append(branch)
+        if host:
+            where.append('suites.host = ?')
+            params.append(host)
+        if since:
+            where.append('COALESCE(suites.commit_date, suites.date) >= ?')
+            params.append(since)
+        if until:
+            try:
+                day = datetime.datetime.strptime(until, '%Y-%m-%d')
+            except ValueError:
+                where.append('COALESCE(suites.commit_date, suites.date) <= ?')
+                params.append(until)
+            else:
+                # Dates are ISO 8601 timestamps: include the whole day
+                day += datetime.timedelta(days=1)
+                where.append('COALESCE(suites.commit_date, suites.date) < ?')
+                params.append(day.strftime('%Y-%m-%d'))
+        if commits:
+            # GLOB is case sensitive and so can use the commit index
+            where.append('(%s)' % ' OR '.join(['suites.commit_id GLOB ?']
+                                              * len(commits)))
+            params.extend(commit + '*' for commit in commits)
+        return where, params
+
+    def query(self, limit=None, **filters):
+        """Get results ordered by commit date, then by run date.
+
+        Return a list of tuples: (commit_id, branch, commit_date, host,
+        date, benchmark, unit, nvalue, mean, stdev). With limit, only return
+        the limit most recent results.
+        """
+        where, params = self._filters(**filters)
+        sql = ('SELECT %s FROM results JOIN suites '
+               'ON suites.id = results.suite_id' % _RESULT_COLUMNS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += (' ORDER BY COALESCE(suites.commit_date, suites.date) DESC, '
+                'suites.date DESC, results.benchmark DESC')
+        if limit:
+            sql += ' LIMIT %d' % limit
+        rows = self.conn.execute(sql, params).fetchall()
+        rows.reverse()
+        return rows
+
+    def get_values(self, commit, benchmark, host=None):
+        """Get all values of a benchmark on a commit, of all its runs."""
+        where, params = self._filters(benchmarks=[benchmark], host=host,
+                                      commits=[commit])
+        sql = ('SELECT results.vals FROM results JOIN suites '
+               'ON suites.id = results.suite_id WHERE ' + ' AND '.join(where))
+        values = []
+        for row in self.conn.execute(sql, params):
+            values.extend(decode_values(row[0]))
+        return values
+
+    def compare(self, commit1, commit2, benchmarks=None, host=None):
+        """Compare the mean of benchmarks on two commits.
+
+        Return a list of (benchmark, unit, mean1, mean2) tuples of
+        benchmarks run on both commits. If a commit has multiple runs, the
+        mean of all their values is used.
+        """
+        means = []
+        for commit in (commit1, commit2):
+            where, params = self._filters(benchmarks=benchmarks, host=host,
+                                          commits=[commit])
+            sql = ('SELECT results.benchmark, results.unit, '
+                   'SUM(results.mean * results.nvalue) / SUM(results.nvalue) '
+                   'FROM results JOIN suites '
+                   'ON suites.id = results.suite_id WHERE %s '
+                   'GROUP BY results.benchmark, results.unit'
+                   % ' AND '.join(where))
+            means.append({(name, unit): mean for name, unit, mean
+                          in self.conn.execute(sql, params)})
+
+        common = sorted(set(means[0]) & set(means[1]))
+        return [(name, unit, means[0][(name, unit)], means[1][(name, unit)])
+                for name, unit in common]
+
+
+def cmd_db_import(db, options):
+    imported = 0
+    skipped = 0
+    for filename in iter_json_files(options.paths):
+        try:
+            count = db.import_file(filename)
+        except (OSError, ValueError, KeyError) as exc:
+            print("ERROR: failed to import %s: %s" % (filename, exc))
+            sys.exit(1)
+        if count is None:
+            skipped += 1
+        else:
+            imported += 1
+            print("Imported %s benchmarks of %s" % (count, filename))
+    print("Imported %s files into %s (%s files already imported)"
+          % (imported, db.filename, skipped))
+
+
+def display_history(rows):
+    for row in rows:
+        (commit_id, branch, commit_date, host, date, name, unit, nvalue,
+         mean, stdev) = row
+        text = format_value(unit, mean)
+        if stdev is not None:
+            text = '%s +- %s' % (text, format_value(unit, stdev))
+        revision = (commit_id or '-')[:12]
+        print('%s %s %s %s: %s (%s values, %s)'
+              % (commit_date or date or '-', revision, branch or '-', name,
+                 text, nvalue, host or '-'))
+
+
+def display_comparison(commit1, commit2, rows):
+    if not rows:
+        print("No benchmark run on both %s and %s" % (commit1, commit2))
+        return
+    width = max(len(row[0]) for row in rows)
+    for name, unit, mean1, mean2 in rows:
+        if mean1 and mean2:
+            ratio = mean2 / mean1
+            if unit != 'second':
+                delta = '%.2fx' % ratio
+            elif ratio >= 1:
+                delta = '%.2fx slower' % ratio
+            else:
+                delta = '%.2fx faster' % (1 / ratio)
+        else:
+            delta = 'incomparable (one result was zero)'
+        print('%s: %s -> %s: %s'
+              % (name.ljust(width), format_value(unit, mean1),
+                 format_value(unit, mean2), delta))
+
+
+def cmd_db_query(db, options):
+    benchmarks = options.benchmarks
+    if options.compare:
+        commit1, commit2 = options.compare
+        rows = db.compare(commit1, commit2, benchmarks=benchmarks,
+                          host=options.host)
+        display_comparison(commit1, commit2, rows)
+        return
+
+    rows = db.query(benchmarks=benchmarks, branch=options.branch,
+                    host=options.host, since=options.since,
+                    until=options.until, commits=options.commits,
+                    limit=options.limit)
+    if not rows:
+        print("No result")
+        return
+    display_history(rows)
+
+
+def cmd_db(options):
+    try:
+        db = ResultsDB(options.db)
+    except (OSError, ValueError, sqlite3.Error) as exc:
+        print("ERROR: failed to open the results database: %s" % exc)
+        sys.exit(1)
+
+    with db:
+        if options.db_action == 'import':
+            cmd_db_import(db, options)
+        else:
+            cmd_db_query(db, options)
@@ -0,0 +1,267 @@
+"""Detect changepoints in the history of benchmark results.
+
+The history of a benchmark is the series of its means, one per revision,
+ordered by commit date: see the db command. Changepoints are the revisions
+where the mean of the series moves, found by PELT (Pruned Exact Linear
+Time, Killick et al. 2012) with a normal mean-shift cost.
+
+The cost of a segment is its sum of squared deviations divided by the noise
+variance, computed in constant time from prefix sums. The noise is
+estimated from the differences of consecutive revisions, which are not
+affected by mean shifts. Each changepoint gets a penalty of
+penalty * log(n).
+
+Each changepoint is reported with the relative change and the effect size
+(Cohen's d) between the segments before and after it, and the confidence
+of a Welch's t-test between these two segments.
+"""
+import math
+import statistics
+import sys
+
+from pyperformance.stats import welch_test
+
+
+# Penalty factor of a changepoint, multiplied by log(n)
+PENALTY = 2.0
+# Minimum number of revisions between two changepoints
+MIN_SIZE = 2
+# Minimum relative change in percent
+THRESHOLD = 1.0
+# Minimum confidence in percent
+CONFIDENCE = 95.0
+
+
+class Changepoint(object):
+    def __init__(self, benchmark, unit, index, revisions, before, after):
+        self.benchmark = benchmark
+        self.unit = unit
+        # index in revisions of the first revision after the change
+        self.index = index
+        self.commit_id, self.commit_date = revisions[index]
+        self.nbefore = len(before)
+        self.nafter = len(after)
+        self.mean_before = statistics.mean(before)
+        self.mean_after = statistics.mean(after)
+        if self.mean_before:
+            self.change = (self.mean_after / self.mean_before - 1.0) * 100
+        else:
+            self.change = math.inf
+        self.effect_size = cohen_d(before, after)
+        self.confidence = (1.0 - welch_test(before, after)[1]) * 100
+
+
+def cohen_d(sample1, sample2):
+    n1 = len(sample1)
+    n2 = len(sample2)
+    diff = statistics.mean(sample2) - statistics.mean(sample1)
+    squares = 0.0
+    if n1 >= 2:
+        squares += statistics.variance(sample1) * (n1 - 1)
+    if n2 >= 2:
+        squares += statistics.variance(sample2) * (n2 - 1)
+    df = n1 + n2 - 2
+    stdev = math.sqrt(squares / df) if df > 0 else 0.0
+    if not stdev:
+        return math.copysign(math.inf, diff) if diff else 0.0
+    return diff / stdev
+
+
+def estimate_noise(values):
+    """Estimate the standard deviation of the noise of a series.
+
+    Use the median absolute deviation of the differences of consecutive
+    values: a mean shift only changes one difference.
+    """
+    diffs = [y - x for x, y in zip(values, values[1:])]
+    if len(diffs) < 2:
+        return 0.0
+    center = statistics.median(diffs)
+    mad = statistics.median(abs(diff - center) for diff in diffs)
+    sigma = 1.4826 * mad / math.sqrt(2)
+    if not sigma:
+        sigma = statistics.stdev(values)
+    return sigma
+
+
+def pelt(values, penalty=PENALTY, min_size=MIN_SIZE):
+    """Find changepoints of the mean of values.
+
+    Return the sorted list of indexes of the first value of each new
+    segment.
+    """
+    n = len(values)
+    if n < 2 * min_size:
+        return []
+    sigma = estimate_noise(values)
+    if not sigma:
+        return []
+
+    # Prefix sums of the normalized values and of their squares
+    sum1 = [0.0]
+    sum2 = [0.0]
+    for value in values:
+        value /= sigma
+        sum1.append(sum1[-1] + value)
+        sum2.append(sum2[-1] + value * value)
+
+    def cost(start, end):
+        total = sum1[end] - sum1[start]
+        return (sum2[end] - sum2[start]) - total * total / (end - start)
+
+    beta = penalty * math.log(n)
+    best = [0.0] * (n + 1)
+    best[0] = -beta
+    last = [0] * (n + 1)
+    candidates = [0]
+    for end in range(min_size, n + 1):
+        start = end - min_size
+        if start >= min_size:
+            candidates.append(start)
+        costs = [best[start] + cost(start, end) for start in candidates]
+        index = min(range(len(costs)), key=costs.__getitem__)
+        best[end] = costs[index] + beta
+        last[end] = candidates[index]
+        # Prune starts which can never be optimal
+        candidates = [start for start, value in zip(candidates, costs)
+                      if value <= best[end]]
+
+    changepoints = []
+    end = n
+    while end > 0:
+        end = last[end]
+        if end:
+            changepoints.append(end)
+    changepoints.reverse()
+    return changepoints
+
+
+def detect_changepoints(benchmark, unit, revisions, values,
+                        penalty=PENALTY, min_size=MIN_SIZE,
+                        threshold=THRESHOLD, confidence=CONFIDENCE):
+    """Find the significant changepoints of the history of a benchmark.
+
+    revisions is a list of (commit_id, commit_date) tuples and values the
+    list of means of the benchmark on these revisions.
+    """
+    indexes = pelt(values, penalty, min_size)
+    while True:
+        bounds = [0] + indexes + [len(values)]
+        changepoints = [Changepoint(benchmark, unit, index, revisions,
+                                    values[start:index], values[index:end])
+                        for start, index, end
+                        in zip(bounds, bounds[1:], bounds[2:])]
+        rejected = [changepoint for changepoint in changepoints
+                    if abs(changepoint.change) < threshold
+                    or changepoint.confidence < confidence]
+        if not rejected:
+            return changepoints
+        # Merge the segments of the weakest changepoint and recompute
+        # the changes of its neighbors
+        weakest = min(rejected,
+                      key=lambda changepoint: abs(changepoint.effect_size))
+        indexes.remove(weakest.index)
+
+
+def get_histories(db, options):
+    """Get the history of each benchmark from the results database.
+
+    Return a dict: benchmark => (unit, revisions, values). If a revision has
+    multiple runs, the mean of all their values is used.
+    """
+    rows = db.query(benchmarks=options.benchmarks, branch=options.branch,
+                    host=options.host, since=options.since,
+                    until=options.until)
+    histories = {}
+    for row in rows:
+        (commit_id, branch, commit_date, host, date, name, unit, nvalue,
+         mean, stdev) = row
+        if not commit_id:
+            # changes can only be reported on commits
+            continue
+        revisions = histories.setdefault(name, (unit, {}))[1]
+        revision = revisions.setdefault(commit_id, [commit_date, 0, 0.0])
+        revision[1] += nvalue
+        revision[2] += mean * nvalue
+
+    result = {}
+    for name, (unit, revisions) in histories.items():
+        # rows are ordered by commit date and dict preserves insertion order
+        commits = [(commit_id, commit_date)
+                   for commit_id, (commit_date, nvalue, total)
+                   in revisions.items()]
+        values = [total / nvalue
+                  for commit_date, nvalue, total in revisions.values()]
+        result[name] = (unit, commits, values)
+    return result
+
+
+def format_changepoint(changepoint):
+    # Use lazy import: pyperformance.db is only needed by the command
+    from pyperformance.db import format_value
+
+    unit = changepoint.unit
+    if not changepoint.mean_before or not changepoint.mean_after:
+        delta = "incomparable (one result was zero)"
+    elif unit != 'second':
+        delta = "%.2fx" % (changepoint.mean_after / changepoint.mean_before)
+    elif changepoint.mean_after >= changepoint.mean_before:
+        delta = ("%.2fx slower"
+                 % (changepoint.mean_after / changepoint.mean_before))
+    else:
+        delta = ("%.2fx faster"
+                 % (changepoint.mean_before / changepoint.mean_after))
+    return ("%s (%s): %s -> %s: %s (%+.1f%%, d=%.1f, confidence %.1f%%, "
+            "%s revisions before, %s after)"
+            % (changepoint.commit_id[:12], changepoint.commit_date or '-',
+               format_value(unit, changepoint.mean_before),
+               format_value(unit, changepoint.mean_after),
+               delta, changepoint.change, changepoint.effect_size,
+               changepoint.confidence, changepoint.nbefore,
+               changepoint.nafter))
+
+
+def cmd_detect(options):
+    # Use lazy import: pyperformance.db imports sqlite3
+    from pyperformance.db import ResultsDB, iter_json_files
+
+    if options.paths:
+        # Import JSON files into a temporary database
+        db = ResultsDB(':memory:')
+        for filename in iter_json_files(options.paths):
+            try:
+                db.import_file(filename)
+            except (OSError, ValueError, KeyError) as exc:
+                print("ERROR: failed to import %s: %s" % (filename, exc))
+                sys.exit(1)
+    else:
+        try:
+            db = ResultsDB(options.db)
+        except (OSError, ValueError) as exc:
+            print("ERROR: failed to open the results database: %s" % exc)
+            sys.exit(1)
+
+    with db:
+        histories = get_histories(db, options)
+
+    nchangepoint = 0
+    nrevision = 0
+    for name, (unit, revisions, values) in sorted(histories.items()):
+        nrevision = max(nrevision, len(revisions))
+        changepoints = detect_changepoints(
+            name, unit, revisions, values,
+            penalty=options.penalty, min_size=options.min_size,
+            threshold=options.threshold, confidence=options.confidence)
+        if not changepoints:
+            continue
+        if nchangepoint:
+            print()
+        print("### %s ###" % name)
+        for changepoint in changepoints:
+            print(format_changepoint(changepoint))
+        nchangepoint += len(changepoints)
+
+    if nchangepoint:
+        print()
+    print("Detected %s changepoints in %s benchmarks (%s revisions)"
+          % (nchangepoint, len(histories), nrevision))
@@ -0,0 +1,113 @@
+"""History of benchmark runtimes, per host and per Python executable.
+
+Every "pyperformance run" records how long each benchmark took, to estimate
+the remaining time of serial runs and to start long benchmarks first in
+parallel runs. The history is stored in a JSON file:
+
+    {"version": 1,
+     "runtimes": {"<host> <python>": {"<mode>": {"<benchmark>": [seconds, ...]}}}}
+
+where mode describes the number of worker processes and values: runtimes of
+a --fast run are not comparable to runtimes of a --rigorous run.
+"""
+import json
+import os.path
+import platform
+import statistics
+
+from pyperformance.utils import get_cache_dir
+
+
+HISTORY_VERSION = 1
+# Number of runtimes kept per benchmark
+MAX_RUNTIMES = 5
+
+
+def get_history_filename():
+    return os.path.join(get_cache_dir(), 'history.json')
+
+
+def get_run_mode(options, sample_size=None):
+    """Describe the number of worker processes and values of a run.
+
+    sample_size is an optional (processes, values) tuple overriding the
+    options.
+    """
+    if options.debug_single_value:
+        mode = ['debug']
+    elif sample_size or options.processes or options.values:
+        processes, values = sample_size or (options.processes, options.values)
+        mode = ['processes=%s' % (processes or 'default'),
+                'values=%s' % (values or 'default')]
+    elif options.rigorous:
+        mode = ['rigorous']
+    elif options.fast:
+        mode = ['fast']
+    else:
+        mode = ['default']
+    if options.adaptive_ci:
+        mode.append('adaptive=%s' % options.adaptive_ci)
+    if options.warm_workers or options.hw_counters:
+        mode.append('warm')
+    return ','.join(mode)
+
+
+class RuntimeHistory(object):
+    """Runtimes of benchmarks run by a Python executable on this host."""
+
+    def __init__(self, python, filename=None):
+        if filename is None:
+            filename = get_history_filename()
+        self.filename = filename
+        self.key = '%s %s' % (platform.node(), os.path.realpath(python))
+        self.runtimes = self._load().get(self.key, {})
+
+    def _load(self):
+        try:
+            with open(self.filename, encoding='utf-8') as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            print("WARNING: failed to read the runtime history %s: %s"
+                  % (self.filename, exc))
+            return {}
+        if data.get('version') != HISTORY_VERSION:
+            return {}
+        return data.get('runtimes', {})
+
+    def get(self, name, mode):
+        """Get the expected runtime of a benchmark in seconds, or None."""
+        runtimes = self.runtimes.get(mode, {}).get(name)
+        if not runtimes:
+            return None
+        return statistics.median(runtimes)
+
+    def add(self, name, mode, runtime):
+        runtimes = self.runtimes.setdefault(mode, {}).setdefault(name, [])
+        runtimes.append(runtime)
+        del runtimes[:-MAX_RUNTIMES]
+
+    def save(self):
+        """Write the history, keeping runtimes of other hosts and Pythons.
+
+        Errors are only logged: the history is not required to run
+        benchmarks.
+        """
+        # Reload the file to not lose the runtimes written by a concurrent
+        # run of another Python
+        all_runtimes = self._load()
+        all_runtimes[self.key] = self.runtimes
+        data = {'version': HISTORY_VERSION, 'runtimes': all_runtimes}
+
+        tmp = '%s.tmp-%s' % (self.filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as fp:
+                json.dump(data, fp, sort_keys=True)
+            os.replace(tmp, self.filename)
+        except OSError as exc:
+            print("WARNING: failed to write the runtime history %s: %s"
+                  % (self.filename, exc))
+            if os.path.exists(tmp):
+                os.unlink(tmp)
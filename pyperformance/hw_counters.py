@@ -0,0 +1,177 @@
+"""Linux hardware performance counters of a process.
+
+Counters are opened with the perf_event_open() syscall, called with ctypes,
+on the current process and its threads. Only user space is counted, which is
+permitted with the default kernel.perf_event_paranoid setting (2).
+
+If the kernel has more counters than hardware counter slots, it multiplexes
+them: counts are scaled by the ratio of the time enabled to the time running.
+
+Counters can be opened disabled, and then only enabled around the code to
+measure, with the PERF_EVENT_IOC_ENABLE and PERF_EVENT_IOC_DISABLE ioctls.
+
+Only use the standard library: this module runs in the virtual environment.
+"""
+import ctypes
+import ctypes.util
+import fcntl
+import os
+import platform
+import struct
+import sys
+
+
+# perf_event_open() syscall numbers
+SYSCALLS = {
+    'x86_64': 298,
+    'i386': 336,
+    'i686': 336,
+    'aarch64': 241,
+    'arm64': 241,
+    'armv7l': 364,
+    'ppc64': 319,
+    'ppc64le': 319,
+    's390x': 331,
+    'riscv64': 241,
+}
+
+PERF_TYPE_HARDWARE = 0
+# (name, PERF_TYPE_HARDWARE config)
+EVENTS = (
+    ('instructions', 1),    # PERF_COUNT_HW_INSTRUCTIONS
+    ('cycles', 0),          # PERF_COUNT_HW_CPU_CYCLES
+    ('branch_misses', 5),   # PERF_COUNT_HW_BRANCH_MISSES
+    ('cache_misses', 3),    # PERF_COUNT_HW_CACHE_MISSES
+)
+# Name of the pyperf run metadata of a counter
+METADATA_PREFIX = 'hw_'
+# Name of the pyperf run metadata of the number of loop iterations counted
+ITERATIONS_METADATA = 'hw_iterations'
+
+# perf_event_attr flags
+_DISABLED = 1 << 0
+_INHERIT = 1 << 1
+_EXCLUDE_KERNEL = 1 << 5
+_EXCLUDE_HV = 1 << 6
+# perf_event_attr read_format
+_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+# read() result: value, time enabled, time running
+_READ_FORMAT = struct.Struct('QQQ')
+# PERF_EVENT_IOC_ENABLE and PERF_EVENT_IOC_DISABLE: _IO('$', 0) and
+# _IO('$', 1), where _IO() sets the _IOC_NONE direction bit on PowerPC
+if platform.machine().startswith('ppc'):
+    _IOC_ENABLE = 0x20002400
+    _IOC_DISABLE = 0x20002401
+else:
+    _IOC_ENABLE = 0x2400
+    _IOC_DISABLE = 0x2401
+
+
+class _PerfEventAttr(ctypes.Structure):
+    # First fields of struct perf_event_attr (PERF_ATTR_SIZE_VER1)
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('size', ctypes.c_uint32),
+        ('config', ctypes.c_uint64),
+        ('sample_period', ctypes.c_uint64),
+        ('sample_type', ctypes.c_uint64),
+        ('read_format', ctypes.c_uint64),
+        ('flags', ctypes.c_uint64),
+        ('wakeup_events', ctypes.c_uint32),
+        ('bp_type', ctypes.c_uint32),
+        ('config1', ctypes.c_uint64),
+        ('config2', ctypes.c_uint64),
+    ]
+
+
+def _get_syscall():
+    if not sys.platform.startswith('linux'):
+        raise OSError("hardware counters are only supported on Linux")
+    machine = platform.machine()
+    if machine not in SYSCALLS:
+        raise OSError("perf_event_open() syscall number unknown on %s"
+                      % machine)
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return libc.syscall, SYSCALLS[machine]
+
+
+def perf_event_open(config, event_type=PERF_TYPE_HARDWARE, enabled=True):
+    """Open a counter of the current process: return a file descriptor.
+
+    If enabled is false, the counter doesn't count until it is enabled by
+    the PERF_EVENT_IOC_ENABLE ioctl. Raise OSError if the counter is not
+    supported or not permitted.
+    """
+    syscall, number = _get_syscall()
+    attr = _PerfEventAttr()
+    attr.type = event_type
+    attr.size = ctypes.sizeof(attr)
+    attr.config = config
+    attr.read_format = (_FORMAT_TOTAL_TIME_ENABLED
+                        | _FORMAT_TOTAL_TIME_RUNNING)
+    attr.flags = _INHERIT | _EXCLUDE_KERNEL | _EXCLUDE_HV
+    if not enabled:
+        attr.flags |= _DISABLED
+    syscall.restype = ctypes.c_long
+    # pid=0 (current process), cpu=-1 (any CPU), group_fd=-1, flags=0
+    fd = syscall(number, ctypes.byref(attr), 0, -1, -1, 0)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, "perf_event_open() failed: %s"
+                      % os.strerror(errno))
+    return fd
+
+
+class HWCounters(object):
+    """Hardware counters of the current process.
+
+    Counters count from now, or if enabled is false, only between enable()
+    and disable() calls. Events which are not supported by the CPU are
+    skipped. Raise OSError if no counter can be opened, for example if perf
+    events are not permitted.
+    """
+
+    def __init__(self, events=EVENTS, enabled=True):
+        self.fds = {}
+        error = None
+        for name, config in events:
+            try:
+                self.fds[name] = perf_event_open(config, enabled=enabled)
+            except OSError as exc:
+                error = exc
+        if not self.fds:
+            raise error
+
+    def enable(self):
+        for fd in self.fds.values():
+            fcntl.ioctl(fd, _IOC_ENABLE, 0)
+
+    def disable(self):
+        for fd in self.fds.values():
+            fcntl.ioctl(fd, _IOC_DISABLE, 0)
+
+    def read(self):
+        """Read counters: return a dict name => count."""
+        counts = {}
+        for name, fd in self.fds.items():
+            data = os.read(fd, _READ_FORMAT.size)
+            value, enabled, running = _READ_FORMAT.unpack(data)
+            if not running:
+                # never scheduled on a hardware counter
+                continue
+            if running < enabled:
+                value = value * enabled // running
+            counts[name] = value
+        return counts
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
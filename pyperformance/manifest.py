@@ -0,0 +1,125 @@
+"""Declarative description of benchmarks.
+
+Benchmarks are described by INI manifest files: see
+pyperformance/benchmarks/manifest.ini for the format. Loading a manifest
+only uses the standard library, so listing benchmarks doesn't import pyperf
+or benchmark scripts.
+"""
+import configparser
+import os.path
+import shlex
+
+from pyperformance.utils import parse_duration
+
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__),
+                                'benchmarks', 'manifest.ini')
+MANIFEST_KEYS = ('script', 'args', 'groups', 'requirements', 'runtime',
+                 'timeout', 'tags')
+
+
+class Benchmark(object):
+    """A benchmark of a manifest.
+
+    Calling the benchmark runs its script: bench(python, options) returns a
+    pyperf BenchmarkSuite.
+    """
+
+    def __init__(self, name, script, args=(), groups=(), requirements=(),
+                 runtime=None, timeout=None, tags=()):
+        self.name = name
+        self.script = script
+        self.args = list(args)
+        self.groups = list(groups)
+        self.requirements = list(requirements)
+        # expected duration in seconds, or None
+        self.runtime = runtime
+        # timeout in seconds, or None
+        self.timeout = timeout
+        self.tags = list(tags)
+
+    def __repr__(self):
+        return '<Benchmark %r script=%r>' % (self.name, self.script)
+
+    def __call__(self, python, options):
+        # Use lazy import: pyperformance.run imports pyperf
+        from pyperformance.run import run_perf_script
+        return run_perf_script(python, options, self.name,
+                               extra_args=self.args, script=self.script)
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _parse_duration(filename, name, key, value):
+    if not value:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError as exc:
+        raise ValueError("%s: [%s] %s: %s" % (filename, name, key, exc))
+
+
+def load_manifest(filename):
+    """Load a manifest file: return a list of Benchmark objects.
+
+    Scripts are relative to the directory of the manifest.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    with open(filename, encoding='utf-8') as fp:
+        parser.read_file(fp)
+
+    basedir = os.path.dirname(os.path.abspath(filename))
+    benchmarks = []
+    for name in parser.sections():
+        section = parser[name]
+        for key in section:
+            if key not in MANIFEST_KEYS:
+                raise ValueError("%s: [%s] unknown key: %s"
+                                 % (filename, name, key))
+
+        script = section.get('script', 'bm_%s.py' % name)
+        script = os.path.join(basedir, script)
+        runtime = _parse_duration(filename, name, 'runtime',
+                                  section.get('runtime', ''))
+        timeout = _parse_duration(filename, name, 'timeout',
+                                  section.get('timeout', ''))
+        bench = Benchmark(name, script,
+                          args=shlex.split(section.get('args', '')),
+                          groups=_split_list(section.get('groups', '')),
+                          requirements=_split_list(
+                              section.get('requirements', '')),
+                          runtime=runtime,
+                          timeout=timeout,
+                          tags=_split_list(section.get('tags', '')))
+        benchmarks.append(bench)
+    return benchmarks
+
+
+def load_benchmarks(manifests=()):
+    """Load the pyperformance manifest and additional manifests.
+
+    Return (benchmarks, groups) where benchmarks is a dict: name =>
+    Benchmark, and groups is a dict: group name => list of benchmark
+    names. The "all" group includes every benchmark.
+    """
+    benchmarks = {}
+    for filename in [DEFAULT_MANIFEST] + list(manifests):
+        for bench in load_manifest(filename):
+            if bench.name in benchmarks:
+                raise ValueError("%s: duplicated benchmark name: %s"
+                                 % (filename, bench.name))
+            benchmarks[bench.name] = bench
+
+    groups = {}
+    for name, bench in sorted(benchmarks.items()):
+        for group in bench.groups:
+            groups.setdefault(group, []).append(name)
+    groups['all'] = sorted(benchmarks)
+
+    for group in groups:
+        if group in benchmarks:
+            raise ValueError("group name %r is also a benchmark name"
+                             % group)
+    return (benchmarks, groups)
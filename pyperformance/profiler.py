@@ -0,0 +1,240 @@
+"""Profiling harness: run a benchmark script under a profiler.
+
+Usage: python -m pyperformance.profiler [--sampler] [--interval SECONDS]
+OUTPUT BM_SCRIPT [ARGS ...]
+
+The benchmark script is run in the current process with ARGS, the
+arguments of a single pyperf worker process with --loops. The profiler is
+only enabled while pyperf calls the timed function of the benchmark, for
+warmups and values: module imports, the benchmark setup and the pyperf
+master are not profiled. Profiles are written into OUTPUT.pstats, a file
+readable by the pstats module, and with --sampler into OUTPUT.collapsed.
+
+By default, the script is profiled by cProfile. With --sampler, a SIGPROF
+timer samples the Python stack every INTERVAL seconds of CPU time: the
+overhead is much lower, and the collapsed stacks can be rendered as a
+flamegraph (flamegraph.pl, speedscope). The .pstats file of sampled profiles
+is computed from the samples: "calls" are numbers of samples.
+
+Only use the standard library: this module runs in the virtual environment.
+"""
+import argparse
+import cProfile
+import marshal
+import os.path
+import runpy
+import signal
+import sys
+import time
+
+from pyperformance.warm_worker import wrap_timed_loops
+
+
+# Default sampling interval in seconds of CPU time
+INTERVAL = 0.001
+
+
+def short_filename(filename):
+    # Keep the last two path components ("json/encoder.py"): paths of two
+    # Python installations are different
+    parts = filename.replace(os.sep, '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+class StackSampler(object):
+    """Sample the Python stack of the main thread on SIGPROF."""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        # stack => number of samples, where stack is a tuple of pstats
+        # function keys (filename, line, name), root first
+        self.samples = {}
+        # CPU time in seconds while the sampler was running
+        self.cpu_time = 0.0
+        self._start_time = None
+        # Remaining delay of the timer when the sampler was disabled
+        self._delay = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno,
+                          code.co_name))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def enable(self):
+        """Start sampling: samples are added to previous samples."""
+        self._start_time = time.process_time()
+        signal.signal(signal.SIGPROF, self._sample)
+        # Timed loops can be shorter than the interval: resume the timer
+        # rather than restarting it, or short loops would never be sampled
+        delay = self._delay or self.interval
+        signal.setitimer(signal.ITIMER_PROF, delay, self.interval)
+
+    def disable(self):
+        self._delay = signal.setitimer(signal.ITIMER_PROF, 0, 0)[0]
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.cpu_time += time.process_time() - self._start_time
+
+    def get_sample_time(self):
+        """Get the CPU time in seconds of a sample.
+
+        The kernel accounts CPU time in ticks (ex: 4 ms), and signals
+        received while a C function runs are merged: the interval between
+        samples is longer than the timer interval. Divide the measured CPU
+        time by the number of samples instead.
+        """
+        nsample = sum(self.samples.values())
+        if not nsample:
+            return self.interval
+        return self.cpu_time / nsample
+
+    def get_stacks(self, root):
+        """Get the samples of stacks below the frames of the root file.
+
+        Drop the frames of the profiling harness (this module and runpy).
+        Return a dict: stack => number of samples.
+        """
+        stacks = {}
+        for stack, count in self.samples.items():
+            for index, func in enumerate(stack):
+                if func[0] == root:
+                    stack = stack[index:]
+                    break
+            else:
+                # sample taken outside the benchmark script
+                continue
+            stacks[stack] = stacks.get(stack, 0) + count
+        return stacks
+
+
+def get_stats(stacks, sample_time):
+    """Compute pstats statistics from stack samples.
+
+    Return a dict: function => (cc, nc, tt, ct, callers), the format of
+    pstats.Stats.stats, where numbers of calls are numbers of samples.
+    """
+    stats = {}
+    for stack, count in stacks.items():
+        seconds = count * sample_time
+        last = len(stack) - 1
+        for index, func in enumerate(stack):
+            cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+            # Only count the outermost frame of recursive functions
+            first = func not in stack[:index]
+            own = seconds if index == last else 0.0
+            tt += own
+            if first:
+                cc += count
+                nc += count
+                ct += seconds
+                if index:
+                    caller = stack[index - 1]
+                    c_nc, c_cc, c_tt, c_ct = callers.get(caller,
+                                                         (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_nc + count, c_cc + count,
+                                       c_tt + own, c_ct + seconds)
+            stats[func] = (cc, nc, tt, ct, callers)
+    return stats
+
+
+def format_frame(func):
+    filename, line, name = func
+    # ";" separates frames in collapsed stacks
+    return ("%s (%s:%s)"
+            % (name, short_filename(filename), line)).replace(';', ':')
+
+
+def write_collapsed(stacks, filename):
+    """Write stacks in the collapsed format of flamegraph.pl."""
+    lines = sorted("%s %s" % (';'.join(map(format_frame, stack)), count)
+                   for stack, count in stacks.items())
+    with open(filename, 'w', encoding='utf-8') as fp:
+        for line in lines:
+            print(line, file=fp)
+
+
+def profile_timed_loops(profiler):
+    """Only enable profiler while pyperf calls timed functions.
+
+    Return False if the pyperf version is not supported.
+    """
+    def wrap(task_func):
+        def profiled_task_func(task, loops):
+            profiler.enable()
+            try:
+                return task_func(task, loops)
+            finally:
+                profiler.disable()
+        return profiled_task_func
+
+    try:
+        wrap_timed_loops(wrap)
+    except ImportError:
+        return False
+    return True
+
+
+def run_script(bm_path, args):
+    # Mimic "python bm_script.py": the script directory is sys.path[0]
+    sys.path[0] = os.path.dirname(bm_path)
+    sys.argv = [bm_path] + args
+    try:
+        runpy.run_path(bm_path, run_name='__main__')
+    except SystemExit as exc:
+        if exc.code:
+            raise
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run a benchmark script under a profiler")
+    parser.add_argument('--sampler', action='store_true',
+                        help='Use the stack sampler instead of cProfile')
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='Sampling interval in seconds of CPU time '
+                             '(default: %s)' % INTERVAL)
+    parser.add_argument('output', metavar='OUTPUT',
+                        help='Filename without extension of profiles')
+    parser.add_argument('script', metavar='BM_SCRIPT')
+    parser.add_argument('args', metavar='ARGS', nargs=argparse.REMAINDER)
+    return parser.parse_args()
+
+
+def profile_script(profiler, bm_path, args):
+    if profile_timed_loops(profiler):
+        run_script(bm_path, args)
+        return
+
+    print("WARNING: unsupported pyperf version, profile the whole "
+          "benchmark script", file=sys.stderr)
+    profiler.enable()
+    try:
+        run_script(bm_path, args)
+    finally:
+        profiler.disable()
+
+
+def main():
+    options = parse_args()
+    bm_path = os.path.abspath(options.script)
+    filename = options.output + '.pstats'
+
+    if options.sampler:
+        sampler = StackSampler(options.interval)
+        profile_script(sampler, bm_path, options.args)
+        stacks = sampler.get_stacks(bm_path)
+        with open(filename, 'wb') as fp:
+            marshal.dump(get_stats(stacks, sampler.get_sample_time()), fp)
+        write_collapsed(stacks, options.output + '.collapsed')
+    else:
+        profiler = cProfile.Profile()
+        profile_script(profiler, bm_path, options.args)
+        profiler.dump_stats(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Static HTML report comparing two benchmark files.
+
+"pyperformance report --html" writes a single HTML file with inline CSS,
+JavaScript and SVG charts: it doesn't load anything from the network and so
+can be read offline or attached to a bug report.
+
+Raw values are never embedded in the page. The distribution of the values of
+each benchmark is summarized by a histogram of BINS bins, drawn as a violin
+plot, and the history of a benchmark is downsampled to MAX_POINTS points, so
+the size of the page doesn't depend on the number of runs.
+"""
+import html
+import math
+import os.path
+import sys
+
+from pyperformance.compare import (BenchmarkResult, format_geometric_mean,
+                                   geometric_mean, get_benchmark_groups,
+                                   get_labels, get_manifest_name,
+                                   quantity_delta, significant_msg)
+from pyperformance.stream import load_suite
+
+
+# Number of histogram bins of a distribution chart
+BINS = 40
+# Maximum number of points of a history chart
+MAX_POINTS = 300
+# Size of charts in SVG user units
+CHART_WIDTH = 600
+CHART_HEIGHT = 140
+# Space on the left of charts for labels
+CHART_MARGIN = 90
+
+STYLE = """
+body { font-family: sans-serif; margin: 2em; color: #222; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+th, td { border: 1px solid #ccc; padding: 0.3em 0.6em; text-align: left; }
+th { background: #eee; }
+table.sortable th { cursor: pointer; }
+table.sortable th[data-order="asc"]::after { content: " \\25b2"; }
+table.sortable th[data-order="desc"]::after { content: " \\25bc"; }
+tr.faster td.change { color: #080; font-weight: bold; }
+tr.slower td.change { color: #c00; font-weight: bold; }
+svg { display: block; max-width: 100%; }
+svg text { font-size: 11px; fill: #444; }
+.base { fill: #4e79a7; stroke: #4e79a7; }
+.changed { fill: #f28e2b; stroke: #f28e2b; }
+.violin { fill-opacity: 0.5; }
+.median { stroke-width: 2; }
+.axis { stroke: #999; }
+.series { fill: none; stroke: #444; stroke-width: 1.5; }
+.reference { stroke-dasharray: 4 3; fill: none; }
+"""
+
+# Sort the rows of tables when a header is clicked: cells are compared by
+# their data-sort attribute if set, or by their text
+SCRIPT = """
+function sortKey(row, col) {
+  var cell = row.cells[col];
+  var key = cell.getAttribute('data-sort');
+  if (key === null) {
+    return cell.textContent;
+  }
+  return key === '' ? Infinity : parseFloat(key);
+}
+document.querySelectorAll('table.sortable th').forEach(function (th) {
+  th.addEventListener('click', function () {
+    var body = th.closest('table').tBodies[0];
+    var col = th.cellIndex;
+    var order = th.getAttribute('data-order') === 'asc' ? 'desc' : 'asc';
+    th.parentNode.querySelectorAll('th').forEach(function (other) {
+      other.removeAttribute('data-order');
+    });
+    th.setAttribute('data-order', order);
+    var rows = Array.prototype.slice.call(body.rows);
+    rows.sort(function (row1, row2) {
+      var key1 = sortKey(row1, col), key2 = sortKey(row2, col);
+      var cmp = key1 < key2 ? -1 : (key1 > key2 ? 1 : 0);
+      return order === 'asc' ? cmp : -cmp;
+    });
+    rows.forEach(function (row) { body.appendChild(row); });
+  });
+});
+"""
+
+
+def histogram(values, low, high, bins=BINS):
+    """Count values in bins of the same width between low and high."""
+    counts = [0] * bins
+    width = (high - low) / bins
+    for value in values:
+        index = int((value - low) / width) if width else 0
+        counts[min(max(index, 0), bins - 1)] += 1
+    return counts
+
+
+def downsample(points, max_points=MAX_POINTS):
+    """Downsample a list of (x, y) points to at most max_points points.
+
+    Keep the minimum and the maximum of each bucket of consecutive points,
+    to not hide spikes and regressions.
+    """
+    if len(points) <= max_points:
+        return list(points)
+    size = int(math.ceil(len(points) / (max_points // 2)))
+    result = []
+    for start in range(0, len(points), size):
+        bucket = points[start:start + size]
+        low = min(bucket, key=lambda point: point[1])
+        high = max(bucket, key=lambda point: point[1])
+        result.extend(sorted({low, high}))
+    return result
+
+
+def _value_range(values):
+    low = min(values)
+    high = max(values)
+    if low == high:
+        delta = abs(low) * 0.01 or 1.0
+        low -= delta
+        high += delta
+    return low, high
+
+
+def _svg(height, items, title):
+    return ('<svg viewBox="0 0 %s %s" width="%s" height="%s" role="img">'
+            '<title>%s</title>%s</svg>'
+            % (CHART_WIDTH, height, CHART_WIDTH, height, html.escape(title),
+               ''.join(items)))
+
+
+def _text(x, y, text, anchor='start'):
+    return ('<text x="%.1f" y="%.1f" text-anchor="%s">%s</text>'
+            % (x, y, anchor, html.escape(text)))
+
+
+def svg_distribution(title, base, changed):
+    """Violin plots of the values of two pyperf benchmarks."""
+    samples = [('base', base.get_values()), ('changed', changed.get_values())]
+    low, high = _value_range(base.get_values() + changed.get_values())
+    plot_width = CHART_WIDTH - CHART_MARGIN - 10
+    row_height = (CHART_HEIGHT - 20) / len(samples)
+
+    def scale(value):
+        return CHART_MARGIN + (value - low) / (high - low) * plot_width
+
+    items = []
+    for row, (css, values) in enumerate(samples):
+        center = row_height * (row + 0.5)
+        counts = histogram(values, low, high)
+        width = (high - low) / len(counts)
+        peak = max(counts)
+        upper = []
+        lower = []
+        for index, count in enumerate(counts):
+            x = scale(low + width * (index + 0.5))
+            half = count / peak * (row_height / 2 - 4)
+            upper.append('%.1f,%.1f' % (x, center - half))
+            lower.append('%.1f,%.1f' % (x, center + half))
+        lower.reverse()
+        items.append('<polygon class="violin %s" points="%s"/>'
+                     % (css, ' '.join(upper + lower)))
+        median = scale(sorted(values)[len(values) // 2])
+        items.append('<line class="median %s" x1="%.1f" x2="%.1f" '
+                     'y1="%.1f" y2="%.1f"/>'
+                     % (css, median, median, center - row_height / 2 + 4,
+                        center + row_height / 2 - 4))
+        items.append(_text(4, center + 4, "%s (%s)" % (css, len(values))))
+
+    axis = CHART_HEIGHT - 20
+    items.append('<line class="axis" x1="%s" x2="%s" y1="%.1f" y2="%.1f"/>'
+                 % (CHART_MARGIN, CHART_WIDTH - 10, axis, axis))
+    items.append(_text(CHART_MARGIN, axis + 14, base.format_value(low)))
+    items.append(_text(CHART_WIDTH - 10, axis + 14, base.format_value(high),
+                       'end'))
+    return _svg(CHART_HEIGHT, items, title)
+
+
+def svg_history(title, bench, points, revisions, references):
+    """Line chart of the means of a benchmark on history revisions.
+
+    points is a list of (index, mean) where index is the index of the
+    revision in revisions. references is a list of (css class, mean) drawn
+    as horizontal lines.
+    """
+    points = downsample(points)
+    values = [mean for index, mean in points]
+    values.extend(mean for css, mean in references)
+    low, high = _value_range(values)
+    plot_width = CHART_WIDTH - CHART_MARGIN - 10
+    plot_height = CHART_HEIGHT - 30
+    last = max(len(revisions) - 1, 1)
+
+    def scale_x(index):
+        return CHART_MARGIN + index / last * plot_width
+
+    def scale_y(value):
+        return 10 + (high - value) / (high - low) * plot_height
+
+    items = []
+    for css, mean in references:
+        y = scale_y(mean)
+        items.append('<line class="reference %s" x1="%s" x2="%s" '
+                     'y1="%.1f" y2="%.1f"/>'
+                     % (css, CHART_MARGIN, CHART_WIDTH - 10, y, y))
+    items.append('<polyline class="series" points="%s"/>'
+                 % ' '.join('%.1f,%.1f' % (scale_x(index), scale_y(mean))
+                            for index, mean in points))
+    items.append(_text(CHART_MARGIN - 4, scale_y(high) + 4,
+                       bench.format_value(high), 'end'))
+    items.append(_text(CHART_MARGIN - 4, scale_y(low) + 4,
+                       bench.format_value(low), 'end'))
+    bottom = CHART_HEIGHT - 6
+    items.append(_text(CHART_MARGIN, bottom, revisions[0]))
+    if len(revisions) > 1:
+        items.append(_text(CHART_WIDTH - 10, bottom, revisions[-1], 'end'))
+    return _svg(CHART_HEIGHT, items, title)
+
+
+def get_revision(suite, filename):
+    """Get (date, label) of a history file."""
+    metadata = suite.get_metadata()
+    date = metadata.get('commit_date')
+    if not date:
+        dates = suite.get_dates()
+        date = dates[0].isoformat(' ') if dates else ''
+    commit_id = metadata.get('commit_id')
+    label = commit_id[:12] if commit_id else os.path.basename(filename)
+    return (date, label)
+
+
+def load_history(filenames, names):
+    """Load the means of benchmarks of history files.
+
+    Return (revisions, history): revisions is the list of labels of
+    history files ordered by date, history is a dict: benchmark name =>
+    list of (index, mean) where index is the index in revisions.
+    """
+    entries = []
+    for filename in filenames:
+        # Only keep the means: don't keep all suites in memory
+        suite = load_suite(filename, names)
+        means = {bench.get_name(): bench.mean()
+                 for bench in suite.get_benchmarks()}
+        entries.append(get_revision(suite, filename) + (means,))
+    entries.sort(key=lambda entry: entry[0])
+
+    revisions = []
+    history = {}
+    for index, (date, label, means) in enumerate(entries):
+        revisions.append(label)
+        for name, mean in means.items():
+            history.setdefault(name, []).append((index, mean))
+    return revisions, history
+
+
+def _metadata_table(labels, suites):
+    rows = ['<table><thead><tr><th>File</th><th>Python</th>'
+            '<th>Performance</th><th>Platform</th><th>Start date</th>'
+            '</tr></thead><tbody>']
+    for label, suite in zip(labels, suites):
+        metadata = suite.get_metadata()
+        dates = suite.get_dates()
+        cells = [label]
+        cells.extend(metadata.get(key, '-')
+                     for key in ('python_version', 'performance_version',
+                                 'platform'))
+        cells.append(dates[0].isoformat(' ') if dates else '-')
+        rows.append('<tr>%s</tr>'
+                    % ''.join('<td>%s</td>' % html.escape(str(cell))
+                              for cell in cells))
+    rows.append('</tbody></table>')
+    return ''.join(rows)
+
+
+def _anchor(name):
+    return 'bench-' + ''.join(char if char.isalnum() else '-'
+                              for char in name)
+
+
+def _results_table(results):
+    rows = ['<table class="sortable"><thead><tr><th>Benchmark</th>'
+            '<th>Base</th><th>Changed</th><th>Change</th>'
+            '<th>Significance</th></tr></thead><tbody>']
+    for result in results:
+        base = result.base
+        changed = result.changed
+        name = base.get_name()
+        msg = significant_msg(base, changed, result.method)
+        if base.mean() and changed.mean():
+            ratio = changed.mean() / base.mean()
+            sort_key = '%.6g' % ratio
+        else:
+            ratio = None
+            sort_key = ''
+        css = ''
+        if msg.startswith('Significant') and ratio is not None:
+            css = ' class="%s"' % ('slower' if ratio > 1 else 'faster')
+        rows.append(
+            '<tr%s><td><a href="#%s">%s</a></td>'
+            '<td data-sort="%.6g">%s</td><td data-sort="%.6g">%s</td>'
+            '<td class="change" data-sort="%s">%s</td><td>%s</td></tr>'
+            % (css, _anchor(name), html.escape(name),
+               base.mean(), html.escape(base.format_value(base.mean())),
+               changed.mean(),
+               html.escape(changed.format_value(changed.mean())),
+               sort_key, html.escape(quantity_delta(base, changed)),
+               html.escape(msg)))
+    rows.append('</tbody></table>')
+    return ''.join(rows)
+
+
+def _summary_table(results, groups):
+    ratios = {}
+    # benchmark name => manifest benchmark name
+    manifest_names = {}
+    is_time = True
+    for result in results:
+        name = result.base.get_name()
+        base = result.base.mean()
+        changed = result.changed.mean()
+        is_time &= (result.base.get_unit() == 'second')
+        manifest_names[name] = get_manifest_name(result.base)
+        if base and changed:
+            ratios[name] = changed / base
+
+    summary = []
+    for group, members in sorted(groups.items()):
+        group_ratios = [ratio for name, ratio in ratios.items()
+                        if manifest_names[name] in members]
+        if group_ratios:
+            summary.append(("Geometric mean (%s)" % group, group_ratios))
+    summary.append(("Geometric mean", list(ratios.values())))
+
+    rows = ['<table class="sortable"><thead><tr><th>Group</th>'
+            '<th>Benchmarks</th><th>Change</th></tr></thead><tbody>']
+    for title, group_ratios in summary:
+        sort_key = ('%.6g' % geometric_mean(group_ratios)[0]
+                    if group_ratios else '')
+        rows.append('<tr><td>%s</td><td data-sort="%s">%s</td>'
+                    '<td data-sort="%s">%s</td></tr>'
+                    % (html.escape(title), len(group_ratios),
+                       len(group_ratios), sort_key,
+                       html.escape(format_geometric_mean(group_ratios,
+                                                         is_time))))
+    rows.append('</tbody></table>')
+    return ''.join(rows)
+
+
+def render_report(labels, suites, results, groups, revisions, history):
+    """Render the HTML report: return a str."""
+    title = "Performance report: %s -> %s" % tuple(labels)
+    parts = ['<!DOCTYPE html>',
+             '<html><head><meta charset="utf-8">',
+             '<title>%s</title>' % html.escape(title),
+             '<style>%s</style></head><body>' % STYLE,
+             '<h1>%s</h1>' % html.escape(title),
+             _metadata_table(labels, suites),
+             '<h2>Summary</h2>',
+             _summary_table(results, groups),
+             '<h2>Benchmarks</h2>',
+             _results_table(results)]
+
+    for result in results:
+        name = result.base.get_name()
+        parts.append('<h3 id="%s">%s</h3>'
+                     % (_anchor(name), html.escape(name)))
+        parts.append(svg_distribution("Distribution of %s values" % name,
+                                      result.base, result.changed))
+        if history.get(name):
+            references = [('base', result.base.mean()),
+                          ('changed', result.changed.mean())]
+            parts.append(svg_history("History of %s" % name, result.base,
+                                     history[name], revisions, references))
+
+    parts.append('<script>%s</script></body></html>' % SCRIPT)
+    return '\n'.join(parts)
+
+
+def cmd_report(options):
+    filenames = [options.baseline_filename, options.changed_filename]
+    labels = get_labels(filenames)
+    base_suite = load_suite(options.baseline_filename)
+    names = set(base_suite.get_benchmark_names())
+    changed_suite = load_suite(options.changed_filename, names)
+    suites = [base_suite, changed_suite]
+
+    common = names & set(changed_suite.get_benchmark_names())
+    if not common:
+        print("ERROR: %s and %s have no common benchmark" % tuple(labels))
+        sys.exit(1)
+    results = [BenchmarkResult(base_suite.get_benchmark(name),
+                               changed_suite.get_benchmark(name),
+                               options.stats)
+               for name in sorted(common)]
+
+    revisions, history = load_history(options.history_filenames, common)
+    groups = get_benchmark_groups(options)
+    report = render_report(labels, suites, results, groups, revisions,
+                           history)
+    with open(options.html, 'w', encoding='utf-8') as fp:
+        fp.write(report)
+    print("Report written into %s" % options.html)
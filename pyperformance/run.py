@@ -1,7 +1,18 @@
+import concurrent.futures
+import copy
+import json
 import logging
+import math
 import os.path
+import queue
+import select
+import signal
+import statistics
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import traceback
 try:
     import multiprocessing
@@ -11,7 +22,10 @@ except ImportError:
 import pyperf
 
 import pyperformance
-from pyperformance.utils import temporary_file
+from pyperformance.compare import tdist95conf_level
+from pyperformance.utils import (temporary_file, parse_cpu_list,
+                                 parse_cpu_sets, format_cpu_list,
+                                 format_duration)
 from pyperformance.venv import PERFORMANCE_ROOT
 
 
@@ -19,6 +33,23 @@ class BenchmarkException(Exception):
     pass
 
 
+class BenchmarkTimeout(BenchmarkException):
+    """A benchmark didn't complete before its timeout.
+
+    partial is a BenchmarkSuite of the values computed before the timeout,
+    or None.
+    """
+
+    def __init__(self, timeout, partial=None):
+        super().__init__("timeout after %s" % format_duration(timeout))
+        self.timeout = timeout
+        self.partial = partial
+
+
+# Seconds between SIGTERM and SIGKILL when a benchmark times out
+TIMEOUT_GRACE = 5.0
+
+
 # Utility functions
 
 
@@ -26,11 +57,43 @@ def Relative(*path):
     return os.path.join(PERFORMANCE_ROOT, 'benchmarks', *path)
 
 
-def run_command(command, hide_stderr=True):
+def kill_process_group(proc):
+    """Kill a process spawned with start_new_session=True and its children.
+
+    Send SIGTERM, and then SIGKILL if the processes are still running after
+    TIMEOUT_GRACE seconds.
+    """
+    if os.name != 'posix':
+        proc.kill()
+        return
+
+    for signum in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, signum)
+        except OSError:
+            # process group already exited
+            return
+        try:
+            proc.wait(TIMEOUT_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def run_command(command, hide_stderr=True, timeout=None):
+    """Run a command in its own process group.
+
+    Raise BenchmarkTimeout, without partial results, if the command doesn't
+    complete in timeout seconds: the whole process group is killed.
+    """
     if hide_stderr:
         kw = {'stderr': subprocess.PIPE}
     else:
         kw = {}
+    if os.name == 'posix':
+        # Run the command in its own process group, to kill pyperf worker
+        # processes as well on timeout
+        kw['start_new_session'] = True
 
     logging.info("Running `%s`",
                  " ".join(list(map(str, command))))
@@ -44,15 +107,19 @@ def run_command(command, hide_stderr=True):
                             universal_newlines=True,
                             **kw)
     try:
+        stderr = proc.communicate(timeout=timeout)[1]
+    except subprocess.TimeoutExpired:
+        kill_process_group(proc)
         stderr = proc.communicate()[1]
+        if hide_stderr:
+            sys.stderr.flush()
+            sys.stderr.write(stderr)
+            sys.stderr.flush()
+        raise BenchmarkTimeout(timeout)
     except:   # noqa
         if proc.stderr:
             proc.stderr.close()
-        try:
-            proc.kill()
-        except OSError:
-            # process already exited
-            pass
+        kill_process_group(proc)
         proc.wait()
         raise
 
@@ -67,6 +134,11 @@ def run_command(command, hide_stderr=True):
 def copy_perf_options(cmd, options):
     if options.debug_single_value:
         cmd.append('--debug-single-value')
+    elif options.processes or options.values:
+        if options.processes:
+            cmd.append('--processes=%s' % options.processes)
+        if options.values:
+            cmd.append('--values=%s' % options.values)
     elif options.rigorous:
         cmd.append('--rigorous')
     elif options.fast:
@@ -83,57 +155,644 @@ def copy_perf_options(cmd, options):
         cmd.append('--inherit-environ=%s' % ','.join(options.inherit_environ))
 
 
-def run_perf_script(python, options, name, extra_args=[]):
-    bm_path = Relative("bm_%s.py" % name)
+def run_perf_script(python, options, name, extra_args=[], script=None):
+    if script is not None:
+        bm_path = script
+    else:
+        bm_path = Relative("bm_%s.py" % name)
     cmd = list(python)
     cmd.append('-u')
     cmd.append(bm_path)
     cmd.extend(extra_args)
+    if options.adaptive_ci:
+        return run_adaptive(cmd, options)
+    if ((options.warm_workers or options.hw_counters)
+            and can_use_warm_workers(options)):
+        return run_warm_workers(python, options, bm_path, extra_args)
     copy_perf_options(cmd, options)
 
     with temporary_file() as tmp:
         cmd.extend(('--output', tmp))
-        run_command(cmd, hide_stderr=not options.verbose)
+        run_command(cmd, hide_stderr=not options.verbose,
+                    timeout=options.timeout)
         return pyperf.BenchmarkSuite.load(tmp)
 
 
-def run_benchmarks(bench_funcs, should_run, cmd_prefix, options):
-    suite = None
-    to_run = sorted(should_run)
-    run_count = str(len(to_run))
-    errors = []
+# Timeout in seconds of benchmarks without timeout in their manifest
+DEFAULT_TIMEOUT = 10 * 60
 
-    for index, name in enumerate(to_run):
-        func = bench_funcs[name]
-        print("[%s/%s] %s..." %
-              (str(index + 1).rjust(len(run_count)), run_count, name))
+
+def get_timeout(bench, options, processes=None):
+    """Get the timeout in seconds of a benchmark, or None for no timeout.
+
+    --timeout overrides the timeout of all benchmarks, 0 disables timeouts.
+    Manifest timeouts are for the default number of worker processes (20)
+    and are scaled with the number of worker processes.
+    """
+    if options.timeout is not None:
+        return options.timeout or None
+    if processes is None:
+        processes = get_processes(options)
+    timeout = bench.timeout or DEFAULT_TIMEOUT
+    return timeout * max(processes / 20, 1)
+
+
+def get_expected_runtime(bench, options, processes=None):
+    """Get the expected runtime in seconds of a benchmark from its manifest.
+
+    Manifest runtimes are for the default number of worker processes (20).
+    Return None if the manifest has no runtime.
+    """
+    if not bench.runtime:
+        return None
+    if options.debug_single_value:
+        processes = 1
+    elif processes is None:
+        processes = get_processes(options)
+    return bench.runtime * processes / 20
+
+
+def get_deadline(options):
+    if not options.timeout:
+        return None
+    return time.monotonic() + options.timeout
+
+
+def get_remaining_time(options, deadline):
+    """Seconds until deadline, or None if there is no deadline.
+
+    Raise BenchmarkTimeout if the deadline is already exceeded.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise BenchmarkTimeout(options.timeout)
+    return remaining
+
+
+# Adaptive mode: number of worker processes of the first batch
+ADAPTIVE_MIN_PROCESSES = 3
+
+
+def get_processes(options):
+    """Number of worker processes of a benchmark: --processes.
+
+    Use the pyperf default for the --rigorous and --fast presets.
+    """
+    if options.processes:
+        return options.processes
+    if options.rigorous:
+        return 40
+    if options.fast:
+        return 10
+    return 20
+
+
+def confidence_interval(bench):
+    """Relative half-width of the 95% confidence interval of the mean.
+
+    Values computed by the same worker process are not independent: use
+    the mean of each worker process as a sample. Return None if there are
+    less than 2 worker processes.
+    """
+    means = [statistics.mean(run.values)
+             for run in bench.get_runs() if run.values]
+    if len(means) < 2:
+        return None
+    mean = statistics.mean(means)
+    if not mean:
+        return None
+    stdev = statistics.stdev(means)
+    return (tdist95conf_level(len(means) - 1) * stdev
+            / math.sqrt(len(means)) / mean)
+
+
+def get_stop_reason(suite, target, processes, max_processes):
+    """Stop rule of the adaptive mode.
+
+    Return 'confidence' if the confidence intervals of all benchmarks of
+    suite are within +-target (ex: 0.01 for 1%) of the mean,
+    'max_processes' if processes reached max_processes, or None to run
+    one more worker process.
+    """
+    widths = [confidence_interval(bench) for bench in suite.get_benchmarks()]
+    if all(width is not None and width <= target for width in widths):
+        return 'confidence'
+    if processes >= max_processes:
+        return 'max_processes'
+    return None
+
+
+def _run_perf_batch(cmd, options, processes, deadline, extra_args=()):
+    batch_options = copy.copy(options)
+    batch_options.processes = processes
+    cmd = cmd + list(extra_args)
+    copy_perf_options(cmd, batch_options)
+    with temporary_file() as tmp:
+        cmd.extend(('--output', tmp))
+        run_command(cmd, hide_stderr=not options.verbose,
+                    timeout=get_remaining_time(options, deadline))
+        return pyperf.BenchmarkSuite.load(tmp)
+
+
+def run_adaptive(cmd, options):
+    """Spawn worker processes until the confidence interval is narrow enough.
+
+    Run a first batch of worker processes, then one worker process at a
+    time, until the 95% confidence interval of the mean of all pyperf
+    benchmarks of the script is within +-options.adaptive_ci percent of the
+    mean, or until the maximum number of processes is reached. The reason
+    is stored in the performance_stop_reason metadata.
+
+    On timeout, values of the previous worker processes are kept in the
+    BenchmarkTimeout exception.
+    """
+    target = options.adaptive_ci / 100.0
+    max_processes = get_processes(options)
+    processes = min(ADAPTIVE_MIN_PROCESSES, max_processes)
+    deadline = get_deadline(options)
+    suite = _run_perf_batch(cmd, options, processes, deadline)
+
+    # Reuse the calibrated number of loops and warmups, unless the script
+    # runs multiple benchmarks, which have different numbers of loops
+    extra_args = []
+    benchmarks = suite.get_benchmarks()
+    if len(benchmarks) == 1:
+        runs = [run for run in benchmarks[0].get_runs() if run.values]
+        extra_args.append('--loops=%s' % runs[-1].get_metadata()['loops'])
+        extra_args.append('--warmups=%s' % len(runs[-1].warmups))
+
+    while True:
+        reason = get_stop_reason(suite, target, processes, max_processes)
+        if reason is not None:
+            break
+
+        widths = [confidence_interval(bench)
+                  for bench in suite.get_benchmarks()]
+        width = max(width for width in widths if width is not None)
+        print("95%% confidence interval: +-%.1f%% after %s processes, "
+              "target: +-%s%%" % (width * 100, processes, options.adaptive_ci))
+        sys.stdout.flush()
+        try:
+            batch = _run_perf_batch(cmd, options, 1, deadline, extra_args)
+        except BenchmarkTimeout:
+            raise BenchmarkTimeout(options.timeout, suite)
+        suite.add_runs(batch)
+        processes += 1
+
+    print("Stop after %s processes (%s)" % (processes, reason))
+    for bench in suite.get_benchmarks():
+        bench.update_metadata({'performance_stop_reason': reason})
+    return suite
+
+
+def can_use_warm_workers(options):
+    # Forking a preloaded process requires fork(). With a JIT compiler,
+    # pyperf calibrates warmups, which is not implemented by the warm
+    # worker client.
+    return (hasattr(os, 'fork')
+            and not options.debug_single_value
+            and not pyperf.python_has_jit())
+
+
+def check_hw_counters(options):
+    """Disable --hw-counters with a warning if counters cannot be opened."""
+    # Use lazy import: ctypes is only needed by --hw-counters
+    from pyperformance.hw_counters import HWCounters
+
+    if not can_use_warm_workers(options):
+        reason = ("worker processes must be forked by warm workers, "
+                  "which require fork() and no JIT compiler")
+    else:
+        try:
+            with HWCounters():
+                return
+        except OSError as exc:
+            reason = str(exc)
+    print("WARNING: hardware counters are disabled: %s" % reason)
+    options.hw_counters = False
+
+
+def add_hw_counters(bench, counts, iterations=None):
+    """Store the hardware counters of a worker process into the metadata of
+    its run.
+
+    The hw_iterations metadata is the number of loop iterations (warmups
+    included) run by the worker process while counters were enabled. By
+    default, compute it from the warmups and values of the run.
+    """
+    # Use lazy import: ctypes is only needed by --hw-counters
+    from pyperformance.hw_counters import ITERATIONS_METADATA, METADATA_PREFIX
+
+    run = bench.get_runs()[-1]
+    if not run.values:
+        # calibration run
+        return
+    if not iterations:
+        metadata = run.get_metadata()
+        loops = metadata.get('loops', 1)
+        iterations = (sum(warmup_loops for warmup_loops, value in run.warmups)
+                      + len(run.values) * loops)
+        iterations *= metadata.get('inner_loops', 1)
+    metadata = {METADATA_PREFIX + name: count
+                for name, count in counts.items()}
+    metadata[ITERATIONS_METADATA] = iterations
+    bench.update_metadata(metadata)
+
+
+def get_worker_environ(options):
+    """Environment variables of worker processes, as the pyperf master."""
+    names = ["PATH", "HOME", "TEMP", "COMSPEC", "SystemRoot", "SystemDrive"]
+    if options.inherit_environ:
+        names.extend(options.inherit_environ)
+    return {name: os.environ[name] for name in names if name in os.environ}
+
+
+class WarmWorker(object):
+    """Client of a pyperformance.warm_worker process."""
+
+    def __init__(self, python, bm_path, extra_args, options):
+        rfd, wfd = os.pipe()
+        cmd = list(python)
+        cmd.extend(('-u', '-m', 'pyperformance.warm_worker'))
+        if options.hw_counters:
+            cmd.append('--hw-counters')
+        cmd.extend((str(wfd), bm_path))
+        cmd.extend(extra_args)
+        logging.info("Running `%s`", " ".join(cmd))
         sys.stdout.flush()
+        sys.stderr.flush()
+
+        if options.verbose:
+            self.stderr = None
+        else:
+            self.stderr = tempfile.TemporaryFile(mode='w+')
+        try:
+            self.proc = subprocess.Popen(cmd,
+                                         stdin=subprocess.PIPE,
+                                         stderr=self.stderr,
+                                         env=get_worker_environ(options),
+                                         pass_fds=[wfd],
+                                         start_new_session=True,
+                                         universal_newlines=True)
+        except:   # noqa
+            os.close(rfd)
+            raise
+        finally:
+            os.close(wfd)
+        self.responses = open(rfd, encoding='utf-8')
+        # Error message if hardware counters cannot be opened
+        self.counters_error = None
+
+    def run_worker(self, args, timeout=None):
+        """Run a pyperf worker with args: return a Benchmark or None.
+
+        Raise BenchmarkTimeout if the worker doesn't complete in timeout
+        seconds.
+        """
+        self.proc.stdin.write(json.dumps(args) + '\n')
+        self.proc.stdin.flush()
+        if not select.select([self.responses], [], [], timeout)[0]:
+            kill_process_group(self.proc)
+            raise BenchmarkTimeout(timeout)
+        line = self.responses.readline()
+        if not line:
+            self._dump_stderr()
+            raise RuntimeError("Warm worker died")
+
+        response = json.loads(line)
+        if response['exitcode']:
+            self._dump_stderr()
+            raise RuntimeError("Benchmark worker failed with exit code %s"
+                               % response['exitcode'])
+        if not response['result']:
+            return None
+        bench = pyperf.Benchmark.loads(response['result'])
+
+        counters = response.get('counters')
+        if counters is None:
+            pass
+        elif counters['counts']:
+            add_hw_counters(bench, counters['counts'],
+                            counters.get('iterations'))
+        elif self.counters_error is None:
+            self.counters_error = counters['error']
+            print("WARNING: failed to open hardware counters: %s"
+                  % self.counters_error)
+        return bench
+
+    def _dump_stderr(self):
+        if self.stderr is None:
+            return
+        self.stderr.seek(0)
+        sys.stderr.flush()
+        sys.stderr.write(self.stderr.read())
+        sys.stderr.flush()
+
+    def close(self):
+        self.proc.stdin.close()
+        self.responses.close()
+        self.proc.wait()
+        if self.stderr is not None:
+            self.stderr.close()
 
-        def add_bench(dest_suite, obj):
-            if isinstance(obj, pyperf.BenchmarkSuite):
-                benchmarks = obj
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            # kill also the forked worker process
+            kill_process_group(self.proc)
+        self.close()
+
+
+def run_warm_workers(python, options, bm_path, extra_args):
+    """Run a benchmark script in a warm worker.
+
+    The benchmark script is loaded once by a pyperformance.warm_worker
+    process which forks pyperf worker processes, so benchmark dependencies
+    are only imported once. This function replaces the pyperf master:
+    calibrate the number of loops, then spawn worker processes for each
+    benchmark function (worker task) of the script.
+
+    On timeout, values of the previous worker processes are kept in the
+    BenchmarkTimeout exception.
+    """
+    processes = get_processes(options)
+    # Only override the number of values and warmups of the Runner of the
+    # script if requested, as the pyperf master does
+    worker_args = []
+    if options.processes or options.values:
+        if options.values:
+            worker_args.append('--values=%s' % options.values)
+    elif options.fast:
+        # pyperf computes the number of values from the Runner defaults
+        worker_args.append('--fast')
+    if options.affinity:
+        worker_args.append('--affinity=%s' % options.affinity)
+    if options.track_memory:
+        worker_args.append('--track-memory')
+
+    deadline = get_deadline(options)
+    suite = None
+    with WarmWorker(python, bm_path, extra_args, options) as worker:
+        task = 0
+        while True:
+            task_args = ['--worker', '--worker-task=%s' % task]
+            task_args.extend(worker_args)
+            bench = None
+            try:
+                bench = worker.run_worker(
+                    task_args + ['--calibrate-loops'],
+                    get_remaining_time(options, deadline))
+                if bench is None:
+                    # no more worker task
+                    break
+                loops = bench.get_runs()[-1].get_metadata()['calibrate_loops']
+
+                for process in range(processes):
+                    print(".", end='')
+                    sys.stdout.flush()
+                    run_bench = worker.run_worker(
+                        task_args + ['--loops=%s' % loops],
+                        get_remaining_time(options, deadline))
+                    bench.add_runs(run_bench)
+            except BenchmarkTimeout:
+                print()
+                if bench is not None and bench.get_nvalue():
+                    if suite is not None:
+                        suite.add_benchmark(bench)
+                    else:
+                        suite = pyperf.BenchmarkSuite([bench])
+                raise BenchmarkTimeout(options.timeout, suite)
+            print()
+            print("%s: Mean +- std dev: %s +- %s"
+                  % ((bench.get_name(),)
+                     + tuple(bench.format_values((bench.mean(),
+                                                  bench.stdev())))))
+
+            bench.update_metadata({'performance_warm_worker': 'yes'})
+            if suite is not None:
+                suite.add_benchmark(bench)
             else:
-                benchmarks = (obj,)
+                suite = pyperf.BenchmarkSuite([bench])
+            task += 1
 
-            version = pyperformance.__version__
-            for bench in benchmarks:
-                bench.update_metadata({'performance_version': version})
+    if suite is None:
+        raise RuntimeError("Warm worker didn't produce any benchmark")
+    return suite
 
-                if dest_suite is not None:
-                    dest_suite.add_benchmark(bench)
-                else:
-                    dest_suite = pyperf.BenchmarkSuite([bench])
 
-            return dest_suite
+def get_cpu_sets(options):
+    """Get the CPU sets used to run benchmarks.
+
+    Return a list with one item per job: a CPU list for the --affinity
+    option, or None if the job is not pinned to CPUs.
+    """
+    jobs = options.jobs
+    if options.cpu_sets:
+        cpu_sets = parse_cpu_sets(options.cpu_sets)
+        if jobs is None:
+            jobs = len(cpu_sets)
+        elif jobs > len(cpu_sets):
+            raise ValueError("--jobs=%s requires at least %s CPU sets, "
+                             "got %s" % (jobs, jobs, len(cpu_sets)))
+        return cpu_sets[:jobs]
+
+    if not jobs or jobs == 1:
+        return [options.affinity]
+
+    if options.affinity:
+        # Split the CPUs of --affinity into one CPU set per job
+        cpus = parse_cpu_list(options.affinity)
+        if len(cpus) < jobs:
+            raise ValueError("--jobs=%s requires at least %s CPUs in "
+                             "--affinity, got %s"
+                             % (jobs, jobs, options.affinity))
+        size = len(cpus) // jobs
+        return [format_cpu_list(cpus[index * size:(index + 1) * size])
+                for index in range(jobs)]
+
+    logging.warning("Running %s benchmarks in parallel without CPU "
+                    "isolation: use --cpu-sets or --affinity to get "
+                    "stable results", jobs)
+    return [None] * jobs
 
+
+def _run_serial(to_run, cpu_set, run_job):
+    for index, name in enumerate(to_run):
         try:
-            bench = func(cmd_prefix, options)
+            result = run_job(index, name, cpu_set)
         except Exception as exc:
+            yield (name, None, exc)
+        else:
+            yield (name, result, None)
+
+
+def _run_parallel(to_run, cpu_sets, run_job):
+    # Each job takes a free CPU set, so two benchmarks never share CPUs
+    free_cpu_sets = queue.Queue()
+    for cpu_set in cpu_sets:
+        free_cpu_sets.put(cpu_set)
+
+    def job(index, name):
+        cpu_set = free_cpu_sets.get()
+        try:
+            return run_job(index, name, cpu_set)
+        finally:
+            free_cpu_sets.put(cpu_set)
+
+    executor = concurrent.futures.ThreadPoolExecutor(len(cpu_sets))
+    with executor:
+        futures = {executor.submit(job, index, name): name
+                   for index, name in enumerate(to_run)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    yield (name, None, exc)
+                else:
+                    yield (name, result, None)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def tag_benchmarks(obj, name, cpu_set=None):
+    """Add pyperformance metadata to the result of a benchmark function.
+
+    Return the list of pyperf benchmarks produced by the benchmark *name*.
+    """
+    if isinstance(obj, pyperf.BenchmarkSuite):
+        benchmarks = obj.get_benchmarks()
+    else:
+        benchmarks = [obj]
+
+    metadata = {'performance_version': pyperformance.__version__,
+                'performance_benchmark': name}
+    if cpu_set:
+        metadata['performance_cpu_set'] = cpu_set
+    for bench in benchmarks:
+        bench.update_metadata(metadata)
+    return benchmarks
+
+
+def run_benchmarks(bench_funcs, should_run, cmd_prefix, options,
+                   cpu_sets=None, checkpoint=None, sample_sizes=None,
+                   timeouts=None, runtimes=None):
+    """Run benchmarks and return (suite, errors).
+
+    errors is a list of (name, reason) tuples where reason is "failed" or
+    "timeout".
+
+    If set, checkpoint(name, benchmarks, elapsed) is called as soon as the
+    benchmark *name* completes, with the list of pyperf benchmarks it
+    produced and its duration in seconds.
+
+    sample_sizes is an optional dict: benchmark name => (processes, values)
+    overriding the number of worker processes and values per process.
+
+    timeouts is an optional dict: benchmark name => timeout in seconds
+    (None means no timeout), overriding options.timeout. With
+    --adaptive-ci and --warm-workers, values computed before a timeout are
+    kept, with the performance_partial metadata. The pyperf master only
+    writes results at exit: in the default mode, nothing is kept.
+
+    runtimes is an optional dict: benchmark name => expected runtime in
+    seconds, used to display the remaining time of serial runs and to start
+    long benchmarks first in parallel runs. By default, use the runtime of
+    the benchmark manifest.
+    """
+    suite = None
+    to_run = sorted(should_run)
+    run_count = str(len(to_run))
+    errors = []
+
+    if cpu_sets is None:
+        cpu_sets = get_cpu_sets(options)
+    if runtimes is None:
+        runtimes = {name: bench_funcs[name].runtime for name in to_run}
+    if len(cpu_sets) > 1:
+        # Longest processing time first: start long benchmarks first to not
+        # wait for a long benchmark started last while other CPU sets are
+        # idle
+        to_run.sort(key=lambda name: -(runtimes.get(name) or 0))
+    bench_cpu_sets = {}
+    lock = threading.Lock()
+
+    def run_job(index, name, cpu_set):
+        text = ("[%s/%s] %s..."
+                % (str(index + 1).rjust(len(run_count)), run_count, name))
+        if cpu_set:
+            text += " (CPUs %s)" % cpu_set
+        if len(cpu_sets) == 1:
+            remaining = [runtimes.get(bench_name)
+                         for bench_name in to_run[index:]]
+            if all(remaining):
+                text += " (~%s left)" % format_duration(sum(remaining))
+        with lock:
+            bench_cpu_sets[name] = cpu_set
+            print(text)
+            sys.stdout.flush()
+
+        changes = {}
+        if cpu_set != options.affinity:
+            changes['affinity'] = cpu_set
+        if sample_sizes and name in sample_sizes:
+            changes['processes'], changes['values'] = sample_sizes[name]
+        if timeouts and name in timeouts:
+            changes['timeout'] = timeouts[name]
+        if changes:
+            job_options = copy.copy(options)
+            vars(job_options).update(changes)
+        else:
+            job_options = options
+
+        start = time.monotonic()
+        bench = bench_funcs[name](cmd_prefix, job_options)
+        return (bench, time.monotonic() - start)
+
+    if len(cpu_sets) > 1:
+        results = _run_parallel(to_run, cpu_sets, run_job)
+    else:
+        results = _run_serial(to_run, cpu_sets[0], run_job)
+
+    benchmarks = {}
+    for name, result, exc in results:
+        if isinstance(exc, BenchmarkTimeout):
+            print("ERROR: Benchmark %s: %s" % (name, exc))
+            errors.append((name, 'timeout'))
+            if exc.partial is None:
+                continue
+            bench = tag_benchmarks(exc.partial, name, bench_cpu_sets[name])
+            for partial in bench:
+                partial.update_metadata({'performance_partial': 'timeout'})
+            elapsed = exc.timeout
+        elif exc is not None:
             print("ERROR: Benchmark %s failed: %s" % (name, exc))
-            traceback.print_exc()
-            errors.append(name)
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+            errors.append((name, 'failed'))
+            continue
         else:
-            suite = add_bench(suite, bench)
+            bench, elapsed = result
+            bench = tag_benchmarks(bench, name, bench_cpu_sets[name])
+        benchmarks[name] = bench
+        if checkpoint is not None:
+            checkpoint(name, bench, elapsed)
+
+    # Merge results in a deterministic order, whatever the order in which
+    # benchmarks completed
+    for name in sorted(to_run):
+        for bench in benchmarks.get(name, ()):
+            if suite is not None:
+                suite.add_benchmark(bench)
+            else:
+                suite = pyperf.BenchmarkSuite([bench])
+    errors.sort()
 
     print()
 
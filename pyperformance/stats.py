@@ -0,0 +1,228 @@
+"""Statistical tests comparing benchmark values.
+
+Timing values are often skewed or multimodal, so besides Student's t-test
+(see pyperformance.compare), the following methods are available:
+
+- Welch's t-test: doesn't assume equal variances nor equal sizes;
+- Mann-Whitney U test: nonparametric test of the ranks of the values;
+- bootstrap: confidence interval of the ratio of means (or medians) of
+  the two samples, computed from resamples of the values.
+
+Bootstrap resamples are computed with the random module and a fixed seed:
+the same values always give the same confidence interval, whatever the
+installed packages.
+"""
+import math
+import random
+import statistics
+
+
+# Number of bootstrap resamples
+RESAMPLES = 2000
+# Seed of bootstrap resamples, to get reproducible results
+SEED = 0
+# z-score of the 95% confidence level of the standard normal distribution
+Z_95 = 1.959964
+
+
+def _mean(values):
+    # statistics.mean() is slow and statistics.fmean() requires Python 3.8
+    return math.fsum(values) / len(values)
+
+
+def _betacf(a, b, x):
+    # Continued fraction of the incomplete beta function (modified Lentz's
+    # method)
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def t_pvalue(t_score, df):
+    """Two-tailed p-value of Student's t distribution."""
+    if math.isinf(t_score):
+        return 0.0
+    return betainc(df / 2.0, 0.5, df / (df + t_score ** 2))
+
+
+def normal_pvalue(z_score):
+    """Two-tailed p-value of the standard normal distribution."""
+    return math.erfc(abs(z_score) / math.sqrt(2))
+
+
+def welch_test(sample1, sample2):
+    """Welch's t-test for two samples of any sizes.
+
+    Return (t_score, pvalue): pvalue is two-tailed. The t-score is positive
+    if the mean of sample1 is greater, as pyperformance.compare.tscore().
+    """
+    n1 = len(sample1)
+    n2 = len(sample2)
+    diff = statistics.mean(sample1) - statistics.mean(sample2)
+    var1 = statistics.variance(sample1) / n1 if n1 >= 2 else 0.0
+    var2 = statistics.variance(sample2) / n2 if n2 >= 2 else 0.0
+    error = var1 + var2
+    if not error:
+        if not diff:
+            return (0.0, 1.0)
+        return (math.copysign(math.inf, diff), 0.0)
+    t_score = diff / math.sqrt(error)
+    # Welch-Satterthwaite degrees of freedom
+    df = error ** 2 / ((var1 ** 2 / (n1 - 1) if var1 else 0.0)
+                       + (var2 ** 2 / (n2 - 1) if var2 else 0.0))
+    return (t_score, t_pvalue(t_score, df))
+
+
+def _ranks(values):
+    # Ranks starting at 1, tied values get the average of their ranks.
+    # Return (ranks, ties) where ties is the list of the sizes of groups
+    # of tied values.
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    ties = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while (end < len(order)
+               and values[order[end]] == values[order[start]]):
+            end += 1
+        rank = (start + end + 1) / 2.0
+        for index in order[start:end]:
+            ranks[index] = rank
+        if end - start > 1:
+            ties.append(end - start)
+        start = end
+    return ranks, ties
+
+
+def mann_whitney_u(sample1, sample2):
+    """Mann-Whitney U test for two samples.
+
+    Use the normal approximation with tie and continuity corrections,
+    which is accurate for the sizes of benchmark samples (more than 10
+    values). Return (u, pvalue): u is the U statistic of sample1 and pvalue
+    is two-tailed.
+    """
+    n1 = len(sample1)
+    n2 = len(sample2)
+    n = n1 + n2
+    ranks, ties = _ranks(list(sample1) + list(sample2))
+    u = math.fsum(ranks[:n1]) - n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    tie_term = math.fsum(t ** 3 - t for t in ties) / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if not sigma:
+        return (u, 1.0)
+    delta = abs(u - mean)
+    z_score = max(delta - 0.5, 0.0) / sigma
+    return (u, normal_pvalue(z_score))
+
+
+def percentile(sorted_values, percent):
+    """Percentile of sorted values with linear interpolation."""
+    pos = (len(sorted_values) - 1) * percent / 100.0
+    index = int(pos)
+    if index + 1 >= len(sorted_values):
+        return sorted_values[-1]
+    frac = pos - index
+    return (sorted_values[index] * (1.0 - frac)
+            + sorted_values[index + 1] * frac)
+
+
+def _bootstrap_stats(values, statistic, resamples, rng):
+    func = statistics.median if statistic == 'median' else _mean
+    # Draw all resamples at once, and split them into resamples of
+    # len(values) values: it gives the same resamples than one draw per
+    # resample, but is faster
+    draws = iter(rng.choices(values, k=len(values) * resamples))
+    return [func(resample) for resample in zip(*[draws] * len(values))]
+
+
+def bootstrap_ci(values, statistic='mean', confidence=95.0,
+                 resamples=RESAMPLES, seed=SEED):
+    """Bootstrap confidence interval of the mean or the median of values.
+
+    Return (low, high).
+    """
+    rng = random.Random(seed)
+    stats = sorted(_bootstrap_stats(values, statistic, resamples, rng))
+    alpha = (100.0 - confidence) / 2
+    return (percentile(stats, alpha), percentile(stats, 100.0 - alpha))
+
+
+def bootstrap_ratio(sample1, sample2, statistic='mean', confidence=95.0,
+                    resamples=RESAMPLES, seed=SEED):
+    """Bootstrap confidence interval of the ratio sample2 / sample1.
+
+    statistic is 'mean' or 'median'. Return (ratio, low, high): ratio is
+    the ratio of the statistic of the two samples.
+    """
+    func = statistics.median if statistic == 'median' else _mean
+    ratio = func(sample2) / func(sample1)
+
+    rng = random.Random(seed)
+    stats1 = _bootstrap_stats(sample1, statistic, resamples, rng)
+    stats2 = _bootstrap_stats(sample2, statistic, resamples, rng)
+    ratios = sorted(stat2 / stat1 for stat1, stat2 in zip(stats1, stats2))
+    alpha = (100.0 - confidence) / 2
+    return (ratio, percentile(ratios, alpha),
+            percentile(ratios, 100.0 - alpha))
+
+
+def median_ci(values):
+    """Distribution-free confidence interval of the median of values.
+
+    Use order statistics: the number of values below the median follows a
+    binomial distribution B(n, 1/2), approximated by a normal distribution.
+    Return (low, high) of the 95% confidence interval.
+    """
+    values = sorted(values)
+    n = len(values)
+    half_width = Z_95 * math.sqrt(n) / 2.0
+    low = max(int(math.floor(n / 2.0 - half_width)), 0)
+    high = min(int(math.ceil(n / 2.0 + half_width)), n - 1)
+    return (values[low], values[high])
@@ -0,0 +1,272 @@
+"""Streaming loader of pyperf JSON files.
+
+pyperf.BenchmarkSuite.load() parses a whole JSON file into memory, and
+keeps the metadata and warmups of every run. Files of --rigorous and
+--track-memory runs can be hundreds of MB uncompressed.
+
+load_suite() parses the JSON file (or .json.gz) incrementally, one
+benchmark at a time. It only keeps the values and the dates of the runs of
+the selected benchmarks, and then creates a regular pyperf BenchmarkSuite
+from them.
+"""
+import datetime
+import json
+import math
+import sys
+
+
+# Size in characters of the first read, doubled when a benchmark doesn't
+# fit into the buffer
+CHUNK_SIZE = 1024 * 1024
+# Run metadata kept by load_suite(): dates are used by
+# BenchmarkSuite.get_dates(), performance_benchmark maps benchmarks to
+# manifest groups, other keys are needed to interpret values, and hw_ keys
+# are hardware counters of the --hw-counters option of run
+RUN_METADATA = ('date', 'duration', 'name', 'unit', 'loops', 'inner_loops',
+                'performance_benchmark',
+                'hw_iterations', 'hw_instructions', 'hw_cycles',
+                'hw_branch_misses', 'hw_cache_misses')
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]}'
+
+
+class JSONStream(object):
+    """Incremental parser of the top-level object of a JSON document.
+
+    Iterating on the stream yields (key, value) pairs of the top-level
+    object. The items of the key list (like "benchmarks") are yielded one
+    by one as (key, item) pairs.
+    """
+
+    def __init__(self, fp, key=None):
+        self.fp = fp
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.chunk_size = CHUNK_SIZE
+
+    def _read(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            return False
+        # Drop the parsed data
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _next_char(self):
+        while True:
+            while self.pos < len(self.buffer):
+                char = self.buffer[self.pos]
+                if char not in _WHITESPACE:
+                    return char
+                self.pos += 1
+            if not self._read():
+                raise ValueError("unexpected end of JSON file")
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError("expected %s at position %s, got %r"
+                             % (' or '.join(map(repr, chars)), self.pos, char))
+        self.pos += 1
+        return char
+
+    def _decode(self):
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                value = end = None
+            # A number can be truncated by the end of the buffer, like "1."
+            # of "1.25": it must be followed by a delimiter
+            if (end is not None and end < len(self.buffer)
+                    and (not isinstance(value, (int, float))
+                         or self.buffer[end] in _DELIMITERS)):
+                self.pos = end
+                self.chunk_size = CHUNK_SIZE
+                return value
+            if not self._read():
+                if end is None:
+                    raise ValueError("invalid JSON value at position %s"
+                                     % self.pos)
+                self.pos = end
+                return value
+            # Read more data at each attempt to not parse a large value
+            # too many times
+            self.chunk_size *= 2
+
+    def __iter__(self):
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            if key == self.key and self._next_char() == '[':
+                self.pos += 1
+                if self._next_char() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield (key, self._decode())
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                yield (key, self._decode())
+            if self._expect(',}') == '}':
+                break
+
+
+def _slim_run(run):
+    data = {key: value for key, value in run.items()
+            if key not in ('metadata', 'warmups')}
+    metadata = run.get('metadata')
+    if metadata:
+        metadata = {key: metadata[key] for key in RUN_METADATA
+                    if key in metadata}
+        if metadata:
+            data['metadata'] = metadata
+    if 'warmups' in run and not run.get('values') and not run.get('samples'):
+        # calibration run without values
+        data['warmups'] = run['warmups']
+    return data
+
+
+def parse_date(text):
+    # Parse a date written by pyperf, like "2020-03-26 15:50:39.816020"
+    try:
+        # fromisoformat() is much faster than strptime(), but requires
+        # Python 3.7
+        return datetime.datetime.fromisoformat(text)
+    except (AttributeError, ValueError):
+        pass
+    text, _, microseconds = text.strip().partition('.')
+    sep = 'T' if 'T' in text else ' '
+    date = datetime.datetime.strptime(text, '%Y-%m-%d' + sep + '%H:%M:%S')
+    if microseconds:
+        date += datetime.timedelta(seconds=float('.' + microseconds))
+    return date
+
+
+class SuiteFile(object):
+    """Benchmarks of a JSON file loaded by load_suite().
+
+    Implement the methods of pyperf.BenchmarkSuite used by pyperformance.
+    get_benchmark_names() and get_dates() cover all benchmarks of the file,
+    but only selected benchmarks are loaded.
+    """
+
+    def __init__(self, filename, names, metadata, dates, suite):
+        self.filename = filename
+        self._names = names
+        self._metadata = metadata
+        self._dates = dates
+        # pyperf BenchmarkSuite of selected benchmarks, or None
+        self._suite = suite
+
+    def get_benchmark_names(self):
+        return list(self._names)
+
+    def get_benchmarks(self):
+        if self._suite is None:
+            return []
+        return self._suite.get_benchmarks()
+
+    def __iter__(self):
+        return iter(self.get_benchmarks())
+
+    def __len__(self):
+        return len(self.get_benchmarks())
+
+    def get_benchmark(self, name):
+        if self._suite is None:
+            raise KeyError("benchmark %r was not loaded" % name)
+        return self._suite.get_benchmark(name)
+
+    def get_metadata(self):
+        if self._suite is None:
+            return dict(self._metadata)
+        return self._suite.get_metadata()
+
+    def get_dates(self):
+        return self._dates
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        # Use lazy import: only needed by compressed files
+        import gzip
+        return gzip.open(filename, "rt", encoding="utf-8")
+    else:
+        return open(filename, "r", encoding="utf-8")
+
+
+def _update_dates(dates, bench):
+    common = bench.get('metadata', {})
+    for run in bench['runs']:
+        metadata = dict(common, **run.get('metadata', {}))
+        if 'date' not in metadata:
+            continue
+        start = parse_date(metadata['date'])
+        duration = math.ceil(metadata.get('duration', 0))
+        end = start + datetime.timedelta(seconds=duration)
+        if not dates:
+            dates.extend((start, end))
+        else:
+            dates[0] = min(dates[0], start)
+            dates[1] = max(dates[1], end)
+
+
+def load_suite(filename, names=None):
+    """Load a pyperf JSON file incrementally: return a SuiteFile.
+
+    If names is set, only load benchmarks with these names.
+    """
+    # Use lazy import: pyperf is not needed to parse the JSON file
+    import pyperf
+
+    if filename == '-':
+        fp = sys.stdin
+    else:
+        fp = _open(filename)
+
+    data = {}
+    benchmarks = []
+    all_names = []
+    dates = []
+    with fp:
+        for key, bench in JSONStream(fp, 'benchmarks'):
+            if key != 'benchmarks':
+                data[key] = bench
+                continue
+            _update_dates(dates, bench)
+            # A suite of a single benchmark stores its name in the suite
+            # metadata, written after the benchmarks: None
+            name = bench.get('metadata', {}).get('name')
+            all_names.append(name)
+            if names is not None and name is not None and name not in names:
+                continue
+            runs = [_slim_run(run) for run in bench['runs']]
+            bench = {key: value for key, value in bench.items()
+                     if key != 'runs'}
+            bench['runs'] = runs
+            benchmarks.append((name, bench))
+
+    metadata = data.get('metadata') or {}
+    all_names = [name or metadata.get('name') for name in all_names]
+    if names is not None:
+        benchmarks = [bench for name, bench in benchmarks
+                      if (name or metadata.get('name')) in names]
+    else:
+        benchmarks = [bench for name, bench in benchmarks]
+
+    if benchmarks:
+        data['benchmarks'] = benchmarks
+        suite = pyperf.BenchmarkSuite.loads(json.dumps(data))
+    else:
+        suite = None
+    return SuiteFile(filename, all_names, metadata, tuple(dates) or None,
+                     suite)
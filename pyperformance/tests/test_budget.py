@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import budget
+
+
+def create_cost(name, spawn_time=0.1, value_time=0.1, between=0.0,
+                within=0.0):
+    """Create a cost with synthetic timings and relative variances."""
+    cost = budget.BenchmarkCost(name, [], 0.0)
+    cost.nbench = 1
+    cost.spawn_time = spawn_time
+    cost.fixed_time = 2 * spawn_time
+    cost.value_time = value_time
+    cost.warmups = 1
+    cost.variances = [(between, within)]
+    return cost
+
+
+def total_time(costs, sizes):
+    return sum(cost.estimate(*sizes[cost.name]) for cost in costs)
+
+
+class BenchmarkCostTests(unittest.TestCase):
+    def test_calibration(self):
+        metadata = {'name': 'bench', 'unit': 'second', 'loops': 1}
+        runs = [pyperf.Run([], warmups=[(1, 1.0)],
+                           metadata=dict(metadata, duration=0.5),
+                           collect_metadata=False)]
+        for values in ([1.0, 1.2], [1.1, 1.3]):
+            runs.append(pyperf.Run(values, warmups=[(1, 1.0)],
+                                   metadata=dict(metadata, duration=3.0),
+                                   collect_metadata=False))
+        cost = budget.BenchmarkCost('bench', [pyperf.Benchmark(runs)], 10.0)
+
+        # 1 master process and 3 worker processes: (10 - 6.5) / 4
+        self.assertAlmostEqual(cost.spawn_time, 0.875)
+        self.assertAlmostEqual(cost.fixed_time, 2 * 0.875 + 0.5)
+        # 6 seconds for 6 values, including warmups
+        self.assertAlmostEqual(cost.value_time, 1.0)
+        self.assertEqual(cost.warmups, 1)
+        self.assertAlmostEqual(cost.process_time(2), 0.875 + 3.0)
+        self.assertAlmostEqual(cost.estimate(3, 2),
+                               cost.fixed_time + 3 * cost.process_time(2))
+
+    def test_needed_processes(self):
+        cost = create_cost('bench', between=0.0004, within=0.0004)
+        # (0.0004 + 0.0004 / 4) / 0.01 ** 2 = 5 processes
+        self.assertEqual(cost.needed_processes(4, 0.01), 5)
+        stable = create_cost('stable')
+        self.assertEqual(stable.needed_processes(4, 0.01),
+                         budget.MIN_PROCESSES)
+        noisy = create_cost('noisy', between=1.0)
+        self.assertEqual(noisy.needed_processes(4, 0.01),
+                         budget.MAX_PROCESSES)
+
+
+class SplitBudgetTests(unittest.TestCase):
+    def test_enough_budget(self):
+        costs = [create_cost('a', between=0.0004),
+                 create_cost('b', between=0.0009)]
+        sizes = budget.split_budget(costs, 3600, 0.01)
+        self.assertEqual({name: size[0] for name, size in sizes.items()},
+                         {'a': 4, 'b': 9})
+
+    def test_short_budget(self):
+        costs = [create_cost('stable', between=0.0001),
+                 create_cost('noisy', between=0.01),
+                 create_cost('noisier', between=0.04)]
+        needed = budget.split_budget(costs, 3600, 0.01)
+        budget_time = total_time(costs, needed) / 4
+        sizes = budget.split_budget(costs, budget_time, 0.01)
+
+        self.assertLessEqual(total_time(costs, sizes), budget_time)
+        # the stable benchmark is capped, the noisier benchmark gets the
+        # most processes
+        self.assertEqual(sizes['stable'][0], needed['stable'][0])
+        self.assertGreater(sizes['noisier'][0], sizes['noisy'][0])
+        for name, (processes, values) in sizes.items():
+            self.assertGreaterEqual(processes, budget.MIN_PROCESSES)
+            self.assertLessEqual(processes, needed[name][0])
+
+    def test_min_processes(self):
+        # the stable benchmark would get less than MIN_PROCESSES: the
+        # time of its minimum processes is taken from the other benchmark
+        costs = [create_cost('stable', between=0.000001),
+                 create_cost('noisy', between=1.0)]
+        budget_time = sum(cost.estimate(10, cost.best_values())
+                          for cost in costs)
+        sizes = budget.split_budget(costs, budget_time, 0.01)
+
+        self.assertEqual(sizes['stable'][0], budget.MIN_PROCESSES)
+        self.assertEqual(sizes['noisy'][0], 17)
+        self.assertLessEqual(total_time(costs, sizes), budget_time)
+
+    def test_stable(self):
+        # all benchmarks are stable, but the budget is too short for the
+        # minimum number of processes: split the time evenly
+        costs = [create_cost('a', between=0.0, value_time=0.2),
+                 create_cost('b', between=0.0)]
+        sizes = budget.split_budget(costs, 1.0, 0.01)
+        self.assertEqual(sizes['a'][0], budget.MIN_PROCESSES)
+        self.assertEqual(sizes['b'][0], budget.MIN_PROCESSES)
+
+    def test_zero_process_time(self):
+        costs = [create_cost('free', spawn_time=0.0, value_time=0.0,
+                             between=0.01),
+                 create_cost('stable', between=0.0),
+                 create_cost('noisy', between=0.01)]
+        budget_time = sum(cost.estimate(budget.MIN_PROCESSES,
+                                        cost.best_values())
+                          for cost in costs) + 5.0
+        sizes = budget.split_budget(costs, budget_time, 0.01)
+
+        # a benchmark which takes no time gets the needed processes
+        self.assertEqual(sizes['free'][0], 100)
+        self.assertEqual(sizes['stable'][0], budget.MIN_PROCESSES)
+        self.assertGreater(sizes['noisy'][0], budget.MIN_PROCESSES)
+        self.assertLessEqual(total_time(costs, sizes), budget_time)
+
+        # all benchmarks are stable and take no time
+        costs = [create_cost('free', spawn_time=0.0, value_time=0.0)]
+        self.assertEqual(budget.split_budget(costs, 0.0, 0.01),
+                         {'free': (budget.MIN_PROCESSES,
+                                   budget.DEFAULT_VALUES)})
+
+
+class PlanTimeBudgetTests(unittest.TestCase):
+    def test_calibration_failed(self):
+        def run_benchmarks(bench_funcs, should_run, cmd_prefix, options,
+                           checkpoint=None, **kw):
+            metadata = {'name': 'a', 'unit': 'second', 'loops': 1,
+                        'duration': 1.0}
+            runs = [pyperf.Run([1.0, 1.01], warmups=[(1, 1.0)],
+                               metadata=metadata, collect_metadata=False)
+                    for process in range(2)]
+            checkpoint('a', [pyperf.Benchmark(runs)], 3.0)
+            return (None, [('b', 'failed'), ('c', 'timeout')])
+
+        bench_funcs = {name: types.SimpleNamespace(timeout=60)
+                       for name in 'abc'}
+        options = types.SimpleNamespace(time_budget=600, target_rsd=1.0,
+                                        timeout=None)
+        with mock.patch.object(budget, 'run_benchmarks', run_benchmarks):
+            with contextlib.redirect_stdout(io.StringIO()):
+                sizes, skipped = budget.plan_time_budget(
+                    bench_funcs, {'a', 'b', 'c'}, ['python'], options, [None])
+
+        # benchmarks without cost are not run with the default sample size
+        self.assertEqual(list(sizes), ['a'])
+        self.assertEqual(skipped, [('b', 'skipped, calibration failed'),
+                                   ('c', 'skipped, calibration timeout')])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import os
+import os.path
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import cli_run, run
+
+
+def create_bench(name, manifest_name=None, value=1.0, version=None,
+                 run_options=None):
+    worker_run = pyperf.Run([value, value * 1.01],
+                            metadata={'name': name, 'unit': 'second'},
+                            collect_metadata=False)
+    bench = pyperf.Benchmark([worker_run])
+    bench = run.tag_benchmarks(bench, manifest_name or name)[0]
+    if version is not None:
+        bench.update_metadata({'performance_version': version})
+    if run_options is not None:
+        bench.update_metadata({'performance_run_options': run_options})
+    return bench
+
+
+def create_options(**kw):
+    options = dict(debug_single_value=False, processes=None, values=None,
+                   rigorous=False, fast=False, adaptive_ci=None,
+                   warm_workers=False, hw_counters=False, time_budget=None)
+    options.update(kw)
+    return types.SimpleNamespace(**options)
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.filename = os.path.join(self.tmpdir, 'results.json')
+
+    def load_checkpoint(self, run_options=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return cli_run.load_checkpoint(self.filename, run_options)
+
+    def test_write_checkpoint(self):
+        results = {'telco': [create_bench('telco')],
+                   'xml_etree': [create_bench('xml_etree_parse', 'xml_etree'),
+                                 create_bench('xml_etree_generate',
+                                              'xml_etree')]}
+        suite = cli_run.write_checkpoint(self.filename, results)
+        self.assertEqual(suite.get_benchmark_names(),
+                         ['telco', 'xml_etree_parse', 'xml_etree_generate'])
+
+        loaded = self.load_checkpoint()
+        self.assertEqual({name: [bench.get_name() for bench in benchmarks]
+                          for name, benchmarks in loaded.items()},
+                         {'telco': ['telco'],
+                          'xml_etree': ['xml_etree_parse',
+                                        'xml_etree_generate']})
+        # the temporary file is renamed
+        self.assertEqual(os.listdir(self.tmpdir), ['results.json'])
+
+    def test_write_checkpoint_atomic(self):
+        cli_run.write_checkpoint(self.filename,
+                                 {'telco': [create_bench('telco')]})
+
+        # a failure while writing keeps the previous file
+        results = {'telco': [create_bench('telco')],
+                   'nbody': [create_bench('nbody')]}
+        with mock.patch.object(pyperf.BenchmarkSuite, 'dump',
+                               side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                cli_run.write_checkpoint(self.filename, results)
+        self.assertEqual(os.listdir(self.tmpdir), ['results.json'])
+        self.assertEqual(list(self.load_checkpoint()), ['telco'])
+
+    def test_resume_partial(self):
+        partial = create_bench('nbody')
+        partial.update_metadata({'performance_partial': 'timeout'})
+        results = {'telco': [create_bench('telco')],
+                   'nbody': [partial],
+                   'go': [create_bench('go', version='0.9')]}
+        cli_run.write_checkpoint(self.filename, results)
+
+        # only complete benchmarks of the same version are kept, missing
+        # benchmarks are run again
+        self.assertEqual(list(self.load_checkpoint()), ['telco'])
+
+    def test_run_options(self):
+        fast = cli_run.get_run_options(create_options(fast=True))
+        self.assertEqual(fast, 'fast')
+        self.assertEqual(
+            cli_run.get_run_options(create_options(time_budget=600)),
+            'default,budget=600')
+        self.assertEqual(
+            cli_run.get_run_options(create_options(processes=3)),
+            'processes=3,values=default')
+        self.assertEqual(
+            cli_run.get_run_options(create_options(adaptive_ci=1.0)),
+            'default,adaptive=1.0')
+        self.assertEqual(
+            cli_run.get_run_options(create_options(warm_workers=True)),
+            'default,warm')
+
+        cli_run.write_checkpoint(
+            self.filename,
+            {'telco': [create_bench('telco', run_options=fast)],
+             # checkpoint written before run options were stored
+             'go': [create_bench('go')]})
+        self.assertEqual(sorted(self.load_checkpoint(fast)), ['go', 'telco'])
+        with self.assertRaises(ValueError) as cm:
+            self.load_checkpoint('rigorous')
+        self.assertIn('fast != rigorous', str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 import io
 import os.path
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
 import unittest
 
-from pyperformance import tests
+import pyperf
+
+from pyperformance import compare, run, tests
+from pyperformance.stream import load_suite
 
 
 DATA_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), 'data'))
@@ -49,6 +54,7 @@ class CompareTests(unittest.TestCase):
         cmd = [sys.executable, '-m', 'pyperformance', 'compare',
                os.path.join(DATA_DIR, file1),
                os.path.join(DATA_DIR, file2)]
+        cmd.extend(kw.get('changed', ()))
         cmd.extend(args)
         proc = subprocess.Popen(cmd,
                                 stdout=subprocess.PIPE,
@@ -189,6 +195,130 @@ class CompareTests(unittest.TestCase):
             +-------------+-----------+-----------+--------------+------------------------------------------+
         ''').lstrip())
 
+    def test_compare_multiple(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file3 = os.path.join(tmpdir, 'py38_copy.json')
+            shutil.copyfile(os.path.join(DATA_DIR, 'py38.json'), file3)
+            stdout = self.compare(changed=[file3])
+
+        self.assertEqual(stdout.split('\n\n')[-1], textwrap.dedent('''
+            +--------------------------+-----------+-----------------------+-----------------------+
+            | Benchmark                | py36.json | py38.json             | py38_copy.json        |
+            +==========================+===========+=======================+=======================+
+            | telco                    | 10.7 ms   | 7.22 ms: 1.49x faster | 7.22 ms: 1.49x faster |
+            +--------------------------+-----------+-----------------------+-----------------------+
+            | Geometric mean (default) | (ref)     | 1.49x faster          | 1.49x faster          |
+            +--------------------------+-----------+-----------------------+-----------------------+
+            | Geometric mean           | (ref)     | 1.49x faster          | 1.49x faster          |
+            +--------------------------+-----------+-----------------------+-----------------------+
+        ''').lstrip())
+
+
+class GroupTests(unittest.TestCase):
+    def write_suite(self, filename, value):
+        # xml_etree produces several pyperf benchmarks, not in the manifest
+        benchmarks = []
+        for name in ('xml_etree_parse', 'xml_etree_generate'):
+            worker_run = pyperf.Run([value, value * 1.001],
+                                    warmups=[(1, value)],
+                                    metadata={'name': name, 'loops': 1,
+                                              'unit': 'second'},
+                                    collect_metadata=False)
+            bench = pyperf.Benchmark([worker_run])
+            benchmarks.extend(run.tag_benchmarks(bench, 'xml_etree'))
+        pyperf.BenchmarkSuite(benchmarks).dump(filename)
+
+    def test_multiple_benchmarks_script(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = []
+            for name, value in (('base', 1.0), ('changed1', 0.5),
+                                ('changed2', 2.0)):
+                filename = os.path.join(tmpdir, '%s.json' % name)
+                self.write_suite(filename, value)
+                filenames.append(filename)
+            cmd = [sys.executable, '-m', 'pyperformance', 'compare']
+            cmd.extend(filenames)
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        self.assertIn('| Geometric mean (serialize) | (ref)     '
+                      '| 2.00x faster (95% CI: 2.00x-2.00x) '
+                      '| 2.00x slower (95% CI: 2.00x-2.00x) |', proc.stdout)
+
+    def test_get_manifest_name(self):
+        bench = pyperf.Benchmark([pyperf.Run([1.0],
+                                             metadata={'name': 'telco'},
+                                             collect_metadata=False)])
+        self.assertEqual(compare.get_manifest_name(bench), 'telco')
+        bench = run.tag_benchmarks(bench, 'decimal')[0]
+        self.assertEqual(compare.get_manifest_name(bench), 'decimal')
+
+
+class GeometricMeanTests(unittest.TestCase):
+    def test_geometric_mean(self):
+        mean, low, high = compare.geometric_mean([0.5, 2.0])
+        self.assertAlmostEqual(mean, 1.0)
+        self.assertLess(low, 1.0)
+        self.assertGreater(high, 1.0)
+        self.assertEqual(compare.geometric_mean([0.5]), (0.5, None, None))
+
+    def test_format(self):
+        self.assertEqual(compare.format_geometric_mean([0.5], True),
+                         '2.00x faster')
+        self.assertEqual(compare.format_geometric_mean([0.5, 0.5], True),
+                         '2.00x faster (95% CI: 2.00x-2.00x)')
+        self.assertEqual(compare.format_geometric_mean([1.2, 1.2], False),
+                         '1.20x larger (95% CI: 1.20x-1.20x)')
+        self.assertEqual(compare.format_geometric_mean([], True), '-')
+
+
+class HWCountersTests(unittest.TestCase):
+    def create_bench(self, instructions, cycles):
+        # Runs of 2 values of 10 loops after a warmup: 30 iterations
+        bench = None
+        for run_instructions in instructions:
+            worker_run = pyperf.Run([1.0, 1.0], warmups=[(10, 1.0)],
+                                    metadata={'name': 'bench', 'loops': 10,
+                                              'unit': 'second'},
+                                    collect_metadata=False)
+            run_bench = pyperf.Benchmark([worker_run])
+            run.add_hw_counters(run_bench, {'instructions': run_instructions,
+                                            'cycles': cycles})
+            if bench is None:
+                bench = run_bench
+            else:
+                bench.add_runs(run_bench)
+        return bench
+
+    def test_get_hw_counters(self):
+        bench = self.create_bench([3000, 6000], 1500)
+        self.assertEqual(compare.get_hw_counters(bench),
+                         {'instructions': 150.0, 'cycles': 50.0,
+                          'ipc': 3.0})
+        self.assertEqual(compare.get_hw_counters(
+            pyperf.Benchmark([pyperf.Run([1.0], metadata={'name': 'bench'},
+                                         collect_metadata=False)])),
+                         {})
+
+    def test_format(self):
+        base = self.create_bench([3000], 1500)
+        changed = self.create_bench([2700], 1500)
+        self.assertEqual(compare.format_hw_counters(base, changed),
+                         ['Instructions per iteration: 100 -> 90: -10.0%',
+                          'IPC: 2.00 -> 1.80: -10.0%',
+                          'Cycles per iteration: 50 -> 50: +0.0%'])
+
+    def test_load_suite(self):
+        # counters are kept by the streaming loader
+        bench = self.create_bench([3000, 6000], 1500)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'bench.json')
+            pyperf.BenchmarkSuite([bench]).dump(filename)
+            suite = load_suite(filename)
+        self.assertEqual(
+            compare.get_hw_counters(suite.get_benchmark('bench'))['ipc'],
+            3.0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import json
+import logging
+import os.path
+import shutil
+import tempfile
+import textwrap
+import threading
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import compile, upload
+
+
+class ParseConfigTests(unittest.TestCase):
+    def parse_config(self, text, command='compile_all'):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'benchmark.conf')
+            with open(filename, 'w', encoding='utf-8') as fp:
+                fp.write(textwrap.dedent('''
+                    [config]
+                    json_dir = %s/json
+
+                    [scm]
+                    repo_dir = %s/cpython
+
+                    [compile]
+                    bench_dir = %s/bench
+                ''' % (tmpdir, tmpdir, tmpdir)))
+                fp.write(textwrap.dedent(text))
+            return compile.parse_config(filename, command)
+
+    def check_error(self, text, error):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            with self.assertRaises(SystemExit):
+                self.parse_config(text)
+        self.assertIn(error, stdout.getvalue())
+
+    def test_pipeline(self):
+        conf = self.parse_config('''
+            [run_benchmark]
+            cpu_sets = 2-3,4-5
+
+            [compile_all]
+            pipeline = True
+            housekeeping_cpus = 0-1
+        ''')
+        self.assertTrue(conf.pipeline)
+        self.assertEqual(conf.housekeeping_cpus, '0-1')
+
+    def test_pipeline_requires_housekeeping_cpus(self):
+        self.check_error('''
+            [run_benchmark]
+            affinity = 2-3
+
+            [compile_all]
+            pipeline = True
+        ''', 'requires to set housekeeping_cpus')
+
+    def test_pipeline_requires_benchmark_cpus(self):
+        self.check_error('''
+            [compile_all]
+            pipeline = True
+            housekeeping_cpus = 0-1
+        ''', 'requires to set affinity or cpu_sets')
+
+    def test_housekeeping_cpus_overlap(self):
+        self.check_error('''
+            [run_benchmark]
+            affinity = 1-3
+
+            [compile_all]
+            pipeline = True
+            housekeeping_cpus = 0-1
+        ''', 'must not contain benchmark CPUs: 1')
+
+
+class FakeApplication(compile.Application):
+    def __init__(self, conf=None):
+        self.conf = conf
+        self.branch = 'master'
+        self.logger = logging.getLogger('test_compile')
+        self.logger.propagate = False
+        self.commands = []
+        # exit codes of the next make commands
+        self.make_exitcodes = []
+
+    def run_nocheck(self, *cmd, cwd=None, env=None):
+        self.commands.append((os.path.basename(cmd[0]),) + cmd[1:])
+        if cmd[0].endswith('configure'):
+            open(os.path.join(cwd, 'Makefile'), 'w').close()
+        if cmd[0] == 'make' and self.make_exitcodes:
+            return self.make_exitcodes.pop(0)
+        return 0
+
+
+class PythonBuildTests(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.conf = types.SimpleNamespace(
+            build_dir=os.path.join(tmpdir, 'build'),
+            repo_dir=os.path.join(tmpdir, 'cpython'),
+            ccache=True, ccache_dir=os.path.join(tmpdir, 'ccache'),
+            prefix='', debug=False, lto=False, pkg_only=[], pgo=False,
+            jobs=2, incremental=True, prefix_cache=False, install=False)
+        self.app = FakeApplication(self.conf)
+        self.python = compile.Python(self.app, self.conf)
+
+        # fake ccache program
+        self.bin_dir = os.path.join(tmpdir, 'bin')
+        os.makedirs(self.bin_dir)
+        self.ccache = os.path.join(self.bin_dir, 'ccache')
+        with open(self.ccache, 'w') as fp:
+            fp.write('#!/bin/sh\n')
+        os.chmod(self.ccache, 0o755)
+
+    def test_ccache_env(self):
+        with mock.patch.dict(os.environ, {'PATH': self.bin_dir}):
+            env = self.python.get_build_env()
+
+        # compilers are masquerading as ccache, CC is not overridden
+        ccache_bin = os.path.join(self.conf.ccache_dir, 'bin')
+        self.assertEqual(env['PATH'].split(os.pathsep),
+                         [ccache_bin, self.bin_dir])
+        self.assertNotIn('CC', env)
+        for name in ('cc', 'gcc', 'clang'):
+            self.assertEqual(os.readlink(os.path.join(ccache_bin, name)),
+                             self.ccache)
+        self.assertEqual(env['CCACHE_DIR'], self.conf.ccache_dir)
+        self.assertEqual(env['CCACHE_BASEDIR'], self.conf.repo_dir)
+
+    def test_no_ccache(self):
+        # ccache program not found
+        with mock.patch.dict(os.environ, {'PATH': self.conf.repo_dir}):
+            self.assertIsNone(self.python.get_build_env())
+
+        self.conf.ccache = False
+        with mock.patch.dict(os.environ, {'PATH': self.bin_dir}):
+            self.assertIsNone(self.python.get_build_env())
+
+    def compile(self):
+        self.app.commands.clear()
+        self.python.compile()
+        return [cmd[0] for cmd in self.app.commands]
+
+    def test_incremental(self):
+        self.assertEqual(self.compile(), ['configure', 'make'])
+        # same configure options: skip configure
+        self.assertEqual(self.compile(), ['make'])
+
+        # configure options changed
+        self.conf.lto = True
+        self.assertEqual(self.compile(), ['configure', 'make'])
+        self.assertIn('--with-lto', self.app.commands[0])
+
+        # the incremental build failed: rebuild from scratch
+        self.app.make_exitcodes = [2, 0]
+        self.assertEqual(self.compile(), ['make', 'configure', 'make'])
+
+        # incremental builds disabled
+        self.conf.incremental = False
+        self.assertEqual(self.compile(), ['configure', 'make'])
+
+
+class PrefixCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.prefix = os.path.join(self.tmpdir, 'prefix')
+
+    def create_cache(self, max_size=10 ** 6):
+        return compile.PrefixCache(FakeApplication(), self.cache_dir,
+                                   max_size)
+
+    def install(self, content):
+        # Files of the prefix are hard links to files of the cache: like
+        # install_python(), remove the previous installation
+        shutil.rmtree(self.prefix, ignore_errors=True)
+        os.makedirs(os.path.join(self.prefix, 'bin'))
+        with open(os.path.join(self.prefix, 'bin', 'python'), 'w') as fp:
+            fp.write(content)
+
+    def read_installed(self):
+        with open(os.path.join(self.prefix, 'bin', 'python')) as fp:
+            return fp.read()
+
+    def test_miss(self):
+        cache = self.create_cache()
+        self.install('python')
+        self.assertFalse(cache.restore('key', self.prefix))
+        self.assertEqual(self.read_installed(), 'python')
+
+    def test_hit(self):
+        cache = self.create_cache()
+        self.install('python1')
+        cache.add('key1', self.prefix, {'revision': 'rev1'})
+        with open(os.path.join(self.cache_dir, 'key1', 'info.json')) as fp:
+            info = json.load(fp)
+        self.assertEqual(info, {'revision': 'rev1', 'size': 7})
+
+        # the prefix is replaced with the cached prefix
+        self.install('python2')
+        open(os.path.join(self.prefix, 'stale'), 'w').close()
+        self.assertTrue(cache.restore('key1', self.prefix))
+        self.assertEqual(self.read_installed(), 'python1')
+        self.assertEqual(sorted(os.listdir(self.prefix)), ['bin'])
+        # no temporary directory left
+        self.assertEqual(os.listdir(self.cache_dir), ['key1'])
+
+    def test_eviction(self):
+        # two entries of 7 bytes fit into the cache, not three
+        cache = self.create_cache(max_size=20)
+        for index, key in enumerate(('key1', 'key2')):
+            self.install('python%s' % index)
+            cache.add(key, self.prefix, {})
+            # key1 was used first
+            info_file = os.path.join(self.cache_dir, key, 'info.json')
+            os.utime(info_file, (index, index))
+
+        # using key1 makes key2 the least recently used entry
+        self.assertTrue(cache.restore('key1', self.prefix))
+        self.install('python3')
+        cache.add('key3', self.prefix, {})
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ['key1', 'key3'])
+        self.assertFalse(cache.restore('key2', self.prefix))
+
+        # the most recently used entry is kept even if it is too large
+        cache.max_size = 1
+        cache.evict()
+        self.assertEqual(os.listdir(self.cache_dir), ['key3'])
+
+
+def create_bench(values):
+    worker_run = pyperf.Run(values, metadata={'name': 'bench',
+                                              'unit': 'second'},
+                            collect_metadata=False)
+    return pyperf.Benchmark([worker_run])
+
+
+class BisectTests(unittest.TestCase):
+    def bisect(self, first_bad, skipped=()):
+        revisions = ['rev%s' % index for index in range(10)]
+        tested = []
+
+        def test(revision, left):
+            tested.append(revision)
+            if revision in skipped:
+                return 'skipped'
+            if revisions.index(revision) >= first_bad:
+                return 'bad'
+            return 'good'
+
+        lo, hi = compile.bisect_revisions(revisions, test)
+        return revisions[lo:hi], revisions[hi], tested
+
+    def test_bisect(self):
+        for first_bad in range(10):
+            with self.subTest(first_bad=first_bad):
+                unknown, bad, tested = self.bisect(first_bad)
+                self.assertEqual(unknown, [])
+                self.assertEqual(bad, 'rev%s' % first_bad)
+                # binary search: at most ceil(log2(9)) tests, and the last
+                # revision is known to be bad
+                self.assertLessEqual(len(tested), 4)
+                self.assertNotIn('rev9', tested)
+
+    def test_bisect_skipped(self):
+        # the skipped revision may be the first bad revision
+        unknown, bad, tested = self.bisect(5, skipped={'rev4'})
+        self.assertEqual(unknown, ['rev4'])
+        self.assertEqual(bad, 'rev5')
+
+        # the skipped revision is after the first bad revision
+        unknown, bad, tested = self.bisect(3, skipped={'rev4'})
+        self.assertEqual(unknown, [])
+        self.assertEqual(bad, 'rev3')
+
+        # all revisions skipped
+        unknown, bad, tested = self.bisect(
+            9, skipped={'rev%s' % index for index in range(9)})
+        self.assertEqual(len(unknown), 9)
+        self.assertEqual(len(tested), 9)
+
+    def test_is_regression(self):
+        base = create_bench([1.0, 1.01, 0.99, 1.0, 1.02, 0.98])
+        slower = create_bench([1.1, 1.11, 1.09, 1.1, 1.12, 1.08])
+        self.assertTrue(compile.is_regression(base, slower, 0.05))
+        # slower, but less than the threshold
+        self.assertFalse(compile.is_regression(base, slower, 0.2))
+        # faster
+        self.assertFalse(compile.is_regression(slower, base, 0.05))
+        # not significant
+        noisy = create_bench([0.6, 1.6, 1.0, 1.5, 0.7, 1.2])
+        self.assertFalse(compile.is_regression(base, noisy, 0.05))
+        # single value (--debug-single-value): the significance cannot be
+        # computed
+        with self.assertRaises(ValueError) as cm:
+            compile.is_regression(create_bench([1.0]), create_bench([1.1]),
+                                  0.05)
+        self.assertIn('--debug-single-value', str(cm.exception))
+
+
+class FakeBenchmarkAll(compile.BenchmarkAll):
+    def run_nocheck(self, *cmd, **kw):
+        # Write the result file of the compile command without compiling
+        self.commands.append(cmd)
+        revision = cmd[cmd.index('compile') + 2]
+        if '--stage' in cmd and cmd[cmd.index('--stage') + 1] == 'build':
+            return 0
+        metadata = {'name': 'telco', 'unit': 'second',
+                    'commit_id': revision, 'commit_branch': 'master',
+                    'commit_date': '2020-01-01T00:00:00+00:00'}
+        worker_run = pyperf.Run([1.0, 1.5], metadata=metadata,
+                                collect_metadata=False)
+        suite = pyperf.BenchmarkSuite([pyperf.Benchmark([worker_run])])
+        os.makedirs(self.conf.json_dir, exist_ok=True)
+        filename = os.path.join(self.conf.json_dir,
+                                '2020-01-01_00-00-master-%s.json.gz'
+                                % revision)
+        suite.dump(filename)
+        return 0
+
+
+class CompileAllTests(unittest.TestCase):
+    def start_server(self):
+        server = upload.CodespeedServer()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def compile_all(self, tmpdir, text='', url=None, exitcode=0):
+        logger = logging.getLogger()
+        handlers = list(logger.handlers)
+        self.addCleanup(setattr, logger, 'handlers', handlers)
+
+        filename = os.path.join(tmpdir, 'benchmark.conf')
+        with open(filename, 'w', encoding='utf-8') as fp:
+            fp.write(textwrap.dedent('''
+                [config]
+                json_dir = %s/json
+
+                [scm]
+                repo_dir = %s/cpython
+
+                [compile]
+                bench_dir = %s/bench
+
+                [compile_all_revisions]
+                aaaa =
+                bbbb =
+            ''' % (tmpdir, tmpdir, tmpdir)))
+            if url:
+                fp.write(textwrap.dedent('''
+                    [run_benchmark]
+                    system_tune = False
+                    upload = True
+
+                    [upload]
+                    url = %s
+                    environment = host
+                    executable = python
+                    project = CPython
+                ''' % url))
+            fp.write(textwrap.dedent(text))
+
+        options = types.SimpleNamespace(inherit_environ=None)
+        bench = FakeBenchmarkAll(filename, options)
+        bench.commands = []
+        with self.assertRaises(SystemExit) as cm:
+            bench.main()
+            raise SystemExit(0)
+        self.assertEqual(cm.exception.code, exitcode)
+        return bench
+
+    def test_upload_once(self):
+        server = self.start_server()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bench = self.compile_all(tmpdir, url=server.url)
+            uploaded = sorted(os.listdir(os.path.join(tmpdir, 'json',
+                                                      'uploaded')))
+
+        # compile doesn't upload, compile_all uploads both revisions at once
+        self.assertTrue(all('--no-upload' in cmd for cmd in bench.commands))
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(sorted(result['commitid']
+                                for result in server.results),
+                         ['aaaa', 'bbbb'])
+        self.assertEqual(uploaded,
+                         ['2020-01-01_00-00-master-aaaa.json.gz',
+                          '2020-01-01_00-00-master-bbbb.json.gz'])
+        self.assertEqual(bench.uploaded, ['aaaa', 'bbbb'])
+        self.assertEqual(bench.outputs, [])
+
+    def test_upload_error(self):
+        server = self.start_server()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # results of aaaa were already uploaded
+            uploaded_dir = os.path.join(tmpdir, 'json', 'uploaded')
+            os.makedirs(uploaded_dir)
+            open(os.path.join(uploaded_dir,
+                              '2020-01-01_00-00-master-aaaa.json.gz'),
+                 'w').close()
+
+            # the error doesn't stop next revisions
+            bench = self.compile_all(tmpdir, url=server.url, exitcode=1)
+
+        self.assertEqual(len(bench.commands), 2)
+        self.assertEqual(bench.failed, ['aaaa'])
+        self.assertEqual(bench.uploaded, ['bbbb'])
+        self.assertEqual([result['commitid'] for result in server.results],
+                         ['bbbb'])
+
+    def test_pipeline_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bench = self.compile_all(tmpdir, '''
+                [run_benchmark]
+                system_tune = False
+                affinity = 1
+
+                [compile_all]
+                pipeline = True
+                housekeeping_cpus = 0
+            ''')
+
+        stages = {}
+        for cmd in bench.commands:
+            revision = cmd[cmd.index('compile') + 2]
+            stage = cmd[cmd.index('--stage') + 1]
+            stages[(revision, stage)] = cmd
+        self.assertEqual(sorted(stages),
+                         [('aaaa', 'bench'), ('aaaa', 'build'),
+                          ('bbbb', 'bench'), ('bbbb', 'build')])
+        # only the first build updates the repository, builds run on the
+        # housekeeping CPUs
+        self.assertNotIn('--no-update', stages[('aaaa', 'build')])
+        self.assertIn('--no-update', stages[('bbbb', 'build')])
+        self.assertIn('--no-update', stages[('aaaa', 'bench')])
+        self.assertEqual(stages[('aaaa', 'build')][:3], ('taskset', '-c', '0'))
+        # the builder thread doesn't modify the configuration
+        self.assertTrue(bench.conf.update)
+        self.assertEqual(bench.outputs, ['aaaa', 'bbbb'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from pyperformance import db
+
+
+DATA_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), 'data'))
+
+
+class ResultsDBTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.db = db.ResultsDB(os.path.join(self.tmpdir, 'results.db'))
+        self.addCleanup(self.db.close)
+
+    def create_json(self, name, commit_id, commit_date):
+        # Copy a suite with the metadata written by the compile command
+        with open(os.path.join(DATA_DIR, 'py36.json'),
+                  encoding='utf-8') as fp:
+            data = json.load(fp)
+        data['metadata'].update(commit_id=commit_id,
+                                commit_branch='master',
+                                commit_date=commit_date)
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp)
+        return filename
+
+    def test_values(self):
+        values = [1.5, 0.001, 2e-9]
+        data = db.encode_values(values)
+        self.assertEqual(len(data), 8 * len(values))
+        self.assertEqual(db.decode_values(data), values)
+
+    def test_import(self):
+        filename = self.create_json('a.json', 'abcdef', '2020-03-01')
+        self.assertEqual(self.db.import_file(filename), 1)
+        # already imported
+        self.assertIsNone(self.db.import_file(filename))
+
+        rows = self.db.query(benchmarks=['telco'])
+        self.assertEqual(len(rows), 1)
+        commit_id, branch, commit_date = rows[0][:3]
+        self.assertEqual((commit_id, branch, commit_date),
+                         ('abcdef', 'master', '2020-03-01'))
+        self.assertEqual(rows[0][5:8], ('telco', 'second', 60))
+        self.assertEqual(len(self.db.get_values('abc', 'telco')), 60)
+
+    def test_query(self):
+        for index, day in enumerate((3, 1, 2)):
+            filename = self.create_json('%s.json' % index,
+                                        'commit%s' % day,
+                                        '2020-03-0%s' % day)
+            self.db.import_file(filename)
+
+        rows = self.db.query(benchmarks=['telco'])
+        self.assertEqual([row[0] for row in rows],
+                         ['commit1', 'commit2', 'commit3'])
+        rows = self.db.query(benchmarks=['telco'], limit=2)
+        self.assertEqual([row[0] for row in rows], ['commit2', 'commit3'])
+        rows = self.db.query(benchmarks=['telco'], since='2020-03-02',
+                             until='2020-03-02')
+        self.assertEqual([row[0] for row in rows], ['commit2'])
+        self.assertEqual(self.db.query(benchmarks=['telco'], host='other'),
+                         [])
+
+        rows = self.db.compare('commit1', 'commit3')
+        self.assertEqual(len(rows), 1)
+        name, unit, mean1, mean2 = rows[0]
+        self.assertEqual((name, unit), ('telco', 'second'))
+        self.assertAlmostEqual(mean1, mean2)
+        self.assertEqual(self.db.compare('commit1', 'unknown'), [])
+
+    def test_query_until(self):
+        for day, commit_date in ((1, '2020-03-01T23:59:59+00:00'),
+                                 (2, '2020-03-02T00:00:00+00:00')):
+            filename = self.create_json('%s.json' % day, 'commit%s' % day,
+                                        commit_date)
+            self.db.import_file(filename)
+
+        def query(until):
+            rows = self.db.query(benchmarks=['telco'], until=until)
+            return [row[0] for row in rows]
+
+        # a date includes the whole day
+        self.assertEqual(query('2020-03-01'), ['commit1'])
+        self.assertEqual(query('2020-02-29'), [])
+        self.assertEqual(query('2020-03-02'), ['commit1', 'commit2'])
+        # a timestamp is compared as is
+        self.assertEqual(query('2020-03-01T23:59:59+00:00'), ['commit1'])
+        self.assertEqual(query('2020-03-02T00:00:00+00:00'),
+                         ['commit1', 'commit2'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from pyperformance import detect
+
+
+def create_history(*segments):
+    rng = random.Random(12345)
+    values = []
+    for mean, size in segments:
+        values.extend(rng.gauss(mean, mean * 0.005) for _ in range(size))
+    revisions = [('commit%03d' % index, '2020-01-01')
+                 for index in range(len(values))]
+    return revisions, values
+
+
+class DetectTests(unittest.TestCase):
+    def test_pelt(self):
+        revisions, values = create_history((1.0, 50), (1.1, 30), (1.05, 40))
+        self.assertEqual(detect.pelt(values), [50, 80])
+
+        revisions, values = create_history((1.0, 100))
+        self.assertEqual(detect.pelt(values), [])
+        self.assertEqual(detect.pelt([1.0] * 10), [])
+
+    def test_detect(self):
+        # the second change is smaller than the threshold: its segments are
+        # merged
+        revisions, values = create_history((1.0, 50), (1.1, 30),
+                                           (1.105, 40))
+        changepoints = detect.detect_changepoints('bench', 'second',
+                                                  revisions, values)
+        self.assertEqual(len(changepoints), 1)
+        changepoint = changepoints[0]
+        self.assertEqual(changepoint.commit_id, 'commit050')
+        self.assertEqual((changepoint.nbefore, changepoint.nafter), (50, 70))
+        self.assertAlmostEqual(changepoint.change, 10.0, delta=0.5)
+        self.assertGreater(changepoint.effect_size, 10)
+        self.assertGreater(changepoint.confidence, 99.9)
+
+        # the change is smaller than the threshold
+        changepoints = detect.detect_changepoints('bench', 'second',
+                                                  revisions, values,
+                                                  threshold=20.0)
+        self.assertEqual(changepoints, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
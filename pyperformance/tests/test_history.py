@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import os.path
+import tempfile
+import unittest
+
+from pyperformance import history
+
+
+def run_options(**kw):
+    options = dict(debug_single_value=False, processes=None, values=None,
+                   rigorous=False, fast=False, adaptive_ci=None,
+                   warm_workers=False, hw_counters=False)
+    options.update(kw)
+    return argparse.Namespace(**options)
+
+
+class RuntimeHistoryTests(unittest.TestCase):
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cache', 'history.json')
+            runtimes = history.RuntimeHistory('/usr/bin/python3', filename)
+            self.assertIsNone(runtimes.get('nbody', 'fast'))
+            for runtime in range(1, history.MAX_RUNTIMES + 3):
+                runtimes.add('nbody', 'fast', runtime)
+            runtimes.save()
+
+            other = history.RuntimeHistory('/other/python', filename)
+            other.add('nbody', 'fast', 100.0)
+            other.save()
+
+            runtimes = history.RuntimeHistory('/usr/bin/python3', filename)
+            # median of the last MAX_RUNTIMES runtimes: 3, 4, 5, 6, 7
+            self.assertEqual(runtimes.get('nbody', 'fast'), 5)
+            self.assertIsNone(runtimes.get('nbody', 'rigorous'))
+            other = history.RuntimeHistory('/other/python', filename)
+            self.assertEqual(other.get('nbody', 'fast'), 100.0)
+
+    def test_run_mode(self):
+        self.assertEqual(history.get_run_mode(run_options()), 'default')
+        self.assertEqual(history.get_run_mode(run_options(fast=True)), 'fast')
+        self.assertEqual(history.get_run_mode(run_options(processes=5)),
+                         'processes=5,values=default')
+        self.assertEqual(history.get_run_mode(run_options(), (4, 10)),
+                         'processes=4,values=10')
+        self.assertEqual(history.get_run_mode(run_options(warm_workers=True)),
+                         'default,warm')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import os.path
+import tempfile
+import textwrap
+import unittest
+
+from pyperformance import manifest
+
+
+class ManifestTests(unittest.TestCase):
+    def write_manifest(self, tmpdir, content):
+        filename = os.path.join(tmpdir, 'manifest.ini')
+        with open(filename, 'w', encoding='utf-8') as fp:
+            fp.write(textwrap.dedent(content))
+        return filename
+
+    def test_default_manifest(self):
+        benchmarks, groups = manifest.load_benchmarks()
+        for bench in benchmarks.values():
+            self.assertTrue(os.path.exists(bench.script), bench.script)
+        self.assertEqual(groups['all'], sorted(benchmarks))
+        for group, names in groups.items():
+            self.assertTrue(set(names) <= set(benchmarks), group)
+
+        bench = benchmarks['pickle_pure_python']
+        self.assertEqual(os.path.basename(bench.script), 'bm_pickle.py')
+        self.assertEqual(bench.args, ['--pure-python', 'pickle'])
+        self.assertIn('default', bench.groups)
+        self.assertEqual(bench.runtime, 20)
+        # no default runtime: the runtime of chameleon was not measured
+        self.assertIsNone(benchmarks['chameleon'].runtime)
+
+    def test_external_manifest(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = self.write_manifest(tmpdir, """
+                [DEFAULT]
+                runtime = 1m
+
+                [my_bench]
+                args = --flag "two words"
+                groups = mine, other
+                requirements = sympy
+                timeout = 1h30m
+                tags = slow
+            """)
+            benchmarks, groups = manifest.load_benchmarks([filename])
+
+        bench = benchmarks['my_bench']
+        self.assertEqual(bench.script, os.path.join(tmpdir, 'bm_my_bench.py'))
+        self.assertEqual(bench.args, ['--flag', 'two words'])
+        self.assertEqual(bench.groups, ['mine', 'other'])
+        self.assertEqual(bench.requirements, ['sympy'])
+        self.assertEqual(bench.runtime, 60)
+        self.assertEqual(bench.timeout, 90 * 60)
+        self.assertEqual(bench.tags, ['slow'])
+        self.assertEqual(groups['mine'], ['my_bench'])
+        self.assertIn('my_bench', groups['all'])
+        self.assertIn('nbody', groups['all'])
+
+    def test_invalid_manifest(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = self.write_manifest(tmpdir, """
+                [nbody]
+            """)
+            with self.assertRaises(ValueError):
+                manifest.load_benchmarks([filename])
+
+            filename = self.write_manifest(tmpdir, """
+                [my_bench]
+                unknown = 1
+            """)
+            with self.assertRaises(ValueError):
+                manifest.load_benchmarks([filename])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+import marshal
+import os
+import os.path
+import pstats
+import subprocess
+import sys
+import tempfile
+import textwrap
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import cli_profile, profiler, run
+
+
+MAIN = ('/venv/bm_test.py', 1, '<module>')
+FUNC = ('/venv/bm_test.py', 10, 'func')
+DUMPS = ('/usr/lib/python3.8/json/encoder.py', 180, 'encode')
+
+SCRIPT = textwrap.dedent('''
+    import pyperf
+
+    def setup():
+        return sum(range(10 ** 6))
+
+    def workload():
+        return sum(range(10 ** 6))
+
+    if __name__ == "__main__":
+        setup()
+        runner = pyperf.Runner()
+        runner.bench_func('bench', workload)
+''')
+
+PERFORMANCE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class ProfilerTests(unittest.TestCase):
+    def test_get_stats(self):
+        stacks = {(MAIN, FUNC): 3, (MAIN, FUNC, DUMPS): 1, (MAIN,): 1}
+        stats = profiler.get_stats(stacks, 0.5)
+        self.assertEqual(stats[MAIN], (5, 5, 0.5, 2.5, {}))
+        self.assertEqual(stats[FUNC],
+                         (4, 4, 1.5, 2.0, {MAIN: (4, 4, 1.5, 2.0)}))
+        self.assertEqual(stats[DUMPS],
+                         (1, 1, 0.5, 0.5, {FUNC: (1, 1, 0.5, 0.5)}))
+
+    def test_recursion(self):
+        stats = profiler.get_stats({(MAIN, FUNC, FUNC): 2}, 1.0)
+        self.assertEqual(stats[FUNC],
+                         (2, 2, 2.0, 2.0, {MAIN: (2, 2, 0.0, 2.0)}))
+
+    def test_write_collapsed(self):
+        stacks = {(MAIN, FUNC): 3, (MAIN, FUNC, DUMPS): 1}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'test.collapsed')
+            profiler.write_collapsed(stacks, filename)
+            with open(filename, encoding='utf-8') as fp:
+                lines = fp.read().splitlines()
+        self.assertEqual(lines,
+                         ['<module> (venv/bm_test.py:1);func '
+                          '(venv/bm_test.py:10) 3',
+                          '<module> (venv/bm_test.py:1);func '
+                          '(venv/bm_test.py:10);encode (json/encoder.py:180) '
+                          '1'])
+
+
+class TimedLoopsTests(unittest.TestCase):
+    def profile(self, *args):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bm_path = os.path.join(tmpdir, 'bm_test.py')
+            with open(bm_path, 'w', encoding='utf-8') as fp:
+                fp.write(SCRIPT)
+            output = os.path.join(tmpdir, 'bench')
+            env = dict(os.environ, PYTHONPATH=PERFORMANCE_DIR)
+            cmd = [sys.executable, '-m', 'pyperformance.profiler']
+            cmd.extend(args)
+            cmd.extend((output, bm_path, '--worker', '--loops=2',
+                        '--warmups=1', '--values=3'))
+            subprocess.run(cmd, env=env, check=True)
+            stats = pstats.Stats(output + '.pstats').stats
+        return {name: nc for (filename, line, name), (cc, nc, tt, ct, callers)
+                in stats.items() if filename == bm_path}
+
+    def test_cprofile(self):
+        calls = self.profile()
+        # only the timed loops are profiled: 1 warmup and 3 values of
+        # 2 loops
+        self.assertEqual(calls['workload'], 8)
+        self.assertNotIn('setup', calls)
+        self.assertNotIn('<module>', calls)
+
+    @unittest.skipUnless(hasattr(profiler.signal, 'setitimer'),
+                         'need signal.setitimer()')
+    def test_sampler(self):
+        calls = self.profile('--sampler')
+        self.assertIn('workload', calls)
+        self.assertNotIn('setup', calls)
+
+
+class ProfileDiffTests(unittest.TestCase):
+    def write_profile(self, dirname, stacks):
+        os.makedirs(dirname, exist_ok=True)
+        filename = os.path.join(dirname, 'test.pstats')
+        with open(filename, 'wb') as fp:
+            marshal.dump(profiler.get_stats(stacks, 0.001), fp)
+        # the file is readable by pstats
+        pstats.Stats(filename)
+        return filename
+
+    def test_diff(self):
+        # line numbers and paths of the two Python are different
+        dumps2 = ('/opt/py39/lib/python3.9/json/encoder.py', 182, 'encode')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = os.path.join(tmpdir, 'base')
+            changed = os.path.join(tmpdir, 'changed')
+            self.write_profile(base, {(MAIN, FUNC): 10, (MAIN, DUMPS): 10})
+            self.write_profile(changed, {(MAIN, FUNC): 10,
+                                         (MAIN, dumps2): 15})
+
+            pairs = cli_profile.get_profile_pairs(base, changed)
+            self.assertEqual([name for name, file1, file2 in pairs],
+                             ['test'])
+            times1 = cli_profile.load_profile(pairs[0][1])
+            times2 = cli_profile.load_profile(pairs[0][2])
+
+        diff = cli_profile.diff_profiles(times1, times2)
+        self.assertEqual([name for name, time1, time2 in diff],
+                         ['json/encoder.py:encode',
+                          'venv/bm_test.py:<module>', 'venv/bm_test.py:func'])
+        text = cli_profile.format_profile_diff(times1, times2, limit=1)
+        self.assertEqual(text.splitlines()[0],
+                         'Total: 20.0 ms -> 25.0 ms (+25.0%)')
+        self.assertIn('| json/encoder.py:encode | 10.0 ms | 15.0 ms '
+                      '| +5.0 ms (+25.0%) |', text)
+
+
+class ProfileBenchmarkTests(unittest.TestCase):
+    def profile_benchmark(self, timeout=None):
+        commands = []
+
+        def run_command(cmd, hide_stderr=True, timeout=None):
+            commands.append((cmd, timeout))
+            if '--calibrate-loops' in cmd and '--worker-task=0' in cmd:
+                # a script with a single worker task
+                metadata = {'name': 'bench', 'calibrate_loops': 8}
+                worker_run = pyperf.Run([], warmups=[(8, 1.0)],
+                                        metadata=metadata,
+                                        collect_metadata=False)
+                pyperf.Benchmark([worker_run]).dump(
+                    cmd[cmd.index('--output') + 1])
+
+        bench = types.SimpleNamespace(script='bm_test.py', args=[],
+                                      timeout=60)
+        options = types.SimpleNamespace(timeout=timeout, verbose=False,
+                                        sampler=False, values=10,
+                                        output_dir='profiles')
+        with mock.patch.object(run, 'run_command', run_command):
+            filenames = cli_profile.profile_benchmark('python', bench,
+                                                      options)
+        self.assertEqual(filenames,
+                         [os.path.join('profiles', 'bench.pstats')])
+        # calibration of task 0, profiling of task 0, calibration of task 1
+        self.assertEqual(len(commands), 3)
+        self.assertIn('--loops=8', commands[1][0])
+        return [timeout for cmd, timeout in commands]
+
+    def test_timeout(self):
+        # the timeout of the benchmark is shared by all worker processes
+        timeouts = self.profile_benchmark()
+        self.assertTrue(all(0 < timeout <= 60 for timeout in timeouts),
+                        timeouts)
+        self.assertEqual(sorted(timeouts, reverse=True), timeouts)
+
+        timeouts = self.profile_benchmark(timeout=5)
+        self.assertTrue(all(0 < timeout <= 5 for timeout in timeouts),
+                        timeouts)
+
+        # --timeout=0 disables the timeout
+        self.assertEqual(self.profile_benchmark(timeout=0), [None] * 3)
+
+    def test_deadline_exceeded(self):
+        with mock.patch.object(run, 'get_remaining_time',
+                               side_effect=run.BenchmarkTimeout(60)):
+            with self.assertRaises(run.BenchmarkTimeout):
+                self.profile_benchmark()
+
+
+if __name__ == "__main__":
+    unittest.main()
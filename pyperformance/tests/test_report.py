@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pyperf
+
+from pyperformance import report, run
+from pyperformance.compare import BenchmarkResult
+
+
+DATA_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), 'data'))
+
+
+class ChartTests(unittest.TestCase):
+    def test_histogram(self):
+        self.assertEqual(report.histogram([0.0, 0.5, 1.0, 2.0, 4.0],
+                                          0.0, 4.0, bins=4),
+                         [2, 1, 1, 1])
+        self.assertEqual(report.histogram([], 0.0, 1.0, bins=2), [0, 0])
+
+    def test_downsample(self):
+        points = [(index, float(index % 10)) for index in range(100)]
+        self.assertEqual(report.downsample(points, 200), points)
+
+        result = report.downsample(points, 20)
+        self.assertLessEqual(len(result), 20)
+        # spikes are kept and points stay ordered
+        self.assertIn((9, 9.0), result)
+        self.assertIn((90, 0.0), result)
+        self.assertEqual(result, sorted(result))
+
+
+class ReportTests(unittest.TestCase):
+    def test_report(self):
+        py36 = os.path.join(DATA_DIR, 'py36.json')
+        py38 = os.path.join(DATA_DIR, 'py38.json')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'report.html')
+            cmd = [sys.executable, '-m', 'pyperformance', 'report',
+                   '--html', filename, py36, py38, py38, py36]
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+            self.assertEqual(proc.returncode, 0, proc.stdout)
+            with open(filename, encoding='utf-8') as fp:
+                text = fp.read()
+
+        self.assertIn('<h3 id="bench-telco">telco</h3>', text)
+        self.assertIn('<td class="change" data-sort="0.672772">'
+                      '1.49x faster</td>', text)
+        self.assertIn('<td>Geometric mean</td>', text)
+        self.assertIn('<title>Distribution of telco values</title>', text)
+        self.assertIn('<title>History of telco</title>', text)
+        # the page doesn't load external resources
+        self.assertNotIn(' src=', text)
+        self.assertNotIn(' href="http', text)
+
+    def test_summary_groups(self):
+        # xml_etree produces several pyperf benchmarks, not in the manifest
+        results = []
+        for name in ('xml_etree_parse', 'xml_etree_generate'):
+            benchmarks = []
+            for value in (1.0, 0.5):
+                worker_run = pyperf.Run([value, value * 1.001],
+                                        metadata={'name': name,
+                                                  'unit': 'second'},
+                                        collect_metadata=False)
+                bench = pyperf.Benchmark([worker_run])
+                benchmarks.extend(run.tag_benchmarks(bench, 'xml_etree'))
+            results.append(BenchmarkResult(*benchmarks))
+
+        groups = {'serialize': {'xml_etree'}, 'math': {'nbody'}}
+        text = report._summary_table(results, groups)
+        self.assertIn('<td>Geometric mean (serialize)</td>'
+                      '<td data-sort="2">2</td>', text)
+        self.assertNotIn('(math)', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import os
+import os.path
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import run
+
+
+def create_suite(means, name='bench'):
+    """Create a suite of one benchmark: one worker process per mean."""
+    runs = [pyperf.Run([mean * 0.999, mean * 1.001], warmups=[(4, mean)],
+                       metadata={'name': name, 'loops': 4, 'unit': 'second'},
+                       collect_metadata=False)
+            for mean in means]
+    return pyperf.BenchmarkSuite([pyperf.Benchmark(runs)])
+
+
+def create_options(**kw):
+    options = dict(adaptive_ci=1.0, processes=None, rigorous=False,
+                   fast=False, timeout=None, debug_single_value=False)
+    options.update(kw)
+    return types.SimpleNamespace(**options)
+
+
+class AdaptiveTests(unittest.TestCase):
+    def test_confidence_interval(self):
+        bench = create_suite([1.0]).get_benchmark('bench')
+        self.assertIsNone(run.confidence_interval(bench))
+
+        bench = create_suite([1.0, 1.0, 1.0]).get_benchmark('bench')
+        self.assertEqual(run.confidence_interval(bench), 0.0)
+
+        # t(df=1) * stdev / sqrt(2) / mean with stdev = 0.1 / sqrt(2)
+        bench = create_suite([0.95, 1.05]).get_benchmark('bench')
+        self.assertAlmostEqual(run.confidence_interval(bench), 12.706 * 0.05)
+
+    def test_get_stop_reason(self):
+        stable = create_suite([1.0, 1.001, 0.999])
+        noisy = create_suite([0.9, 1.1, 1.0])
+        self.assertEqual(run.get_stop_reason(stable, 0.01, 3, 20),
+                         'confidence')
+        self.assertIsNone(run.get_stop_reason(noisy, 0.01, 3, 20))
+        self.assertEqual(run.get_stop_reason(noisy, 0.01, 20, 20),
+                         'max_processes')
+        # the confidence is checked first
+        self.assertEqual(run.get_stop_reason(stable, 0.01, 20, 20),
+                         'confidence')
+
+    def test_get_stop_reason_multiple(self):
+        # all benchmarks of the script must be stable
+        suite = create_suite([1.0, 1.001, 0.999], name='stable')
+        suite.add_benchmark(
+            create_suite([0.9, 1.1, 1.0], name='noisy').get_benchmark('noisy'))
+        self.assertIsNone(run.get_stop_reason(suite, 0.01, 3, 20))
+
+    def run_adaptive(self, batches, **kw):
+        batches = iter(batches)
+        calls = []
+
+        def run_perf_batch(cmd, options, processes, deadline, extra_args=()):
+            calls.append((processes, list(extra_args)))
+            return next(batches)
+
+        with mock.patch.object(run, '_run_perf_batch', run_perf_batch):
+            with contextlib.redirect_stdout(io.StringIO()):
+                suite = run.run_adaptive(['python', 'bm_test.py'],
+                                         create_options(**kw))
+        return suite, calls
+
+    def test_run_adaptive(self):
+        # stop when the 4th worker process makes the interval narrow enough:
+        # +-5.0% after 3 processes, +-2.6% after 4 processes
+        suite, calls = self.run_adaptive([create_suite([0.98, 1.02, 1.0]),
+                                          create_suite([1.0])],
+                                         adaptive_ci=3.0)
+        self.assertEqual(calls, [(3, []),
+                                 (1, ['--loops=4', '--warmups=1'])])
+        bench = suite.get_benchmark('bench')
+        self.assertEqual(len(bench.get_runs()), 4)
+        self.assertEqual(bench.get_metadata()['performance_stop_reason'],
+                         'confidence')
+
+    def test_run_adaptive_max_processes(self):
+        suite, calls = self.run_adaptive([create_suite([0.8, 1.2, 1.0]),
+                                          create_suite([0.7])],
+                                         processes=4)
+        self.assertEqual(len(calls), 2)
+        bench = suite.get_benchmark('bench')
+        self.assertEqual(bench.get_metadata()['performance_stop_reason'],
+                         'max_processes')
+
+
+def is_running(pid):
+    try:
+        with open('/proc/%s/stat' % pid) as fp:
+            state = fp.read().rpartition(')')[2].split()[0]
+    except FileNotFoundError:
+        return False
+    # a killed process may stay a zombie until its new parent reaps it
+    return state != 'Z'
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'need /proc')
+class RunCommandTests(unittest.TestCase):
+    def test_timeout(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'pid')
+            # the child process spawns a sleeping process, as the pyperf
+            # master spawns worker processes
+            code = textwrap.dedent('''
+                import subprocess, sys, time
+                proc = subprocess.Popen([sys.executable, '-c',
+                                         'import time; time.sleep(60)'])
+                with open(%r, 'w') as fp:
+                    fp.write(str(proc.pid))
+                time.sleep(60)
+            ''' % filename)
+            start = time.monotonic()
+            with self.assertRaises(run.BenchmarkTimeout) as cm:
+                run.run_command([sys.executable, '-c', code], timeout=2.0)
+            self.assertLess(time.monotonic() - start, 30)
+            with open(filename) as fp:
+                pid = int(fp.read())
+
+        self.assertEqual(cm.exception.timeout, 2.0)
+        self.assertIsNone(cm.exception.partial)
+        # the whole process group is killed
+        for attempt in range(50):
+            if not is_running(pid):
+                break
+            time.sleep(0.1)
+        self.assertFalse(is_running(pid))
+
+    def test_failure(self):
+        with self.assertRaises(RuntimeError):
+            run.run_command([sys.executable, '-c', 'raise SystemExit(1)'])
+
+
+class CPUSetsTests(unittest.TestCase):
+    def get_cpu_sets(self, **kw):
+        options = dict(jobs=None, cpu_sets=None, affinity=None)
+        options.update(kw)
+        return run.get_cpu_sets(types.SimpleNamespace(**options))
+
+    def test_get_cpu_sets(self):
+        self.assertEqual(self.get_cpu_sets(), [None])
+        self.assertEqual(self.get_cpu_sets(affinity='2-3'), ['2-3'])
+        self.assertEqual(self.get_cpu_sets(cpu_sets='2-3,4-5,6'),
+                         ['2-3', '4-5', '6'])
+        self.assertEqual(self.get_cpu_sets(cpu_sets='2-3,4-5,6', jobs=2),
+                         ['2-3', '4-5'])
+        # split --affinity CPUs between jobs
+        self.assertEqual(self.get_cpu_sets(affinity='0-6', jobs=3),
+                         ['0-1', '2-3', '4-5'])
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.get_cpu_sets(jobs=2), [None, None])
+
+        with self.assertRaises(ValueError):
+            self.get_cpu_sets(cpu_sets='2-3,4-5', jobs=3)
+        with self.assertRaises(ValueError):
+            self.get_cpu_sets(affinity='0-1', jobs=3)
+
+
+class FakeBenchFunc(object):
+    """Benchmark function sleeping for its runtime (in milliseconds)."""
+
+    def __init__(self, name, runtime, log, fail=False):
+        self.name = name
+        self.runtime = runtime
+        self.log = log
+        self.fail = fail
+
+    def __call__(self, cmd_prefix, options):
+        self.log.start(self.name, options.affinity)
+        try:
+            time.sleep(self.runtime / 1000.0)
+            if self.fail:
+                raise RuntimeError("Benchmark died")
+        finally:
+            self.log.stop(self.name, options.affinity)
+        worker_run = pyperf.Run([1.0, 1.01],
+                                metadata={'name': self.name,
+                                          'unit': 'second'},
+                                collect_metadata=False)
+        return pyperf.Benchmark([worker_run])
+
+
+class JobLog(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.completed = []
+        self.running = {}
+        self.overlaps = []
+
+    def start(self, name, cpu_set):
+        with self.lock:
+            self.started.append(name)
+            if cpu_set in self.running.values():
+                self.overlaps.append(name)
+            self.running[name] = cpu_set
+
+    def stop(self, name, cpu_set):
+        with self.lock:
+            del self.running[name]
+            self.completed.append(name)
+
+
+class ParallelTests(unittest.TestCase):
+    def run_benchmarks(self, runtimes, cpu_sets, fail=()):
+        log = JobLog()
+        bench_funcs = {name: FakeBenchFunc(name, runtime, log,
+                                           fail=(name in fail))
+                       for name, runtime in runtimes.items()}
+        options = types.SimpleNamespace(affinity=None)
+        checkpoints = []
+
+        def checkpoint(name, benchmarks, elapsed):
+            checkpoints.append(name)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            with contextlib.redirect_stderr(io.StringIO()):
+                suite, errors = run.run_benchmarks(
+                    bench_funcs, set(runtimes), ['python'], options,
+                    cpu_sets=cpu_sets, checkpoint=checkpoint)
+        return suite, errors, log, checkpoints
+
+    def test_run_parallel(self):
+        runtimes = {'a': 10, 'b': 300, 'c': 50, 'd': 200, 'e': 100}
+        suite, errors, log, checkpoints = self.run_benchmarks(
+            runtimes, ['0', '1'])
+
+        self.assertEqual(errors, [])
+        # longest runtime first
+        self.assertEqual(log.started[:2], ['b', 'd'])
+        # a CPU set runs a single benchmark at once
+        self.assertEqual(log.overlaps, [])
+        # benchmarks complete in any order, checkpoints as soon as they
+        # complete, but results are merged in a deterministic order
+        self.assertEqual(checkpoints, log.completed)
+        self.assertEqual(suite.get_benchmark_names(),
+                         ['a', 'b', 'c', 'd', 'e'])
+        cpu_sets = {bench.get_name():
+                    bench.get_metadata()['performance_cpu_set']
+                    for bench in suite.get_benchmarks()}
+        self.assertEqual(set(cpu_sets.values()), {'0', '1'})
+        # b runs on its CPU set until d, c and e complete on the other one
+        self.assertNotEqual(cpu_sets['b'], cpu_sets['d'])
+        self.assertEqual(cpu_sets['d'], cpu_sets['e'])
+
+    def test_run_parallel_failure(self):
+        runtimes = {'a': 10, 'b': 30, 'c': 20}
+        suite, errors, log, checkpoints = self.run_benchmarks(
+            runtimes, ['0', '1'], fail={'b'})
+        self.assertEqual(errors, [('b', 'failed')])
+        self.assertEqual(suite.get_benchmark_names(), ['a', 'c'])
+        self.assertEqual(sorted(checkpoints), ['a', 'c'])
+
+    def test_run_serial(self):
+        runtimes = {'b': 20, 'a': 10, 'c': 0}
+        suite, errors, log, checkpoints = self.run_benchmarks(runtimes,
+                                                              [None])
+        # alphabetical order, not sorted by runtime
+        self.assertEqual(log.started, ['a', 'b', 'c'])
+        self.assertEqual(suite.get_benchmark_names(), ['a', 'b', 'c'])
+        self.assertNotIn('performance_cpu_set',
+                         suite.get_benchmark('a').get_metadata())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import unittest
+
+from pyperformance import compare, stats
+
+
+class StatsTests(unittest.TestCase):
+    def test_t_pvalue(self):
+        # 95% critical values of Student's t distribution
+        self.assertAlmostEqual(stats.t_pvalue(12.706, 1), 0.05, places=4)
+        self.assertAlmostEqual(stats.t_pvalue(2.228, 10), 0.05, places=4)
+        self.assertAlmostEqual(stats.t_pvalue(1.960, 1e6), 0.05, places=4)
+        self.assertEqual(stats.t_pvalue(0.0, 10), 1.0)
+
+    def test_tscore_sizes(self):
+        sample1 = [1.0, 1.1, 0.9, 1.0]
+        sample2 = [2.0, 2.1, 1.9, 2.0, 2.2, 1.8]
+        t_score = compare.tscore(sample1, sample2)
+        self.assertLess(t_score, -10)
+        self.assertTrue(compare.is_significant(sample1, sample2)[0])
+
+    def test_welch(self):
+        sample1 = [1.0, 1.1, 0.9, 1.0]
+        sample2 = [2.0, 2.1, 1.9, 2.0, 2.2, 1.8]
+        t_score, pvalue = stats.welch_test(sample1, sample2)
+        self.assertAlmostEqual(t_score, compare.tscore(sample1, sample2),
+                               delta=2.0)
+        self.assertLess(pvalue, 1e-5)
+        self.assertEqual(stats.welch_test([1.0, 1.0], [1.0, 1.0]),
+                         (0.0, 1.0))
+
+    def test_mann_whitney(self):
+        u, pvalue = stats.mann_whitney_u([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        self.assertEqual(u, 0)
+        self.assertAlmostEqual(pvalue, 0.0122, places=4)
+
+        # ties get the average of their ranks
+        u, pvalue = stats.mann_whitney_u([1, 2, 2], [2, 3])
+        self.assertEqual(u, 1.0)
+        self.assertEqual(stats.mann_whitney_u([1, 1], [1, 1]), (2.0, 1.0))
+
+    def test_bootstrap(self):
+        sample1 = [1.0, 1.1, 0.9, 1.0, 1.05, 0.95] * 5
+        sample2 = [value * 1.5 for value in sample1]
+        ratio, low, high = stats.bootstrap_ratio(sample1, sample2)
+        self.assertAlmostEqual(ratio, 1.5)
+        self.assertLessEqual(low, high)
+        self.assertGreater(low, 1.0)
+        # resamples are reproducible
+        self.assertEqual(stats.bootstrap_ratio(sample1, sample2),
+                         (ratio, low, high))
+
+        low, high = stats.bootstrap_ci(sample1, 'median')
+        self.assertLessEqual(low, 1.0)
+        self.assertGreaterEqual(high, 1.0)
+
+    def test_bootstrap_reproducible(self):
+        # a single implementation with a fixed seed: the result doesn't
+        # depend on the installed packages nor on the platform
+        self.assertEqual(stats.bootstrap_ci([1.0, 2.0, 3.0, 4.0],
+                                            resamples=20),
+                         (1.86875, 4.0))
+
+    def test_median_ci(self):
+        values = list(range(100))
+        low, high = stats.median_ci(values)
+        self.assertLess(low, 50)
+        self.assertGreater(high, 49)
+        self.assertEqual(stats.median_ci([5.0]), (5.0, 5.0))
+
+    def test_stats_test(self):
+        sample1 = [1.0, 1.1, 0.9, 1.0, 1.05, 0.95] * 5
+        sample2 = [value * 1.5 for value in sample1]
+        for method in ('t-test', 'welch', 'mann-whitney', 'bootstrap',
+                       'bootstrap-median'):
+            with self.subTest(method=method):
+                significant, text = compare.stats_test(sample1, sample2,
+                                                       method)
+                self.assertTrue(significant)
+                significant, text = compare.stats_test(sample1, sample1,
+                                                       method)
+                self.assertFalse(significant)
+
+
+if __name__ == "__main__":
+    unittest.main()
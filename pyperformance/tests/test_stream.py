@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import gzip
+import io
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import stream
+
+
+DATA_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), 'data'))
+
+
+class JSONStreamTests(unittest.TestCase):
+    def parse(self, text, key='items'):
+        # Use a tiny buffer to test values split between reads
+        with mock.patch.object(stream, 'CHUNK_SIZE', 3):
+            return list(stream.JSONStream(io.StringIO(text), key))
+
+    def test_items(self):
+        text = ' { "items" : [ {"a": [1, 2]}, 12345, "x,]" ] ,\n"n": 1.25 } '
+        self.assertEqual(self.parse(text),
+                         [('items', {'a': [1, 2]}), ('items', 12345),
+                          ('items', 'x,]'), ('n', 1.25)])
+        self.assertEqual(self.parse('{"items": [], "n": 12345}'),
+                         [('n', 12345)])
+        self.assertEqual(self.parse('{}'), [])
+        # other keys are not split
+        self.assertEqual(self.parse('{"items": [1, 2]}', key=None),
+                         [('items', [1, 2])])
+
+    def test_invalid(self):
+        for text in ('', '[1, 2]', '{"items": [1, 2}', '{"items": [1, 2]'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.parse(text)
+
+
+class LoadSuiteTests(unittest.TestCase):
+    def check_suite(self, suite, filename):
+        ref = pyperf.BenchmarkSuite.load(filename)
+        self.assertEqual(suite.get_benchmark_names(),
+                         ref.get_benchmark_names())
+        self.assertEqual(suite.get_metadata(), ref.get_metadata())
+        self.assertEqual(suite.get_dates(), ref.get_dates())
+        for bench in ref:
+            loaded = suite.get_benchmark(bench.get_name())
+            self.assertEqual(loaded.get_values(), bench.get_values())
+            self.assertEqual(loaded.get_unit(), bench.get_unit())
+
+    def test_load(self):
+        for name in ('py36.json', 'mem1.json', 'py3_performance03.json'):
+            with self.subTest(name=name):
+                filename = os.path.join(DATA_DIR, name)
+                self.check_suite(stream.load_suite(filename), filename)
+
+    def test_gzip(self):
+        filename = os.path.join(DATA_DIR, 'py36.json')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gz_filename = os.path.join(tmpdir, 'py36.json.gz')
+            with open(filename, 'rb') as src:
+                with gzip.open(gz_filename, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            self.check_suite(stream.load_suite(gz_filename), filename)
+
+    def test_names(self):
+        filename = os.path.join(DATA_DIR, 'py36.json')
+        ref = pyperf.BenchmarkSuite.load(filename)
+
+        suite = stream.load_suite(filename, {'telco', 'other'})
+        self.assertEqual(len(suite), 1)
+
+        # skipped benchmarks are listed, but not loaded
+        suite = stream.load_suite(filename, {'other'})
+        self.assertEqual(suite.get_benchmark_names(), ['telco'])
+        self.assertEqual(len(suite), 0)
+        self.assertRaises(KeyError, suite.get_benchmark, 'telco')
+        self.assertEqual(suite.get_dates(), ref.get_dates())
+        self.assertEqual(suite.get_metadata()['performance_version'],
+                         '1.0.1')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import threading
+import unittest
+
+from pyperformance import upload
+
+
+def create_result(benchmark, commitid='abc', value=1.0):
+    return {'commitid': commitid, 'branch': 'master', 'project': 'CPython',
+            'executable': 'python', 'benchmark': benchmark,
+            'environment': 'host', 'result_value': value}
+
+
+class UploadTests(unittest.TestCase):
+    def start_server(self, **kw):
+        server = upload.CodespeedServer(**kw)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def create_queue(self, server, **kw):
+        kw.setdefault('backoff', 0.0)
+        return upload.UploadQueue(server.url, **kw)
+
+    def test_batch(self):
+        server = self.start_server()
+        queue = self.create_queue(server, batch_size=3)
+        queue.add('a.json', [create_result('float'), create_result('nbody')])
+        queue.add('b.json', [create_result('float', 'def')])
+        queue.add('c.json', [create_result('go', 'def')])
+
+        self.assertEqual(queue.flush(), ['a.json', 'b.json', 'c.json'])
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(len(server.results), 4)
+
+    def test_dedup(self):
+        server = self.start_server()
+        queue = self.create_queue(server)
+        queue.add('a.json', [create_result('float', value=1.0)])
+        queue.add('b.json', [create_result('float', value=2.0),
+                             create_result('nbody')])
+
+        self.assertEqual(queue.flush(), ['a.json', 'b.json'])
+        self.assertEqual([(result['benchmark'], result['result_value'])
+                          for result in server.results],
+                         [('float', 1.0), ('nbody', 1.0)])
+
+    def test_dedup_failure(self):
+        # b.json must not be marked as uploaded if the batch of a.json,
+        # which has the kept copy of its float result, failed
+        server = self.start_server(fail_requests=1)
+        queue = self.create_queue(server, batch_size=1, retries=0)
+        queue.add('a.json', [create_result('float')])
+        queue.add('b.json', [create_result('float'),
+                             create_result('nbody')])
+
+        self.assertEqual(queue.flush(), [])
+        self.assertEqual(server.requests, 2)
+        self.assertEqual([result['benchmark'] for result in server.results],
+                         ['nbody'])
+
+        # a.json can be uploaded again
+        queue.add('a.json', [create_result('float')])
+        self.assertEqual(queue.flush(), ['a.json'])
+        self.assertEqual([result['benchmark'] for result in server.results],
+                         ['nbody', 'float'])
+
+    def test_dedup_sent(self):
+        # results already uploaded by a previous flush are skipped
+        server = self.start_server()
+        queue = self.create_queue(server)
+        queue.add('a.json', [create_result('float')])
+        self.assertEqual(queue.flush(), ['a.json'])
+        queue.add('b.json', [create_result('float')])
+        self.assertEqual(queue.flush(), ['b.json'])
+        self.assertEqual(server.requests, 1)
+
+    def test_retry(self):
+        server = self.start_server(fail_requests=2)
+        queue = self.create_queue(server, retries=2)
+        queue.add('a.json', [create_result('float')])
+
+        self.assertEqual(queue.flush(), ['a.json'])
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(len(server.results), 1)
+
+    def test_retry_failure(self):
+        server = self.start_server(fail_requests=10)
+        queue = self.create_queue(server, retries=2)
+        queue.add('a.json', [create_result('float')])
+
+        self.assertEqual(queue.flush(), [])
+        self.assertEqual(server.requests, 3)
+
+    def test_client_error(self):
+        # invalid results are not retried
+        server = self.start_server()
+        queue = self.create_queue(server, retries=2)
+        result = create_result('float')
+        del result['project']
+        queue.add('a.json', [result])
+
+        self.assertEqual(queue.flush(), [])
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(server.results, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
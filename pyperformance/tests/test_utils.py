@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import os.path
+import tempfile
+import unittest
+
+from pyperformance import utils
+
+
+class CopyScriptsTests(unittest.TestCase):
+    def test_copy_scripts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, 'src')
+            dst = os.path.join(tmpdir, 'dst')
+            os.mkdir(src)
+            os.mkdir(dst)
+            files = {
+                'pyperf': b'#!/old/venv/bin/python\nimport pyperf\n',
+                'activate': b'VIRTUAL_ENV="/old/venv"\n',
+                'python': b'#!/old/venv/bin/python\n',
+                'other': b'#!/usr/bin/python3\n',
+            }
+            for name, content in files.items():
+                with open(os.path.join(src, name), 'wb') as fp:
+                    fp.write(content)
+            os.chmod(os.path.join(src, 'pyperf'), 0o755)
+            with open(os.path.join(dst, 'python'), 'wb') as fp:
+                fp.write(b'binary')
+
+            copied = utils.copy_scripts(src, dst, b'/old/venv', b'/new/venv')
+
+            # only scripts referring to the old path, dst files are kept
+            self.assertEqual(copied, ['pyperf'])
+            self.assertEqual(sorted(os.listdir(dst)), ['pyperf', 'python'])
+            with open(os.path.join(dst, 'pyperf'), 'rb') as fp:
+                self.assertEqual(fp.read(),
+                                 b'#!/new/venv/bin/python\nimport pyperf\n')
+            self.assertTrue(os.access(os.path.join(dst, 'pyperf'), os.X_OK))
+            with open(os.path.join(dst, 'python'), 'rb') as fp:
+                self.assertEqual(fp.read(), b'binary')
+
+
+class CPUListTests(unittest.TestCase):
+    def test_parse_cpu_list(self):
+        self.assertEqual(utils.parse_cpu_list('0'), [0])
+        self.assertEqual(utils.parse_cpu_list('0-3,6'), [0, 1, 2, 3, 6])
+        self.assertEqual(utils.parse_cpu_list('6, 2-3,2'), [2, 3, 6])
+        with self.assertRaises(ValueError):
+            utils.parse_cpu_list('3-1')
+
+    def test_format_cpu_list(self):
+        self.assertEqual(utils.format_cpu_list([0]), '0')
+        self.assertEqual(utils.format_cpu_list([3, 0, 1, 2, 6]), '0-3,6')
+        self.assertEqual(utils.format_cpu_list([1, 3, 5]), '1,3,5')
+
+    def test_parse_cpu_sets(self):
+        self.assertEqual(utils.parse_cpu_sets('2-3,4-5,7'),
+                         ['2-3', '4-5', '7'])
+        with self.assertRaises(ValueError):
+            utils.parse_cpu_sets('2-4,4-5')
+
+
+class DurationTests(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(utils.parse_duration('90'), 90)
+        self.assertEqual(utils.parse_duration('45s'), 45)
+        self.assertEqual(utils.parse_duration('20m'), 20 * 60)
+        self.assertEqual(utils.parse_duration('1h30m'), 90 * 60)
+        self.assertEqual(utils.parse_duration('1.5h'), 90 * 60)
+        self.assertEqual(utils.parse_duration('0'), 0)
+        for text in ('', 'm', '10x', '-5m', '-5', 'inf', '.s', '1..5m',
+                     '.'):
+            with self.assertRaises(ValueError) as cm:
+                utils.parse_duration(text)
+            self.assertEqual(str(cm.exception),
+                             'invalid duration: %r' % text)
+
+    def test_format_duration(self):
+        self.assertEqual(utils.format_duration(45), '45s')
+        self.assertEqual(utils.format_duration(200), '3m20s')
+        self.assertEqual(utils.format_duration(3720), '1h02m')
+
+
+class SizeTests(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(utils.parse_size('500'), 500)
+        self.assertEqual(utils.parse_size('2k'), 2048)
+        self.assertEqual(utils.parse_size('500M'), 500 * 1024 ** 2)
+        self.assertEqual(utils.parse_size('10G'), 10 * 1024 ** 3)
+        self.assertEqual(utils.parse_size('1.5GB'), 3 * 1024 ** 3 // 2)
+        for text in ('', 'G', '10X', '-5G'):
+            with self.assertRaises(ValueError):
+                utils.parse_size(text)
+
+
+class LinkTreeTests(unittest.TestCase):
+    def test_link_tree(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, 'src')
+            os.makedirs(os.path.join(src, 'pkg', 'sub'))
+            with open(os.path.join(src, 'pkg', 'sub', 'mod.py'), 'w') as fp:
+                fp.write('x = 1\n')
+            os.symlink('sub', os.path.join(src, 'pkg', 'link'))
+
+            dst = os.path.join(tmpdir, 'dst')
+            utils.link_tree(src, dst)
+
+            filename = os.path.join(dst, 'pkg', 'sub', 'mod.py')
+            with open(filename) as fp:
+                self.assertEqual(fp.read(), 'x = 1\n')
+            self.assertTrue(os.path.samefile(
+                filename, os.path.join(src, 'pkg', 'sub', 'mod.py')))
+            link = os.path.join(dst, 'pkg', 'link')
+            self.assertEqual(os.readlink(link), 'sub')
+
+
+if __name__ == "__main__":
+    unittest.main()
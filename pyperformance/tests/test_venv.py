@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import os.path
+import tempfile
+import textwrap
+import types
+import unittest
+
+from pyperformance import venv
+
+
+class RequirementsTests(unittest.TestCase):
+    def create_requirements(self, content):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        filename = os.path.join(tmpdir.name, 'requirements.txt')
+        with open(filename, 'w') as fp:
+            fp.write(textwrap.dedent(content))
+        return venv.Requirements(filename, ['psutil'])
+
+    def test_via(self):
+        requirements = self.create_requirements("""
+            #
+            # This file is autogenerated by pip-compile
+            #
+            asgiref==3.2.10           # via django
+            django==3.0.7             # via -r requirements.in
+            psutil==5.7.0             # via -r requirements.in
+            pyperf==2.0.0             # via -r requirements.in
+            pytz==2020.1              # via django, babel
+            Babel==2.9.0
+                # via
+                #   -r requirements.in
+                #   sphinx
+            Sphinx==3.0
+                # via -r requirements.in
+        """)
+        self.assertEqual(requirements.via['asgiref'], {'django'})
+        self.assertEqual(requirements.via['django'], set())
+        self.assertEqual(requirements.via['pytz'], {'django', 'babel'})
+        self.assertEqual(requirements.via['babel'], {'sphinx'})
+        self.assertEqual(requirements.optional, ['psutil==5.7.0'])
+
+        self.assertEqual(requirements.get_dependencies(['Django']),
+                         {'django', 'asgiref', 'pytz'})
+        self.assertEqual(requirements.get_dependencies(['sphinx']),
+                         {'sphinx', 'babel', 'pytz'})
+
+        names = requirements.select(['pyperf', 'psutil', 'django'])
+        self.assertEqual(names,
+                         {'pyperf', 'psutil', 'django', 'asgiref', 'pytz'})
+        self.assertEqual(requirements.req,
+                         ['asgiref==3.2.10', 'django==3.0.7',
+                          'pyperf==2.0.0', 'pytz==2020.1'])
+        self.assertEqual(requirements.optional, ['psutil==5.7.0'])
+
+    def test_pyperformance_requirements(self):
+        # requirements of the benchmarks must be pinned in requirements.txt
+        from pyperformance.benchmarks import get_benchmarks
+
+        requirements = venv.get_requirements()
+        names = requirements.get_names()
+        bench_funcs, bench_groups = get_benchmarks()
+        for bench in bench_funcs.values():
+            for name in bench.requirements:
+                self.assertIn(venv.normalize_project_name(name), names)
+
+
+class FakeVirtualEnvironment(venv.VirtualEnvironment):
+    def __init__(self, wheelhouse=None):
+        options = types.SimpleNamespace(python='python', venv='venv',
+                                        wheelhouse=wheelhouse)
+        super().__init__(options)
+        self._pip_program = ['pip']
+        self.commands = []
+
+    def run_cmd_nocheck(self, cmd, verbose=True):
+        self.commands.append(cmd)
+        return 0
+
+
+class InstallTests(unittest.TestCase):
+    def create_requirements(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        filename = os.path.join(tmpdir.name, 'requirements.txt')
+        with open(filename, 'w') as fp:
+            fp.write('pyperf==2.0.0\npsutil==5.7.0\ndulwich==0.20.0\n')
+        return venv.Requirements(filename, ['psutil', 'dulwich'])
+
+    def test_wheelhouse(self):
+        with tempfile.TemporaryDirectory() as wheelhouse:
+            for name in ('pyperf-2.0.0-py3-none-any.whl',
+                         'psutil-5.7.0-cp38-cp38-linux_x86_64.whl'):
+                open(os.path.join(wheelhouse, name), 'w').close()
+            env = FakeVirtualEnvironment(wheelhouse)
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                env._install_packages(self.create_requirements(),
+                                      ['pip==20.0'])
+
+        # a single pip command which doesn't look at the index, optional
+        # requirements without wheel are skipped
+        self.assertEqual(env.commands,
+                         [['pip', 'install', '-U',
+                           '--no-index', '--find-links', wheelhouse,
+                           'pip==20.0', 'pyperf==2.0.0', 'psutil==5.7.0']])
+        self.assertIn('no dulwich==0.20.0 wheel', stdout.getvalue())
+
+    def test_index(self):
+        env = FakeVirtualEnvironment()
+        env._install_packages(self.create_requirements())
+        self.assertEqual(env.commands,
+                         [['pip', 'install', 'pyperf==2.0.0'],
+                          ['pip', 'install', '-U', 'psutil==5.7.0'],
+                          ['pip', 'install', '-U', 'dulwich==0.20.0']])
+        for cmd in env.commands:
+            self.assertNotIn('--no-index', cmd)
+
+    def test_install_pyperformance(self):
+        for wheelhouse in (None, os.path.abspath('wheelhouse')):
+            with self.subTest(wheelhouse=wheelhouse):
+                env = FakeVirtualEnvironment(wheelhouse)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    env._install_pyperformance()
+                cmd = env.commands[0]
+                self.assertEqual(cmd[:2], ['pip', 'install'])
+                self.assertEqual('--no-index' in cmd, bool(wheelhouse))
+                if wheelhouse:
+                    index = cmd.index('--find-links')
+                    self.assertEqual(cmd[index + 1], wheelhouse)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import os
+import os.path
+import sys
+import tempfile
+import textwrap
+import types
+import unittest
+from unittest import mock
+
+import pyperf
+
+from pyperformance import hw_counters, run, warm_worker
+
+
+SCRIPT = textwrap.dedent('''
+    import pyperf
+
+    def func():
+        pass
+
+    runner = pyperf.Runner()
+    runner.bench_func('bench', func)
+''')
+
+
+# Script with two worker tasks and its own default number of values
+TWO_TASKS_SCRIPT = textwrap.dedent('''
+    import pyperf
+
+    def func():
+        pass
+
+    if __name__ == "__main__":
+        runner = pyperf.Runner(values=4)
+        runner.bench_func('first', func)
+        runner.bench_func('second', func)
+''')
+
+# Calibrate short values to run tests quickly
+MIN_TIME = ['--min-time=0.001']
+PERFORMANCE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def create_options(**kw):
+    options = dict(processes=2, values=None, fast=False, rigorous=False,
+                   affinity=None, track_memory=False, timeout=None,
+                   hw_counters=False, verbose=False,
+                   inherit_environ=['PYTHONPATH'])
+    options.update(kw)
+    return types.SimpleNamespace(**options)
+
+
+class FakeCounters(object):
+    """Count calls to enable() instead of hardware events."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.calls = 0
+
+    def enable(self):
+        assert not self.enabled
+        self.enabled = True
+        self.calls += 1
+
+    def disable(self):
+        self.enabled = False
+
+    def read(self):
+        return {'instructions': self.calls}
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'need os.fork()')
+class WarmWorkerTests(unittest.TestCase):
+    def fork_worker(self, *args):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bm_path = os.path.join(tmpdir, 'bm_test.py')
+            with open(bm_path, 'w', encoding='utf-8') as fp:
+                fp.write(SCRIPT)
+            with mock.patch.object(hw_counters, 'HWCounters', FakeCounters):
+                return warm_worker.fork_worker(bm_path, list(args),
+                                               hw_counters=True)
+
+    def test_timed_loops(self):
+        # counters are only enabled around the timed calls: 1 warmup and
+        # 2 values of 3 loops
+        exitcode, result, counters = self.fork_worker(
+            '--worker', '--loops=3', '--warmups=1', '--values=2')
+        self.assertEqual(exitcode, 0)
+        self.assertEqual(counters, {'counts': {'instructions': 3},
+                                    'iterations': 9, 'error': None})
+
+        bench = pyperf.Benchmark.loads(result)
+        run.add_hw_counters(bench, counters['counts'],
+                            counters['iterations'])
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['hw_instructions'], 3)
+        self.assertEqual(metadata['hw_iterations'], 9)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'need os.fork()')
+class WarmWorkerClientTests(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.bm_path = os.path.join(tmpdir.name, 'bm_test.py')
+        with open(self.bm_path, 'w', encoding='utf-8') as fp:
+            fp.write(TWO_TASKS_SCRIPT)
+        # the warm worker imports pyperformance
+        environ = mock.patch.dict(os.environ, {'PYTHONPATH': PERFORMANCE_DIR})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_protocol(self):
+        options = create_options()
+        with run.WarmWorker([sys.executable], self.bm_path, MIN_TIME,
+                            options) as worker:
+            bench = worker.run_worker(['--worker', '--worker-task=1',
+                                       '--calibrate-loops'])
+            self.assertEqual(bench.get_name(), 'second')
+            loops = bench.get_runs()[-1].get_metadata()['calibrate_loops']
+
+            bench = worker.run_worker(['--worker', '--worker-task=0',
+                                       '--loops=%s' % loops])
+            self.assertEqual(bench.get_name(), 'first')
+            self.assertEqual(bench.get_nvalue(), 4)
+
+            # no more worker task
+            self.assertIsNone(worker.run_worker(['--worker', '--worker-task=2',
+                                                 '--calibrate-loops']))
+
+            with self.assertRaises(RuntimeError):
+                worker.run_worker(['--worker', '--loops=0'])
+
+    def run_warm_workers(self, **kw):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run.run_warm_workers([sys.executable],
+                                        create_options(**kw),
+                                        self.bm_path, MIN_TIME)
+
+    def test_run_warm_workers(self):
+        suite = self.run_warm_workers()
+        # the task loop ends after the last worker task
+        self.assertEqual(suite.get_benchmark_names(), ['first', 'second'])
+        for bench in suite.get_benchmarks():
+            runs = [run for run in bench.get_runs() if run.values]
+            self.assertEqual(len(runs), 2)
+            # defaults of the Runner of the script
+            for worker_run in runs:
+                self.assertEqual(len(worker_run.values), 4)
+                self.assertEqual(len(worker_run.warmups), 1)
+            self.assertEqual(bench.get_metadata()['performance_warm_worker'],
+                             'yes')
+
+    def test_values(self):
+        suite = self.run_warm_workers(values=2)
+        bench = suite.get_benchmark('first')
+        self.assertEqual(bench.get_nvalue(), 2 * 2)
+
+        # --fast: pyperf computes values from the Runner defaults
+        suite = self.run_warm_workers(processes=None, fast=True)
+        bench = suite.get_benchmark('first')
+        self.assertEqual(bench.get_nrun(), 1 + 10)
+        self.assertEqual(bench.get_nvalue(), 10 * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+"""Upload benchmark results to a Codespeed website.
+
+UploadQueue sends the results of many JSON files in a few requests to the
+Codespeed result/add/json/ endpoint, and retries on server and network
+errors. CodespeedServer is a local stand-in for this endpoint, to test the
+upload without a Codespeed website.
+"""
+import http.server
+import json
+import logging
+import socketserver
+import threading
+import time
+import urllib.parse
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+
+# Maximum number of results per request: results of a JSON file are never
+# split between two requests
+BATCH_SIZE = 500
+# Number of retries after the first attempt
+RETRIES = 5
+# Delay in seconds before the first retry, doubled at each retry
+BACKOFF = 1.0
+# Keys required by Codespeed in each result
+RESULT_KEYS = ('commitid', 'branch', 'project', 'executable', 'benchmark',
+               'environment', 'result_value')
+
+
+def get_upload_url(url):
+    if not url.endswith('/'):
+        url += '/'
+    return url + 'result/add/json/'
+
+
+class UploadQueue(object):
+    """Queue of results to upload to a Codespeed website.
+
+    Results are deduplicated: only the first result of a benchmark of a
+    commit, executable and environment is uploaded. A file is only reported
+    as uploaded once the results it was deduplicated against were uploaded.
+    """
+
+    def __init__(self, url, batch_size=BATCH_SIZE, retries=RETRIES,
+                 backoff=BACKOFF):
+        self.url = get_upload_url(url)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.logger = logging.getLogger()
+        # list of (filename, results, duplicates) tuples where duplicates
+        # is the set of keys of the results skipped as duplicated
+        self.entries = []
+        # keys of queued results
+        self._keys = set()
+        # keys of uploaded results
+        self._sent = set()
+
+    @staticmethod
+    def get_key(result):
+        return (result['commitid'], result['executable'],
+                result['environment'], result['benchmark'])
+
+    def add(self, filename, results):
+        kept = []
+        duplicates = set()
+        for result in results:
+            key = self.get_key(result)
+            if key in self._keys or key in self._sent:
+                self.logger.error("Skip duplicated result of %s for "
+                                  "commit %s in %s"
+                                  % (result['benchmark'], result['commitid'],
+                                     filename))
+                duplicates.add(key)
+                continue
+            self._keys.add(key)
+            kept.append(result)
+        self.entries.append((filename, kept, duplicates))
+
+    def get_batches(self):
+        batch = []
+        size = 0
+        for entry in self.entries:
+            results = entry[1]
+            if batch and size + len(results) > self.batch_size:
+                yield batch
+                batch = []
+                size = 0
+            batch.append(entry)
+            size += len(results)
+        if batch:
+            yield batch
+
+    def _post(self, results):
+        data = urllib.parse.urlencode({'json': json.dumps(results)})
+        response = urlopen(data=data.encode('utf-8'), url=self.url)
+        with response:
+            return response.read().decode('utf-8', 'replace')
+
+    def post(self, results):
+        """Upload results: return True on success."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                self.logger.error("Retry in %.1f sec (attempt %s/%s)"
+                                  % (delay, attempt + 1, self.retries + 1))
+                time.sleep(delay)
+
+            try:
+                body = self._post(results)
+            except HTTPError as err:
+                errmsg = err.read().decode('utf-8', 'replace')
+                err.close()
+                self.logger.error("HTTP Error: %s" % err)
+                self.logger.error(errmsg)
+                # Don't retry client errors, except of "Too Many Requests"
+                if err.code < 500 and err.code != 429:
+                    return False
+            except (URLError, OSError) as exc:
+                self.logger.error("Upload error: %s" % exc)
+            else:
+                self.logger.error('Response: "%s"' % body)
+                return True
+        return False
+
+    def flush(self):
+        """Upload queued results.
+
+        Return the list of filenames of which all results were uploaded,
+        including the results which were skipped as duplicated. Results of
+        failed uploads can be added again.
+        """
+        sent = []
+        for batch in self.get_batches():
+            results = []
+            for filename, file_results, duplicates in batch:
+                results.extend(file_results)
+
+            self.logger.error("Upload %s results of %s files to %s"
+                              % (len(results), len(batch), self.url))
+            if not results or self.post(results):
+                self._sent.update(map(self.get_key, results))
+                sent.extend(batch)
+
+        uploaded = []
+        for filename, file_results, duplicates in sent:
+            missing = duplicates - self._sent
+            if missing:
+                self.logger.error("Results of %s not uploaded: %s duplicated "
+                                  "results were not uploaded"
+                                  % (filename, len(missing)))
+                continue
+            uploaded.append(filename)
+        self.entries.clear()
+        self._keys.clear()
+        return uploaded
+
+
+class CodespeedHandler(http.server.BaseHTTPRequestHandler):
+    def send_text(self, code, text):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse_results(self, body):
+        form = urllib.parse.parse_qs(body.decode('utf-8'))
+        results = json.loads(form['json'][0])
+        if not isinstance(results, list):
+            raise ValueError("json must be a list of results")
+        for result in results:
+            for key in RESULT_KEYS:
+                if key not in result:
+                    raise ValueError("result without %s key" % key)
+        return results
+
+    def do_POST(self):
+        server = self.server
+        if self.path != '/result/add/json/':
+            self.send_text(404, "Not found: %s" % self.path)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        with server.lock:
+            server.requests += 1
+            fail = (server.requests <= server.fail_requests)
+        if fail:
+            self.send_text(503, "Service unavailable")
+            return
+
+        try:
+            results = self.parse_results(body)
+        except (KeyError, ValueError) as exc:
+            self.send_text(400, "Invalid request: %s" % exc)
+            return
+
+        with server.lock:
+            server.results.extend(results)
+        # Codespeed response
+        self.send_text(202, "All result data saved successfully")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class CodespeedServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Local stand-in for the Codespeed result/add/json/ endpoint.
+
+    Received results are stored in the results list. The first fail_requests
+    requests fail with the HTTP error 503, to test retries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), fail_requests=0,
+                 verbose=False):
+        super().__init__(address, CodespeedHandler)
+        self.results = []
+        self.requests = 0
+        self.fail_requests = fail_requests
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+
+def cmd_codespeed_server(options):
+    server = CodespeedServer((options.host, options.port),
+                             fail_requests=options.fail_requests,
+                             verbose=True)
+    print("Codespeed stand-in listening on %s" % server.url)
+    print("Upload URL: %s" % get_upload_url(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    print()
+    print("Received %s results in %s requests"
+          % (len(server.results), server.requests))
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as fp:
+            json.dump(server.results, fp, indent=2)
+        print("Results written into %s" % options.output)
@@ -1,6 +1,8 @@
 import contextlib
 import errno
 import os
+import re
+import shutil
 import sys
 import tempfile
 
@@ -19,3 +21,175 @@ def temporary_file():
         except OSError as exc:
             if exc.errno != errno.ENOENT:
                 raise
+
+
+def get_cache_dir():
+    """Get the pyperformance directory of the user cache."""
+    cache_dir = os.environ.get('XDG_CACHE_HOME')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'pyperformance')
+
+
+def link_tree(src, dst):
+    """Recreate the src directory tree as dst using hard links.
+
+    Files are copied if hard links are not supported, for example if src
+    and dst are on different file systems. Symbolic links are copied as
+    symbolic links.
+    """
+    use_link = True
+    for dirpath, dirnames, filenames in os.walk(src):
+        dstpath = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(dstpath, exist_ok=True)
+        for name in dirnames + filenames:
+            srcname = os.path.join(dirpath, name)
+            dstname = os.path.join(dstpath, name)
+            if os.path.islink(srcname):
+                os.symlink(os.readlink(srcname), dstname)
+                continue
+            if name in dirnames:
+                continue
+            if use_link:
+                try:
+                    os.link(srcname, dstname)
+                    continue
+                except OSError:
+                    use_link = False
+            shutil.copy2(srcname, dstname)
+
+
+def copy_scripts(src, dst, old, new):
+    """Copy scripts of the src directory to dst, replacing old with new.
+
+    Only regular files starting with a shebang and containing old (bytes)
+    are copied: entry point scripts written by pip. Existing files of dst
+    are not replaced. Return the list of copied filenames.
+    """
+    copied = []
+    for name in sorted(os.listdir(src)):
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if (os.path.islink(srcname) or not os.path.isfile(srcname)
+                or os.path.exists(dstname)):
+            continue
+        with open(srcname, 'rb') as fp:
+            content = fp.read()
+        if not content.startswith(b'#!') or old not in content:
+            continue
+        os.makedirs(dst, exist_ok=True)
+        with open(dstname, 'wb') as fp:
+            fp.write(content.replace(old, new))
+        shutil.copymode(srcname, dstname)
+        copied.append(name)
+    return copied
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a CPU list like "0-3,6" into a sorted list of CPU numbers."""
+    cpus = set()
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            first = int(first)
+            last = int(last)
+            if last < first:
+                raise ValueError("invalid CPU range: %r" % part)
+            cpus.update(range(first, last + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """Format CPU numbers as a compact CPU list like "0-3,6"."""
+    parts = []
+    first = last = None
+    for cpu in sorted(cpus):
+        if first is None:
+            first = cpu
+        elif cpu != last + 1:
+            parts.append(str(first) if first == last
+                         else '%s-%s' % (first, last))
+            first = cpu
+        last = cpu
+    if first is not None:
+        parts.append(str(first) if first == last
+                     else '%s-%s' % (first, last))
+    return ','.join(parts)
+
+
+def parse_cpu_sets(text):
+    """Parse a list of CPU sets like "2-3,4-5".
+
+    Each comma-separated item is one CPU set: a single CPU or a range of
+    CPUs. Return a list of CPU lists formatted for the --affinity option.
+    """
+    cpu_sets = []
+    seen = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        cpus = parse_cpu_list(part)
+        if seen & set(cpus):
+            raise ValueError("CPU sets must not overlap: %s" % text)
+        seen.update(cpus)
+        cpu_sets.append(format_cpu_list(cpus))
+    return cpu_sets
+
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(text):
+    """Parse a duration like "90", "45s", "20m" or "1h30m" into seconds."""
+    text = text.strip().lower()
+    if text and all(char.isdigit() or char == '.' for char in text):
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError("invalid duration: %r" % text)
+
+    seconds = 0.0
+    number = ''
+    for char in text:
+        if char.isdigit() or char == '.':
+            number += char
+        elif char in _DURATION_UNITS and number:
+            try:
+                seconds += float(number) * _DURATION_UNITS[char]
+            except ValueError:
+                raise ValueError("invalid duration: %r" % text)
+            number = ''
+        else:
+            raise ValueError("invalid duration: %r" % text)
+    if number or not text:
+        raise ValueError("invalid duration: %r" % text)
+    return seconds
+
+
+def format_duration(seconds):
+    """Format a duration in seconds like "1h02m", "3m20s" or "45s"."""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%sh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "%sm%02ds" % (seconds // 60, seconds % 60)
+    return "%ss" % seconds
+
+
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+               't': 1024 ** 4}
+
+
+def parse_size(text):
+    """Parse a size like "500", "500M", "10G" or "1.5GB" into bytes."""
+    match = re.match(r'^([0-9]+(?:\.[0-9]*)?)\s*([kmgt]?)b?$',
+                     text.strip().lower())
+    if not match:
+        raise ValueError("invalid size: %r" % text)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
@@ -1,13 +1,15 @@
 import errno
+import json
 import os
+import re
 import shutil
 import subprocess
 import sys
 import textwrap
-import urllib.request
 from shlex import quote as shell_quote
 
 import pyperformance
+from pyperformance.utils import copy_scripts, get_cache_dir, link_tree
 
 
 GET_PIP_URL = 'https://bootstrap.pypa.io/get-pip.py'
@@ -15,6 +17,19 @@ REQ_OLD_PIP = 'pip==7.1.2'
 REQ_OLD_SETUPTOOLS = 'setuptools==18.5'
 
 PERFORMANCE_ROOT = os.path.realpath(os.path.dirname(__file__))
+# File of a venv store entry listing its site-packages directories
+STORE_PATHS_FILE = 'site-packages.json'
+# Directory of a venv store entry containing the entry point scripts,
+# the path of the virtual environment replaced with STORE_VENV_PLACEHOLDER
+STORE_SCRIPTS_DIR = 'scripts'
+STORE_VENV_PLACEHOLDER = b'@PYPERFORMANCE_VENV@'
+# Version of the venv store entry layout, part of the store key
+STORE_VERSION = '2'
+# File of a virtual environment listing the installed requirements
+INSTALLED_FILE = 'pyperformance-requirements.json'
+# Requirements of pyperformance itself, installed in all virtual environments
+# (FIXME: don't hardcode requirements)
+BASE_REQUIREMENTS = ('pyperf', 'psutil')
 
 
 def is_build_dir():
@@ -24,6 +39,15 @@ def is_build_dir():
     return os.path.exists(os.path.join(root_dir, 'setup.py'))
 
 
+def normalize_project_name(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def get_requirement_name(req):
+    # strip env markers and version
+    return re.split(r'[;=<>!~\[ ]', req, 1)[0]
+
+
 class Requirements(object):
     def __init__(self, filename, optional):
         # if pip or setuptools is updated:
@@ -50,25 +74,94 @@ class Requirements(object):
         # optional requirements
         self.optional = []
 
+        # normalized name => set of normalized names of the requirements
+        # which depend on it, from the "# via" comments of pip-compile
+        self.via = {}
+
+        optional = set(map(normalize_project_name, optional))
         with open(filename) as fp:
+            name = None
+            in_via = False
             for line in fp.readlines():
-                # strip comment
-                line = line.partition('#')[0]
-                line = line.rstrip()
-                if not line:
+                line, _, comment = line.partition('#')
+                line = line.strip()
+                comment = comment.strip()
+                if line:
+                    name = normalize_project_name(get_requirement_name(line))
+                    self.via[name] = set()
+                    in_via = False
+                    if name in optional:
+                        self.optional.append(line)
+                    else:
+                        self.req.append(line)
+                elif not comment:
+                    name = None
+
+                if name is None or not comment:
                     continue
-
-                # strip env markers
-                req = line.partition(';')[0]
-
-                # strip version
-                req = req.partition('==')[0]
-                req = req.partition('>=')[0]
-
-                if req in optional:
-                    self.optional.append(line)
-                else:
-                    self.req.append(line)
+                # "# via a, b" or "# via" followed by "#   a" comments
+                if comment.startswith('via'):
+                    in_via = True
+                    comment = comment[3:]
+                elif not in_via:
+                    continue
+                for parent in re.split(r'[\s,]+', comment):
+                    # ignore "-r requirements.in"
+                    if (not parent or parent.startswith('-')
+                            or parent.endswith(('.in', '.txt'))):
+                        continue
+                    self.via[name].add(normalize_project_name(parent))
+
+    def get_names(self):
+        return set(self.via)
+
+    def get_dependencies(self, names):
+        """Get the requirements needed by names, including names."""
+        deps = {}
+        for name, parents in self.via.items():
+            for parent in parents:
+                deps.setdefault(parent, set()).add(name)
+
+        result = set()
+        todo = [normalize_project_name(name) for name in names]
+        while todo:
+            name = todo.pop()
+            if name in result:
+                continue
+            if name not in self.via:
+                print("WARNING: %s is not a requirement of pyperformance"
+                      % name)
+                continue
+            result.add(name)
+            todo.extend(deps.get(name, ()))
+        return result
+
+    def select(self, names):
+        """Only keep names and their dependencies."""
+        names = self.get_dependencies(names)
+
+        def selected(line):
+            return normalize_project_name(get_requirement_name(line)) in names
+
+        self.req = list(filter(selected, self.req))
+        self.optional = list(filter(selected, self.optional))
+        return names
+
+
+def get_requirements():
+    filename = os.path.join(PERFORMANCE_ROOT, 'requirements.txt')
+    return Requirements(filename,
+                        # FIXME: don't hardcode requirements
+                        ['psutil', 'dulwich'])
+
+
+def list_wheels(wheelhouse):
+    """Get the normalized project names of the wheels of a wheelhouse."""
+    names = set()
+    for filename in os.listdir(wheelhouse):
+        if filename.endswith('.whl'):
+            names.add(normalize_project_name(filename.split('-', 1)[0]))
+    return names
 
 
 def safe_rmtree(path):
@@ -111,6 +204,10 @@ def get_venv_program(program):
     return path
 
 
+def get_venv_store_dir():
+    return os.path.join(get_cache_dir(), 'venvs')
+
+
 def create_environ(inherit_environ):
     env = {}
 
@@ -126,6 +223,9 @@ def create_environ(inherit_environ):
 
 
 def download(url, filename):
+    # Use lazy import: urllib.request is slow to import
+    import urllib.request
+
     response = urllib.request.urlopen(url)
     with response:
         content = response.read()
@@ -136,12 +236,28 @@ def download(url, filename):
 
 
 class VirtualEnvironment(object):
-    def __init__(self, options):
+    def __init__(self, options, requirements=None):
         self.options = options
+        # Names of the requirements of the benchmarks which will be run,
+        # or None to install all requirements
+        self.requirements = requirements
         self.python = options.python
         self._venv_path = options.venv
+        self.wheelhouse = getattr(options, 'wheelhouse', None)
+        if self.wheelhouse:
+            self.wheelhouse = os.path.abspath(self.wheelhouse)
+        self._venv_name = None
+        self._store_key = None
+        if getattr(options, 'no_venv_store', False):
+            self.store_dir = None
+        else:
+            self.store_dir = (getattr(options, 'venv_store', None)
+                              or get_venv_store_dir())
         self._pip_program = None
         self._force_old_pip = False
+        # Only virtual environments created by the venv module have the
+        # layout of virtual environments created from the store
+        self._can_store = False
 
     def get_python_program(self):
         venv_path = self.get_path()
@@ -201,37 +317,50 @@ class VirtualEnvironment(object):
             print("Command %s failed with exit code %s" % (cmd_str, exitcode))
         return (exitcode, stdout)
 
-    def get_path(self):
-        if self._venv_path is not None:
-            return self._venv_path
+    def _get_names(self):
+        if self._venv_name is not None:
+            return
 
+        # The venv name depends on the Python executable: each Python gets
+        # its own virtual environment. The store key only depends on the
+        # ABI and the requirements: Python builds sharing the same ABI share
+        # the installed requirements.
         script = textwrap.dedent("""
             import hashlib
+            import platform
             import sys
+            import sysconfig
 
             performance_version = sys.argv[1]
             requirements = sys.argv[2]
+            store_version = sys.argv[3]
+
+            with open(requirements, 'rb') as fp:
+                req_data = fp.read()
 
             data = performance_version + sys.executable + sys.version
+            data = data.encode('utf-8') + req_data
+            venv_sha1 = hashlib.sha1(data).hexdigest()
+
+            abi = (sys.implementation.cache_tag,
+                   sysconfig.get_config_var('SOABI'),
+                   sysconfig.get_config_var('EXT_SUFFIX'),
+                   sys.platform,
+                   platform.machine())
+            data = performance_version + store_version + repr(abi)
+            data = data.encode('utf-8') + req_data
+            store_sha1 = hashlib.sha1(data).hexdigest()
 
             pyver = sys.version_info
-
             implementation = sys.implementation.name.lower()
-
-            if not isinstance(data, bytes):
-                data = data.encode('utf-8')
-            with open(requirements, 'rb') as fp:
-                data += fp.read()
-            sha1 = hashlib.sha1(data).hexdigest()
-
-            name = ('%s%s.%s-%s'
-                    % (implementation, pyver.major, pyver.minor, sha1[:12]))
-            print(name)
+            prefix = '%s%s.%s' % (implementation, pyver.major, pyver.minor)
+            print('%s-%s' % (prefix, venv_sha1[:12]))
+            print('%s-%s' % (prefix, store_sha1[:12]))
         """)
 
         requirements = os.path.join(PERFORMANCE_ROOT, 'requirements.txt')
         cmd = (self.python, '-c', script,
-               pyperformance.__version__, requirements)
+               pyperformance.__version__, requirements, STORE_VERSION)
         proc = subprocess.Popen(cmd,
                                 stdout=subprocess.PIPE,
                                 universal_newlines=True)
@@ -240,9 +369,20 @@ class VirtualEnvironment(object):
             print("ERROR: failed to create the name of the virtual environment")
             sys.exit(1)
 
-        venv_name = stdout.rstrip()
-        self._venv_path = venv_path = os.path.join('venv', venv_name)
-        return venv_path
+        self._venv_name, self._store_key = stdout.split()
+
+    def get_path(self):
+        if self._venv_path is None:
+            self._get_names()
+            self._venv_path = os.path.join('venv', self._venv_name)
+        return self._venv_path
+
+    def get_store_path(self):
+        """Get the path of the venv store entry, or None if disabled."""
+        if self.store_dir is None:
+            return None
+        self._get_names()
+        return os.path.join(self.store_dir, self._store_key)
 
     def _get_pip_program(self):
         venv_path = self.get_path()
@@ -367,6 +507,7 @@ class VirtualEnvironment(object):
         ):
             ok = self._create_venv_cmd(cmd + [venv_path], install_pip)
             if ok:
+                self._can_store = install_pip
                 return True
 
             # Command failed: remove the directory
@@ -383,14 +524,80 @@ class VirtualEnvironment(object):
         venv_python = self.get_python_program()
         return os.path.exists(venv_python)
 
+    def _get_wheelhouse_args(self):
+        return ['--no-index', '--find-links', self.wheelhouse]
+
+    def _get_installed(self):
+        """Get the names of the installed requirements.
+
+        Return None if the virtual environment has all requirements
+        installed.
+        """
+        filename = os.path.join(self.get_path(), INSTALLED_FILE)
+        try:
+            with open(filename) as fp:
+                return set(json.load(fp))
+        except FileNotFoundError:
+            # Virtual environment created by an older pyperformance
+            return None
+
+    def _set_installed(self, names):
+        filename = os.path.join(self.get_path(), INSTALLED_FILE)
+        with open(filename, 'w') as fp:
+            json.dump(sorted(names), fp)
+
+    def _select_req(self, requirements):
+        if self.requirements is None:
+            return requirements.get_names()
+        return requirements.select(BASE_REQUIREMENTS
+                                   + tuple(self.requirements))
+
+    def _install_packages(self, requirements, pip_installers=()):
+        if self.wheelhouse:
+            # Requirements are pinned: install everything in a single pip
+            # command which only looks at the wheelhouse, not at the index
+            wheels = list_wheels(self.wheelhouse)
+            reqs = list(pip_installers) + requirements.req
+            for req in requirements.optional:
+                name = normalize_project_name(get_requirement_name(req))
+                if name in wheels:
+                    reqs.append(req)
+                else:
+                    print("WARNING: no %s wheel in the wheelhouse %s: "
+                          "don't install it" % (req, self.wheelhouse))
+
+            cmd = self.get_pip_program() + ['install', '-U']
+            cmd.extend(self._get_wheelhouse_args())
+            cmd.extend(reqs)
+            self.run_cmd(cmd)
+            return
+
+        pip_program = self.get_pip_program()
+
+        # install requirements
+        if requirements.req:
+            cmd = pip_program + ['install']
+            cmd.extend(requirements.req)
+            self.run_cmd(cmd)
+
+        # install optional requirements
+        for req in requirements.optional:
+            cmd = pip_program + ['install', '-U', req]
+            exitcode = self.run_cmd_nocheck(cmd)
+            if exitcode:
+                print("WARNING: failed to install %s" % req)
+                print()
+
     def _install_req(self):
         pip_program = self.get_pip_program()
+        requirements = get_requirements()
+        names = self._select_req(requirements)
 
-        # parse requirements
-        filename = os.path.join(PERFORMANCE_ROOT, 'requirements.txt')
-        requirements = Requirements(filename,
-                                    # FIXME: don't hardcode requirements
-                                    ['psutil', 'dulwich'])
+        if self.wheelhouse:
+            self._install_packages(requirements,
+                                   requirements.pip + requirements.installer)
+            self._set_installed(names)
+            return
 
         # Upgrade pip
         cmd = pip_program + ['install', '-U']
@@ -405,26 +612,40 @@ class VirtualEnvironment(object):
         cmd.extend(requirements.installer)
         self.run_cmd(cmd)
 
-        # install requirements
-        cmd = pip_program + ['install']
-        cmd.extend(requirements.req)
-        self.run_cmd(cmd)
+        self._install_packages(requirements)
+        self._set_installed(names)
 
-        # install optional requirements
-        for req in requirements.optional:
-            cmd = pip_program + ['install', '-U', req]
-            exitcode = self.run_cmd_nocheck(cmd)
-            if exitcode:
-                print("WARNING: failed to install %s" % req)
-                print()
+    def _install_missing_req(self):
+        installed = self._get_installed()
+        if installed is None:
+            return
+
+        requirements = get_requirements()
+        names = self._select_req(requirements)
+        missing = names - installed
+        if not missing:
+            return
+
+        print("Install requirements missing in the virtual environment "
+              "%s: %s" % (self.get_path(), ', '.join(sorted(missing))))
+        requirements.select(missing)
+        self._install_packages(requirements)
+        self._set_installed(installed | missing)
+
+    def _install_pyperformance(self):
+        pip_program = self.get_pip_program()
 
         # install pyperformance inside the virtual environment
+        cmd = pip_program + ['install']
+        if self.wheelhouse:
+            # setuptools is taken from the wheelhouse to build pyperformance
+            cmd.extend(self._get_wheelhouse_args())
         if is_build_dir():
             root_dir = os.path.dirname(PERFORMANCE_ROOT)
-            cmd = pip_program + ['install', '-e', root_dir]
+            cmd.extend(('-e', root_dir))
         else:
             version = pyperformance.__version__
-            cmd = pip_program + ['install', 'pyperformance==%s' % version]
+            cmd.append('pyperformance==%s' % version)
         self.run_cmd(cmd)
 
         # Display the pip version
@@ -435,24 +656,164 @@ class VirtualEnvironment(object):
         cmd = pip_program + ['freeze']
         self.run_cmd(cmd)
 
+    def _get_site_packages(self):
+        """Get site-packages directories, relative to the venv directory."""
+        venv_python = self.get_python_program()
+        code = ('import json, os, sys, sysconfig; '
+                'paths = sysconfig.get_paths(); '
+                'dirs = {paths["purelib"], paths["platlib"]}; '
+                'print(json.dumps(sorted(os.path.relpath(path, sys.prefix) '
+                'for path in dirs)))')
+        exitcode, stdout = self.get_output_nocheck(venv_python, '-c', code)
+        if exitcode:
+            return None
+        return json.loads(stdout)
+
+    def _get_scripts_dir(self):
+        """Get the scripts directory, relative to the venv directory."""
+        return os.path.relpath(os.path.dirname(self.get_python_program()),
+                               self.get_path())
+
+    def _create_from_store(self):
+        store_path = self.get_store_path()
+        if store_path is None or not os.path.isdir(store_path):
+            return False
+
+        try:
+            with open(os.path.join(store_path, STORE_PATHS_FILE)) as fp:
+                store_dirs = json.load(fp)
+        except (OSError, ValueError) as exc:
+            print("WARNING: invalid venv store entry %s: %s"
+                  % (store_path, exc))
+            return False
+        store_scripts = os.path.join(store_path, STORE_SCRIPTS_DIR)
+        if not os.path.isdir(store_scripts):
+            print("WARNING: invalid venv store entry %s: missing %s directory"
+                  % (store_path, STORE_SCRIPTS_DIR))
+            return False
+
+        venv_path = self.get_path()
+        print("Create the virtual environment from the venv store %s"
+              % store_path)
+        cmd = [self.python, '-m', 'venv', '--without-pip', venv_path]
+        ok = (self.run_cmd_nocheck(cmd) == 0)
+        if ok:
+            ok = (self._get_site_packages() == store_dirs)
+            if not ok:
+                print("WARNING: the venv store entry %s has a different "
+                      "layout" % store_path)
+        if ok:
+            self._get_python_version()
+            for path in store_dirs:
+                site_packages = os.path.join(venv_path, path)
+                shutil.rmtree(site_packages)
+                link_tree(os.path.join(store_path, path), site_packages)
+            # Entry point scripts contain the path of the venv
+            venv_abspath = os.path.abspath(venv_path).encode()
+            copy_scripts(store_scripts,
+                         os.path.join(venv_path, self._get_scripts_dir()),
+                         STORE_VENV_PLACEHOLDER, venv_abspath)
+            ok = (self.get_pip_program() is not None)
+        if ok:
+            self._set_installed(get_requirements().get_names())
+        if not ok:
+            safe_rmtree(venv_path)
+            return False
+
+        print()
+        return True
+
+    def _add_to_store(self):
+        """Copy site-packages directories and scripts into the venv store.
+
+        Errors are only logged: the store is only an optimization.
+        """
+        store_path = self.get_store_path()
+        # Only virtual environments with all requirements are stored
+        if (store_path is None or not self._can_store
+                or self.requirements is not None
+                or os.path.exists(store_path)):
+            return
+
+        dirs = self._get_site_packages()
+        if dirs is None:
+            return
+
+        venv_path = self.get_path()
+        tmp = '%s.tmp-%s' % (store_path, os.getpid())
+        try:
+            for path in dirs:
+                link_tree(os.path.join(venv_path, path),
+                          os.path.join(tmp, path))
+            # Store the entry point scripts installed by pip, the venv
+            # created from the store only contains its own scripts
+            venv_abspath = os.path.abspath(venv_path).encode()
+            os.makedirs(os.path.join(tmp, STORE_SCRIPTS_DIR))
+            copy_scripts(os.path.join(venv_path, self._get_scripts_dir()),
+                         os.path.join(tmp, STORE_SCRIPTS_DIR),
+                         venv_abspath, STORE_VENV_PLACEHOLDER)
+            with open(os.path.join(tmp, STORE_PATHS_FILE), 'w') as fp:
+                json.dump(dirs, fp)
+            # Rename the directory at the end to not use an incomplete
+            # entry if another process creates the same venv
+            os.rename(tmp, store_path)
+        except OSError as exc:
+            if not os.path.exists(store_path):
+                print("WARNING: failed to add the virtual environment "
+                      "to the venv store %s: %s" % (store_path, exc))
+        else:
+            print("Virtual environment added to the venv store %s"
+                  % store_path)
+            print()
+        finally:
+            safe_rmtree(tmp)
+
     def create(self):
         if self.exists():
+            self._install_missing_req()
             return
 
         venv_path = self.get_path()
 
         print("Creating the virtual environment %s" % venv_path)
         try:
-            self._create_venv()
-            self._install_req()
+            if not self._create_from_store():
+                self._create_venv()
+                self._install_req()
+                self._add_to_store()
+            self._install_pyperformance()
         except:   # noqa
             print()
             safe_rmtree(venv_path)
             raise
 
 
+def get_benchmark_requirements(options):
+    """Get the requirements of the benchmarks which will be run.
+
+    Return None if all requirements are needed.
+    """
+    if options.action not in ('run', 'profile'):
+        # compare only needs pyperf
+        return ()
+
+    # Use lazy import: only load the manifest to run benchmarks
+    from pyperformance.cli_list import get_benchmarks_to_run
+    try:
+        bench_funcs, bench_groups, should_run = get_benchmarks_to_run(options)
+    except ValueError:
+        # the run command reports the error
+        return None
+
+    requirements = set()
+    for name in should_run:
+        requirements.update(bench_funcs[name].requirements)
+    return sorted(requirements)
+
+
 def exec_in_virtualenv(options):
-    venv = VirtualEnvironment(options)
+    venv = VirtualEnvironment(options,
+                              requirements=get_benchmark_requirements(options))
 
     venv.create()
     venv_python = venv.get_python_program()
@@ -509,6 +870,15 @@ def cmd_venv(options):
             text += " (not created yet)"
         print(text)
 
+        store_path = venv.get_store_path()
+        if store_path is not None:
+            text = "Venv store entry: %s" % store_path
+            if os.path.exists(store_path):
+                text += " (already populated)"
+            else:
+                text += " (not populated yet)"
+            print(text)
+
         if not created:
             print()
             print("Command to create it:")
@@ -516,3 +886,35 @@ def cmd_venv(options):
             if options.venv:
                 cmd += " --venv=%s" % options.venv
             print(cmd)
+
+
+def cmd_wheelhouse(options):
+    wheelhouse = os.path.abspath(options.wheelhouse_dir)
+    requirements = get_requirements()
+    env = create_environ(options.inherit_environ)
+
+    def pip_wheel(reqs):
+        cmd = [options.python, '-m', 'pip', 'wheel',
+               '--wheel-dir', wheelhouse]
+        cmd.extend(reqs)
+        print("Execute: %s" % ' '.join(map(shell_quote, cmd)))
+        sys.stdout.flush()
+        return subprocess.call(cmd, env=env)
+
+    # Wheels of C extensions are specific to the Python ABI: build the
+    # wheelhouse with each Python used to create virtual environments
+    reqs = requirements.pip + requirements.installer + requirements.req
+    if not is_build_dir():
+        reqs.append('pyperformance==%s' % pyperformance.__version__)
+    if pip_wheel(reqs):
+        print("ERROR: failed to build wheels into %s" % wheelhouse)
+        sys.exit(1)
+    print()
+
+    for req in requirements.optional:
+        # Dependencies are pinned in requirements.txt
+        if pip_wheel(['--no-deps', req]):
+            print("WARNING: failed to build the %s wheel" % req)
+        print()
+
+    print("Wheelhouse %s built for %s" % (wheelhouse, options.python))
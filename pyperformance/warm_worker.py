@@ -0,0 +1,181 @@
+"""Warm worker: fork pyperf worker processes from a preloaded benchmark.
+
+Usage: python -m pyperformance.warm_worker [--hw-counters] RESPONSE_FD
+BM_SCRIPT [ARGS ...]
+
+The benchmark script is loaded once, without running its __main__ block,
+to import its dependencies. Then each line read from stdin is a JSON list of
+pyperf worker arguments: a child process is forked to run the benchmark
+script with these arguments, and a JSON line {"exitcode": ..., "result":
+..., "counters": ...} is written into RESPONSE_FD, where result is the JSON
+written by the pyperf worker into its pipe.
+
+With --hw-counters, the child process opens disabled hardware counters (see
+pyperformance.hw_counters), which are only enabled while pyperf calls the
+timed function of the benchmark, for warmups and values: the script
+execution, the pyperf setup and the loop calibration are not counted.
+counters is a dict {"counts": ..., "iterations": ..., "error": ...} where
+counts is a dict name => count, or null if counters cannot be opened, and
+iterations is the number of loop iterations counted.
+
+Only use the standard library: this module runs in the virtual environment.
+"""
+import json
+import os
+import runpy
+import sys
+import traceback
+
+
+def wrap_timed_loops(wrap):
+    """Wrap the functions called by pyperf workers for warmups and values.
+
+    wrap(task_func) returns the function called instead of task_func, with
+    the same (task, loops) arguments. The benchmark script is not wrapped:
+    module imports, the pyperf setup and the loop calibration are outside
+    the task functions of worker tasks run with --loops. Raise ImportError
+    if the pyperf version is not supported.
+    """
+    # pyperf has no hook around the timed calls: wrap the task function of
+    # its worker tasks
+    from pyperf._worker import WorkerTask
+
+    init = WorkerTask.__init__
+
+    def __init__(task, runner, name, task_func, func_metadata):
+        init(task, runner, name, wrap(task_func), func_metadata)
+
+    WorkerTask.__init__ = __init__
+
+
+class _TimedLoopsCounter(object):
+    """Enable hardware counters around the timed calls of pyperf workers."""
+
+    def __init__(self):
+        self.counters = None
+        self.error = None
+        self.iterations = 0
+
+    def install(self):
+        # Use lazy import: ctypes is only needed by --hw-counters
+        from pyperformance.hw_counters import HWCounters
+
+        try:
+            self.counters = HWCounters(enabled=False)
+        except OSError as exc:
+            self.error = str(exc)
+            return
+        try:
+            wrap_timed_loops(self.wrap)
+        except ImportError as exc:
+            self.counters.close()
+            self.counters = None
+            self.error = "unsupported pyperf version: %s" % exc
+
+    def wrap(self, task_func):
+        def counted_task_func(task, loops):
+            self.counters.enable()
+            try:
+                return task_func(task, loops)
+            finally:
+                self.counters.disable()
+                self.iterations += loops * (task.inner_loops or 1)
+        return counted_task_func
+
+    def dumps(self):
+        counts = self.counters.read() if self.counters is not None else None
+        return json.dumps({'counts': counts, 'iterations': self.iterations,
+                           'error': self.error})
+
+
+def _read_pipe(fd):
+    with open(fd, encoding='utf-8') as rfile:
+        return rfile.read()
+
+
+def fork_worker(bm_path, args, hw_counters=False):
+    rfd, wfd = os.pipe()
+    if hw_counters:
+        counters_rfd, counters_wfd = os.pipe()
+    # Flush buffers to not write them twice
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if not pid:
+        # child process
+        exitcode = 1
+        counter = None
+        try:
+            os.close(rfd)
+            if hw_counters:
+                os.close(counters_rfd)
+                counter = _TimedLoopsCounter()
+                counter.install()
+            sys.argv = [bm_path] + args + ['--pipe', str(wfd)]
+            runpy.run_path(bm_path, run_name='__main__')
+            exitcode = 0
+        except SystemExit as exc:
+            if exc.code is None:
+                exitcode = 0
+            elif isinstance(exc.code, int):
+                exitcode = exc.code
+            else:
+                print(exc.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            if counter is not None:
+                with open(counters_wfd, 'w', encoding='utf-8') as wfile:
+                    wfile.write(counter.dumps())
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+
+    os.close(wfd)
+    if hw_counters:
+        os.close(counters_wfd)
+    result = _read_pipe(rfd)
+    counters = None
+    if hw_counters:
+        counters = json.loads(_read_pipe(counters_rfd) or 'null')
+    status = os.waitpid(pid, 0)[1]
+    if os.WIFEXITED(status):
+        exitcode = os.WEXITSTATUS(status)
+    else:
+        exitcode = -os.WTERMSIG(status)
+    return (exitcode, result, counters)
+
+
+def serve(response_fd, bm_path, args, hw_counters=False):
+    # Mimic "python bm_script.py": the script directory is sys.path[0]
+    sys.path[0] = os.path.dirname(os.path.abspath(bm_path))
+    sys.argv = [bm_path] + args
+    # Import the benchmark dependencies: the __main__ block is not run
+    runpy.run_path(bm_path, run_name='__pyperformance_warm_worker__')
+
+    with open(response_fd, 'w', encoding='utf-8') as responses:
+        for line in sys.stdin:
+            request = json.loads(line)
+            exitcode, result, counters = fork_worker(bm_path,
+                                                     args + request,
+                                                     hw_counters)
+            response = {'exitcode': exitcode, 'result': result,
+                        'counters': counters}
+            responses.write(json.dumps(response) + '\n')
+            responses.flush()
+
+
+def main():
+    args = sys.argv[1:]
+    hw_counters = (args[:1] == ['--hw-counters'])
+    if hw_counters:
+        del args[0]
+    if len(args) < 2:
+        print("usage: %s [--hw-counters] RESPONSE_FD BM_SCRIPT [ARGS ...]"
+              % sys.argv[0], file=sys.stderr)
+        sys.exit(1)
+    serve(int(args[0]), args[1], args[2:], hw_counters)
+
+
+if __name__ == "__main__":
+    main()
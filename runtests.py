@@ -76,8 +76,8 @@ def run_tests(venv):
 
 def main():
     # Unit tests
-    cmd = [sys.executable,
-           os.path.join('pyperformance', 'tests', 'test_compare.py')]
+    cmd = [sys.executable, '-m', 'unittest', 'discover',
+           '-s', os.path.join('pyperformance', 'tests'), '-t', '.']
     run_cmd(cmd)
 
     # Functional tests
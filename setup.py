@@ -91,6 +91,7 @@ def main():
         for filename in filenames:
             filename = os.path.join(root, filename)
             benchmarks_data.append(filename)
+    benchmarks_data.append('manifest.ini')
     data['pyperformance.benchmarks'] = benchmarks_data
 
     options = {